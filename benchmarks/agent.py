@@ -0,0 +1,677 @@
+#!/usr/bin/env python
+
+"""
+Synthetic SNMP agent simulating a load balancer.
+
+The agent answers GET, GETNEXT, GETBULK and SET requests (SNMPv1 and
+SNMPv2c) over UDP from a MIB tree generated for one of the supported
+kinds of load balancer:
+
+ - alteon: ALTEON-CHEETAH-LAYER4-MIB
+ - f5: F5-BIGIP-LOCAL-MIB
+ - haproxy: EXCELIANCE-MIB
+ - keepalived: KEEPALIVED-MIB
+ - css: APENT-MIB with the Cisco base OID
+ - arrowpoint: APENT-MIB with the Arrowpoint base OID
+
+The size of the tree is set with the number of virtual servers, the
+number of real servers for each of them, the number of backups
+(backup groups for Alteon, backup servers for HAProxy, sorry servers
+for Keepalived and CSS) and the number of HTTP classes (F5 HTTP
+classes, additional HAProxy backends).
+
+Latency, loss and a maximum size of responses can be injected. A
+response larger than the maximum size is replaced by a tooBig error,
+including for GETBULK.
+
+Usage:
+ python benchmarks/agent.py [options] kind
+"""
+
+import sys
+import random
+import bisect
+import socket
+import optparse
+
+from twisted.internet import reactor, protocol
+from twisted.python import log
+
+# BER encoding
+
+INTEGER = 0x02
+OCTETSTRING = 0x04
+NULL = 0x05
+OID = 0x06
+SEQUENCE = 0x30
+IPADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+NOSUCHOBJECT = 0x80
+NOSUCHINSTANCE = 0x81
+ENDOFMIBVIEW = 0x82
+
+GET = 0xa0
+GETNEXT = 0xa1
+RESPONSE = 0xa2
+SET = 0xa3
+GETBULK = 0xa5
+
+TOOBIG = 1
+NOSUCHNAME = 2
+NOTWRITABLE = 17
+
+def encodeLength(length):
+    if length < 0x80:
+        return chr(length)
+    result = ""
+    while length:
+        result = chr(length & 0xff) + result
+        length >>= 8
+    return chr(0x80 | len(result)) + result
+
+def encode(tag, content):
+    return chr(tag) + encodeLength(len(content)) + content
+
+def encodeInteger(value, tag=INTEGER):
+    result = [value & 0xff]
+    value >>= 8
+    while not ((value == 0 and not result[0] & 0x80) or
+               (value == -1 and result[0] & 0x80)):
+        result.insert(0, value & 0xff)
+        value >>= 8
+    return encode(tag, "".join([chr(x) for x in result]))
+
+def encodeOid(oid):
+    result = [chr(40*oid[0] + oid[1])]
+    for o in oid[2:]:
+        chunk = [chr(o & 0x7f)]
+        o >>= 7
+        while o:
+            chunk.insert(0, chr(0x80 | (o & 0x7f)))
+            o >>= 7
+        result.extend(chunk)
+    return encode(OID, "".join(result))
+
+def encodeValue((tag, value)):
+    if tag in [INTEGER, COUNTER32, GAUGE32, TIMETICKS]:
+        return encodeInteger(value, tag)
+    if tag == OID:
+        return encodeOid(value)
+    if tag == IPADDRESS:
+        return encode(tag, socket.inet_aton(value))
+    if tag in [NULL, NOSUCHOBJECT, NOSUCHINSTANCE, ENDOFMIBVIEW]:
+        return encode(tag, "")
+    return encode(tag, value)
+
+def decode(data, pos=0):
+    """
+    Decode a TLV.
+
+    @return: (tag, content, position of the next TLV)
+    """
+    tag = ord(data[pos])
+    length = ord(data[pos+1])
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7f
+        length = 0
+        for c in data[pos:pos+n]:
+            length = (length << 8) | ord(c)
+        pos += n
+    return tag, data[pos:pos+length], pos+length
+
+def decodeInteger(content):
+    value = 0
+    for c in content:
+        value = (value << 8) | ord(c)
+    if content and ord(content[0]) & 0x80:
+        value -= 1 << (8*len(content))
+    return value
+
+def decodeOid(content):
+    first = ord(content[0])
+    oid = [first / 40, first % 40]
+    value = 0
+    for c in content[1:]:
+        value = (value << 7) | (ord(c) & 0x7f)
+        if not ord(c) & 0x80:
+            oid.append(value)
+            value = 0
+    return tuple(oid)
+
+def decodeSequence(content):
+    items = []
+    pos = 0
+    while pos < len(content):
+        tag, value, pos = decode(content, pos)
+        items.append((tag, value))
+    return items
+
+# Values stored in the MIB tree
+
+def integer(value):
+    return (INTEGER, value)
+
+def string(value):
+    return (OCTETSTRING, value)
+
+def ipaddress(value):
+    return (IPADDRESS, value)
+
+def counter(value):
+    return (COUNTER32, value)
+
+def gauge(value):
+    return (GAUGE32, value)
+
+def objectid(value):
+    return (OID, oidTuple(value))
+
+def oidTuple(oid):
+    if type(oid) is tuple:
+        return oid
+    return tuple([int(x) for x in oid.split(".") if x])
+
+def stroid(string):
+    """Index of a variable-length string"""
+    return (len(string),) + tuple([ord(c) for c in string])
+
+def ipoid(ip):
+    """Index of an IPv4 address prefixed by its type and its length"""
+    return (1, 4) + tuple([ord(c) for c in socket.inet_aton(ip)])
+
+def octets(ip):
+    return string(socket.inet_aton(ip))
+
+class MibTree:
+    """Sorted MIB tree"""
+
+    def __init__(self):
+        self.values = {}
+        self.keys = None
+
+    def add(self, base, index, value):
+        """
+        Add a value to the tree.
+
+        @param base: base OID (a string or a tuple)
+        @param index: index appended to the base OID (an integer or a tuple)
+        @param value: value as returned by L{integer}, L{string}, ...
+        """
+        if type(index) is not tuple:
+            index = (index,)
+        self.values[oidTuple(base) + index] = value
+        self.keys = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, oid):
+        return self.values.get(oid, None)
+
+    def next(self, oid):
+        """Return the next OID in the tree or C{None}"""
+        if self.keys is None:
+            self.keys = self.values.keys()
+            self.keys.sort()
+        i = bisect.bisect_right(self.keys, oid)
+        if i == len(self.keys):
+            return None
+        return self.keys[i]
+
+    def set(self, oid, value):
+        if oid not in self.values:
+            self.keys = None
+        self.values[oid] = value
+
+# Generators of MIB trees
+
+def vip(i):
+    return "10.0.%d.%d" % (i / 250, i % 250 + 1)
+
+def rip(i):
+    return "10.1.%d.%d" % (i / 250, i % 250 + 1)
+
+def system(tree, description, oid):
+    tree.add(".1.3.6.1.2.1.1.1", 0, string(description))
+    tree.add(".1.3.6.1.2.1.1.2", 0, objectid(oid))
+
+def alteon(vs, rs, backups, classes):
+    tree = MibTree()
+    system(tree, "Alteon Application Switch 3408",
+           ".1.3.6.1.4.1.1872.1.13.1.5")
+    base = ".1.3.6.1.4.1.1872.2.5.4"
+    reals = vs*rs + min(backups, vs)
+
+    def bitmap(servers):
+        result = [0] * ((reals + 8) / 8)
+        for r in servers:
+            i = (r - 1) / 8
+            result[i] |= 1 << (8 - (r - i*8))
+        return string("".join([chr(x) for x in result]))
+
+    def group(g, servers, backup):
+        tree.add(base + ".1.1.3.3.1.2", g, bitmap(servers))
+        tree.add(base + ".1.1.3.3.1.3", g, integer(1))
+        tree.add(base + ".1.1.3.3.1.4", g, integer(0))
+        tree.add(base + ".1.1.3.3.1.5", g, integer(backup))
+        tree.add(base + ".1.1.3.3.1.6", g, string("/"))
+        tree.add(base + ".1.1.3.3.1.7", g, integer(3))
+        tree.add(base + ".1.1.3.3.1.8", g, string("group%d" % g))
+        for r in servers:
+            tree.add(base + ".1.1.3.5.1.3", (g, r), integer(1))
+            tree.add(base + ".1.1.3.6.1.3", (g, r), integer(1))
+            tree.add(base + ".4.5.1.3", (g, r), integer(1))
+
+    for v in range(1, vs + 1):
+        tree.add(base + ".1.1.4.2.1.2", v, ipaddress(vip(v)))
+        tree.add(base + ".1.1.4.2.1.4", v, integer(2))
+        tree.add(base + ".1.1.4.2.1.10", v, string("vs%d" % v))
+        tree.add(base + ".1.1.4.5.1.3", (v, 1), integer(80))
+        tree.add(base + ".1.1.4.5.1.4", (v, 1), integer(v))
+        tree.add(base + ".1.1.4.5.1.5", (v, 1), integer(8080))
+        tree.add(base + ".1.1.4.5.1.6", (v, 1), integer(3))
+        tree.add(base + ".1.1.4.5.1.7", (v, 1), string("www%d" % v))
+        tree.add(base + ".1.1.4.5.1.16", (v, 1), integer(3))
+        servers = range((v - 1)*rs + 1, v*rs + 1)
+        for r in servers:
+            tree.add(base + ".3.4.1.6", (v, 1, r), integer(2))
+        if v <= backups:
+            group(v, servers, vs + v)
+            group(vs + v, [vs*rs + v], 0)
+        else:
+            group(v, servers, 0)
+    for r in range(1, reals + 1):
+        tree.add(base + ".1.1.2.2.1.2", r, ipaddress(rip(r)))
+        tree.add(base + ".1.1.2.2.1.3", r, integer(1))
+        tree.add(base + ".1.1.2.2.1.6", r, integer(0))
+        tree.add(base + ".1.1.2.2.1.7", r, integer(2))
+        tree.add(base + ".1.1.2.2.1.8", r, integer(4))
+        tree.add(base + ".1.1.2.2.1.9", r, integer(2))
+        tree.add(base + ".1.1.2.2.1.10", r, integer(2))
+        tree.add(base + ".1.1.2.2.1.12", r, string("real%d" % r))
+        tree.add(base + ".1.1.2.3.1.10", r, integer(2))
+        tree.add(base + ".2.2.1.4", r, counter(0))
+        tree.add(base + ".3.1.1.7", r, integer(2))
+        tree.add(base + ".4.1.1.2", r, integer(1))
+    return tree
+
+def f5(vs, rs, backups, classes):
+    tree = MibTree()
+    system(tree, "BIG-IP 6400", ".1.3.6.1.4.1.3375.2.1.3.4.1")
+    base = ".1.3.6.1.4.1.3375.2.2"
+    nodes = {}
+
+    def pool(name, first):
+        op = stroid(name)
+        tree.add(base + ".5.1.2.1.2", op, integer(0))
+        tree.add(base + ".5.5.2.1.2", op, integer(1))
+        tree.add(base + ".5.5.2.1.3", op, integer(1))
+        tree.add(base + ".5.5.2.1.5", op, string("The pool is available"))
+        for r in range(first, first + rs):
+            index = op + ipoid(rip(r)) + (8080,)
+            tree.add(base + ".5.3.2.1.6", index, integer(1))
+            tree.add(base + ".5.3.2.1.7", index, integer(1))
+            tree.add(base + ".5.3.2.1.8", index, integer(0))
+            tree.add(base + ".5.3.2.1.9", index, integer(1))
+            tree.add(base + ".5.3.2.1.12", index, integer(2))
+            tree.add(base + ".5.3.2.1.13", index, integer(1))
+            tree.add(base + ".5.3.2.1.14", index, string("http"))
+            tree.add(base + ".5.6.2.1.5", index, integer(1))
+            tree.add(base + ".5.6.2.1.6", index, integer(1))
+            tree.add(base + ".5.6.2.1.8", index,
+                     string("Pool member is available"))
+            nodes[r] = True
+
+    for v in range(1, vs + 1):
+        name = "vs%d" % v
+        ov = stroid(name)
+        tree.add(base + ".10.1.2.1.2", ov, integer(1))
+        tree.add(base + ".10.1.2.1.3", ov, octets(vip(v)))
+        tree.add(base + ".10.1.2.1.6", ov, integer(80))
+        tree.add(base + ".10.1.2.1.9", ov, integer(1))
+        tree.add(base + ".10.1.2.1.13", ov, integer(1))
+        tree.add(base + ".10.1.2.1.19", ov, string("pool%d" % v))
+        tree.add(base + ".10.5.2.1.3", ov + stroid("tcp"), integer(0))
+        tree.add(base + ".10.13.2.1.2", ov, integer(1))
+        tree.add(base + ".10.13.2.1.3", ov, integer(1))
+        tree.add(base + ".10.13.2.1.5", ov,
+                 string("The virtual server is available"))
+        pool("pool%d" % v, (v - 1)*rs + 1)
+        for c in range(1, classes + 1):
+            httpclass = "class%d-%d" % (v, c)
+            tree.add(base + ".10.12.2.1.2", ov + (c,), string(httpclass))
+            tree.add(base + ".6.15.1.2.1.4", stroid(httpclass),
+                     string("pool%d-%d" % (v, c)))
+            pool("pool%d-%d" % (v, c), vs*rs + ((v - 1)*classes + c - 1)*rs + 1)
+    for r in nodes:
+        tree.add(base + ".4.1.2.1.9", ipoid(rip(r)), integer(2))
+        tree.add(base + ".4.1.2.1.12", ipoid(rip(r)), string("node%d" % r))
+    return tree
+
+def haproxy(vs, rs, backups, classes):
+    tree = MibTree()
+    system(tree, "Linux haproxy 2.6.26-2-amd64 x86_64",
+           ".1.3.6.1.4.1.8072.3.2.10")
+    base = ".1.3.6.1.4.1.23263.4.2.1.3"
+    tree.add(base + ".1.1.1", 1, integer(1))
+    b = 0
+    s = 0
+    for f in range(1, vs + 1):
+        front = "front%d" % f
+        tree.add(base + ".2.1.3", (1, f), string("%s:80--%s" % (vip(f), front)))
+        tree.add(base + ".2.1.13", (1, f), string("OPEN"))
+        for name in [front] + ["%s--class%d" % (front, c)
+                               for c in range(1, classes + 1)]:
+            b += 1
+            tree.add(base + ".3.1.3", (1, b), string(name))
+            tree.add(base + ".3.1.20", (1, b), string("UP"))
+            tree.add(base + ".3.1.23", (1, b), integer(0))
+            for i in range(rs + backups):
+                s += 1
+                tree.add(base + ".4.1.4", (1, b, s),
+                         string("%s:8080--srv%d" % (rip(s), s)))
+                tree.add(base + ".4.1.19", (1, b, s), string("UP"))
+                tree.add(base + ".4.1.21", (1, b, s), integer(1))
+                tree.add(base + ".4.1.22", (1, b, s), integer(i < rs and 1 or 0))
+                tree.add(base + ".4.1.23", (1, b, s), integer(i >= rs and 1 or 0))
+                tree.add(base + ".4.1.26", (1, b, s), integer(0))
+    return tree
+
+def keepalived(vs, rs, backups, classes):
+    tree = MibTree()
+    system(tree, "Linux keepalived 2.6.26-2-amd64 x86_64",
+           ".1.3.6.1.4.1.8072.3.2.10")
+    tree.add(".1.3.6.1.4.1.9586.100.5.1.1", 0, string("Keepalived v1.1.17"))
+    base = ".1.3.6.1.4.1.9586.100.5.3"
+    s = 0
+    for v in range(1, vs + 1):
+        tree.add(base + ".3.1.2", v, integer(2))
+        tree.add(base + ".3.1.5", v, integer(1))
+        tree.add(base + ".3.1.6", v, octets(vip(v)))
+        tree.add(base + ".3.1.7", v, integer(80))
+        tree.add(base + ".3.1.8", v, integer(1))
+        tree.add(base + ".3.1.9", v, integer(2))
+        tree.add(base + ".3.1.10", v, integer(1))
+        tree.add(base + ".3.1.11", v, integer(1))
+        tree.add(base + ".3.1.12", v, string("www%d" % v))
+        tree.add(base + ".3.1.13", v, integer(2))
+        tree.add(base + ".3.1.16", v, integer(10))
+        tree.add(base + ".3.1.20", v, integer(rs))
+        tree.add(base + ".3.1.21", v, integer(rs))
+        tree.add(base + ".3.1.22", v, integer(1))
+        tree.add(base + ".3.1.23", v, integer(1))
+        tree.add(base + ".3.1.26", v, integer(0))
+        for r in range(1, rs + backups + 1):
+            s += 1
+            tree.add(base + ".4.1.2", (v, r), integer(r <= rs and 1 or 2))
+            tree.add(base + ".4.1.3", (v, r), integer(1))
+            tree.add(base + ".4.1.4", (v, r), octets(rip(s)))
+            tree.add(base + ".4.1.5", (v, r), integer(8080))
+            tree.add(base + ".4.1.6", (v, r), integer(1))
+            tree.add(base + ".4.1.7", (v, r), integer(1))
+            tree.add(base + ".4.1.8", (v, r), integer(0))
+            tree.add(base + ".4.1.9", (v, r), integer(0))
+            tree.add(base + ".4.1.10", (v, r), integer(1))
+            tree.add(base + ".4.1.13", (v, r), counter(0))
+    return tree
+
+def apent(baseoid, description, oid):
+
+    def generate(vs, rs, backups, classes):
+        tree = MibTree()
+        system(tree, description, oid)
+        base = baseoid
+
+        def service(name, r):
+            os = stroid(name)
+            tree.add(base + ".1.15.2.1.3", os, ipaddress(rip(r)))
+            tree.add(base + ".1.15.2.1.4", os, integer(6))
+            tree.add(base + ".1.15.2.1.5", os, integer(8080))
+            tree.add(base + ".1.15.2.1.6", os, integer(4))
+            tree.add(base + ".1.15.2.1.7", os, integer(5))
+            tree.add(base + ".1.15.2.1.8", os, integer(3))
+            tree.add(base + ".1.15.2.1.9", os, integer(5))
+            tree.add(base + ".1.15.2.1.10", os, string(""))
+            tree.add(base + ".1.15.2.1.12", os, integer(1))
+            tree.add(base + ".1.15.2.1.16", os, integer(1))
+            tree.add(base + ".1.15.2.1.17", os, integer(4))
+            tree.add(base + ".1.15.2.1.31", os, integer(8080))
+
+        for v in range(1, vs + 1):
+            index = stroid("owner%d" % ((v - 1) / 10 + 1)) + stroid("content%d" % v)
+            sorry = ""
+            if v <= backups:
+                sorry = "sorry%d" % v
+                service(sorry, vs*rs + v)
+            tree.add(base + ".1.16.4.1.4", index, ipaddress(vip(v)))
+            tree.add(base + ".1.16.4.1.5", index, integer(6))
+            tree.add(base + ".1.16.4.1.6", index, integer(80))
+            tree.add(base + ".1.16.4.1.7", index, string("/*"))
+            tree.add(base + ".1.16.4.1.8", index, integer(1))
+            tree.add(base + ".1.16.4.1.9", index, integer(1))
+            tree.add(base + ".1.16.4.1.11", index, integer(1))
+            tree.add(base + ".1.16.4.1.15", index, integer(1))
+            tree.add(base + ".1.16.4.1.43", index, integer(1))
+            tree.add(base + ".1.16.4.1.58", index, string(sorry))
+            tree.add(base + ".1.16.4.1.59", index, string(""))
+            for r in range((v - 1)*rs + 1, v*rs + 1):
+                name = "service%d" % r
+                service(name, r)
+                tree.add(base + ".1.18.2.1.3", index + stroid(name), string(name))
+        return tree
+
+    return generate
+
+kinds = {
+    'alteon': alteon,
+    'f5': f5,
+    'haproxy': haproxy,
+    'keepalived': keepalived,
+    'css': apent(".1.3.6.1.4.1.9.9.368", "Content Switch SW Version 7.50",
+                 ".1.3.6.1.4.1.9.9.368.4.1"),
+    'arrowpoint': apent(".1.3.6.1.4.1.2467", "Content Switch SW Version 5.00",
+                        ".1.3.6.1.4.1.2467.4.1"),
+    }
+
+# Agent
+
+class SimulatedAgent(protocol.DatagramProtocol):
+    """
+    SNMP agent answering from a MIB tree.
+
+    @ivar pdus: number of requests received
+    @ivar varbinds: number of varbinds sent in responses
+    """
+
+    def __init__(self, tree, community="public", wcommunity="private",
+                 latency=0, loss=0, toobig=None):
+        """
+        @param tree: a L{MibTree}
+        @param community: community for read requests
+        @param wcommunity: community for SET requests
+        @param latency: delay in seconds before answering
+        @param loss: probability to drop a request
+        @param toobig: maximum size of a response in bytes
+        """
+        self.tree = tree
+        self.community = community
+        self.wcommunity = wcommunity
+        self.latency = latency
+        self.loss = loss
+        self.toobig = toobig
+        self.reset()
+
+    def reset(self):
+        self.pdus = 0
+        self.varbinds = 0
+        self.dropped = 0
+
+    def datagramReceived(self, data, addr):
+        try:
+            response = self.handle(data)
+        except (IndexError, ValueError):
+            log.msg("Unable to decode request from %s:%d" % addr)
+            return
+        if response is None:
+            return
+        if self.loss and random.random() < self.loss:
+            self.dropped += 1
+            return
+        if self.latency:
+            reactor.callLater(self.latency, self.transport.write, response, addr)
+        else:
+            self.transport.write(response, addr)
+
+    def handle(self, data):
+        """
+        Handle a request.
+
+        @return: the response to send or C{None}
+        """
+        tag, message, _ = decode(data)
+        (_, version), (_, community), (pdutype, pdu) = decodeSequence(message)
+        version = decodeInteger(version)
+        (_, reqid), (_, a), (_, b), (_, varbinds) = decodeSequence(pdu)
+        a, b = decodeInteger(a), decodeInteger(b)
+        oids = []
+        for _, varbind in decodeSequence(varbinds):
+            (_, oid), value = decodeSequence(varbind)
+            oids.append((decodeOid(oid), value))
+        if community not in [self.community, self.wcommunity]:
+            return None
+        self.pdus += 1
+
+        status, index = 0, 0
+        if pdutype == GET:
+            results, status, index = self.get([o for o, v in oids], version)
+        elif pdutype == GETNEXT:
+            results, status, index = self.getnext([o for o, v in oids], version)
+        elif pdutype == GETBULK and version == 1:
+            results = self.getbulk([o for o, v in oids], a, b)
+        elif pdutype == SET:
+            results, status, index = self.set(oids, community)
+        else:
+            return None
+        if status:
+            # Original varbinds are sent back with an error
+            results = [(o, (NULL, None)) for o, v in oids]
+        response = self.response(version, community, reqid,
+                                 status, index, results)
+        if self.toobig is not None and len(response) > self.toobig:
+            response = self.response(version, community, reqid, TOOBIG, 0,
+                                     [(o, (NULL, None)) for o, v in oids])
+        else:
+            self.varbinds += len(results)
+        return response
+
+    def response(self, version, community, reqid, status, index, results):
+        varbinds = "".join([encode(SEQUENCE, encodeOid(o) + encodeValue(v))
+                            for o, v in results])
+        pdu = encode(RESPONSE,
+                     encode(INTEGER, reqid) +
+                     encodeInteger(status) +
+                     encodeInteger(index) +
+                     encode(SEQUENCE, varbinds))
+        return encode(SEQUENCE,
+                      encodeInteger(version) +
+                      encode(OCTETSTRING, community) +
+                      pdu)
+
+    def get(self, oids, version):
+        results = []
+        for i in range(len(oids)):
+            value = self.tree.get(oids[i])
+            if value is None:
+                if version == 0:
+                    return [], NOSUCHNAME, i + 1
+                value = (NOSUCHINSTANCE, None)
+            results.append((oids[i], value))
+        return results, 0, 0
+
+    def getnext(self, oids, version):
+        results = []
+        for i in range(len(oids)):
+            oid = self.tree.next(oids[i])
+            if oid is None:
+                if version == 0:
+                    return [], NOSUCHNAME, i + 1
+                results.append((oids[i], (ENDOFMIBVIEW, None)))
+            else:
+                results.append((oid, self.tree.get(oid)))
+        return results, 0, 0
+
+    def getbulk(self, oids, nonrepeaters, maxrepetitions):
+        results = self.getnext(oids[:nonrepeaters], 1)[0]
+        current = list(oids[nonrepeaters:])
+        for r in range(maxrepetitions):
+            if not current:
+                break
+            for i in range(len(current)):
+                oid = self.tree.next(current[i])
+                if oid is None:
+                    results.append((current[i], (ENDOFMIBVIEW, None)))
+                else:
+                    results.append((oid, self.tree.get(oid)))
+                    current[i] = oid
+            if len([v for o, v in results[-len(current):]
+                    if v[0] == ENDOFMIBVIEW]) == len(current):
+                break
+        return results
+
+    def set(self, oids, community):
+        if community != self.wcommunity:
+            return [], NOTWRITABLE, 1
+        results = []
+        for oid, value in oids:
+            tag, content, _ = decode(value)
+            if tag == INTEGER:
+                value = integer(decodeInteger(content))
+            else:
+                value = (tag, content)
+            self.tree.set(oid, value)
+            results.append((oid, value))
+        return results, 0, 0
+
+def options(parser):
+    """Add options describing the agent to the given parser"""
+    parser.add_option("--vs", type="int", default=100,
+                      help="number of virtual servers")
+    parser.add_option("--rs", type="int", default=10,
+                      help="number of real servers for each virtual server")
+    parser.add_option("--backups", type="int", default=10,
+                      help="number of backup groups, servers or sorry servers")
+    parser.add_option("--classes", type="int", default=2,
+                      help="number of HTTP classes or additional backends")
+    parser.add_option("--latency", type="float", default=0,
+                      help="delay before answering, in seconds")
+    parser.add_option("--loss", type="float", default=0,
+                      help="probability to drop a request")
+    parser.add_option("--toobig", type="int", default=None,
+                      help="maximum size of a response, in bytes")
+    parser.add_option("--community", default="public",
+                      help="community for read requests")
+
+def build(kind, opts):
+    """Build an agent for the given kind from parsed options"""
+    tree = kinds[kind](opts.vs, opts.rs, opts.backups, opts.classes)
+    return SimulatedAgent(tree, opts.community,
+                          latency=opts.latency, loss=opts.loss,
+                          toobig=opts.toobig)
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(
+        usage="%%prog [options] {%s}" % "|".join(sorted(kinds.keys())))
+    options(parser)
+    parser.add_option("--port", type="int", default=1161,
+                      help="UDP port to listen to")
+    opts, args = parser.parse_args()
+    if len(args) != 1 or args[0] not in kinds:
+        parser.error("a kind of load balancer is expected")
+    agent = build(args[0], opts)
+    log.startLogging(sys.stdout)
+    log.msg("%d OID for %s on port %d" % (len(agent.tree), args[0], opts.port))
+    reactor.listenUDP(opts.port, agent, interface="127.0.0.1")
+    reactor.run()
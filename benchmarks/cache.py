@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""
+Microbenchmark for the OID cache of the SNMP proxy.
+
+A walk of a table with several columns is stored into the cache, then
+subtrees are queried as collectors do with C{self.cache(...)}. The
+same lookups are done with the previous implementation scanning the
+whole cache.
+
+Usage: python benchmarks/cache.py [number of entries]
+"""
+
+import sys
+import time
+
+from qcss3.collector.proxy import OidCache
+
+def scan(cache, oid):
+    """Previous implementation: scan the whole cache for a prefix"""
+
+    def str2tuple(oid):
+        oid = tuple([int(o) for o in oid.split(".")])
+        if len(oid) == 1:
+            return oid[0]
+        return oid
+
+    c = cache.get(oid, None)
+    if c is not None:
+        return c
+    r = [(str2tuple(c[(len(oid)+1):]), cache[c])
+         for c in cache
+         if c.startswith("%s." % oid)]
+    if not r:
+        raise KeyError("%r is not available in cache" % oid)
+    return dict(r)
+
+def walk(entries, columns=10, width=10):
+    """
+    Build the result of a walk of a table.
+
+    The table is indexed by two integers, like a table of real
+    servers indexed by virtual server and real server. Lookups are
+    made for whole columns and for the real servers of some virtual
+    servers.
+    """
+    table = ".1.3.6.1.4.1.1872.2.5.4.1.1.2.2.1"
+    rows = entries / columns / width
+    results = {}
+    for c in range(1, columns + 1):
+        for r in range(1, rows + 1):
+            for w in range(1, width + 1):
+                results["%s.%d.%d.%d" % (table, c, r, w)] = w
+    lookups = ["%s.%d" % (table, c) for c in range(1, columns + 1)]
+    for c in range(1, columns + 1):
+        lookups.extend(["%s.%d.%d" % (table, c, r)
+                        for r in range(1, rows + 1, rows/100 or 1)])
+    return results, lookups
+
+def bench(name, f, lookups):
+    start = time.time()
+    for l in lookups:
+        f(l)
+    elapsed = time.time() - start
+    print "%-10s %6d lookups in %.3f second(s)" % (name, len(lookups), elapsed)
+    return elapsed
+
+if __name__ == "__main__":
+    entries = len(sys.argv) > 1 and int(sys.argv[1]) or 100000
+    results, lookups = walk(entries)
+
+    start = time.time()
+    cache = OidCache()
+    cache.update(results)
+    cache.get(lookups[0])
+    print "Index of %d entries built in %.3f second(s)" % (len(cache),
+                                                          time.time() - start)
+    for l in lookups:
+        assert cache.get(l) == scan(results, l)
+
+    old = bench("scan", lambda l: scan(results, l), lookups)
+    new = bench("index", cache.get, lookups)
+    print "Speedup: %.1fx" % (old / new)
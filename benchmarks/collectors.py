@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of collectors against synthetic SNMP agents.
+
+For each kind of load balancer, a synthetic agent (see
+C{benchmarks/agent.py}) is started and a full refresh is done with
+L{LoadBalancerCollector.refresh} in a child process. Results are
+written to a database discarding everything. Wall time, number of
+PDU received by the agent, number of SQL statements and peak memory
+of the child process are reported.
+
+The compiled SNMP module is needed.
+
+Usage:
+ python benchmarks/collectors.py [options] [kind ...]
+"""
+
+import os
+import sys
+import time
+import optparse
+import resource
+
+from twisted.internet import defer, reactor, utils
+
+import agent
+
+class NullTransaction:
+    """Transaction discarding everything"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def execute(self, *args, **kwargs):
+        self.pool.statements += 1
+
+    def fetchall(self):
+        return []
+
+class NullPool:
+    """Database pool discarding everything but counting statements"""
+
+    def __init__(self):
+        self.statements = 0
+
+    def runQuery(self, *args, **kwargs):
+        self.statements += 1
+        return defer.succeed([])
+
+    def runOperation(self, *args, **kwargs):
+        self.statements += 1
+        return defer.succeed(None)
+
+    def runInteraction(self, interaction, *args, **kwargs):
+        return defer.maybeDeferred(interaction, NullTransaction(self),
+                                   *args, **kwargs)
+
+def collect(address, community, config):
+    """
+    Refresh a load balancer and print the results (child process).
+
+    @param address: C{host:port} of the agent
+    @param community: community of the agent
+    @param config: collector configuration
+    """
+    from qcss3.collector.service import CollectorService, LoadBalancerCollector
+
+    dbpool = NullPool()
+    service = CollectorService(config, dbpool)
+    collector = LoadBalancerCollector("bench", address, community, None,
+                                      config, dbpool, service.plugins)
+    start = time.time()
+    d = collector.refresh()
+
+    def done(x):
+        print "RESULT %f %d %d" % (time.time() - start,
+                                   resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                   dbpool.statements)
+
+    def failed(x):
+        print "ERROR %s" % x.getErrorMessage()
+
+    d.addCallbacks(done, failed)
+    d.addBoth(lambda x: reactor.stop())
+    reactor.run()
+
+@defer.deferredGenerator
+def benchmark(kinds, opts):
+    print "%-11s %9s %9s %8s %9s %10s" % ("collector", "OID", "time (s)",
+                                         "PDU", "SQL", "peak (KiB)")
+    for kind in kinds:
+        simulated = agent.build(kind, opts)
+        port = reactor.listenUDP(0, simulated, interface="127.0.0.1")
+        args = [os.path.abspath(__file__),
+                "--collect", "127.0.0.1:%d" % port.getHost().port,
+                "--community", opts.community,
+                "--bulk", str(opts.bulk)]
+        d = defer.waitForDeferred(utils.getProcessOutputAndValue(
+                sys.executable, args, env=os.environ))
+        yield d
+        out, err, code = d.getResult()
+        yield defer.waitForDeferred(defer.maybeDeferred(port.stopListening))
+        results = [l.split() for l in out.split("\n")
+                   if l.startswith("RESULT ") or l.startswith("ERROR ")]
+        if code != 0 or not results or results[-1][0] != "RESULT":
+            print "%-11s failed: %s" % (kind,
+                                        results and " ".join(results[-1][1:])
+                                        or err.strip().split("\n")[-1])
+            continue
+        wall, rss, statements = results[-1][1:]
+        print "%-11s %9d %9.3f %8d %9d %10d" % (kind, len(simulated.tree),
+                                               float(wall), simulated.pdus,
+                                               int(statements), int(rss))
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(
+        usage="%%prog [options] [%s ...]" % "|".join(sorted(agent.kinds.keys())))
+    agent.options(parser)
+    parser.add_option("--bulk", type="int", default=1,
+                      help="use GETBULK requests (1) or not (0)")
+    parser.add_option("--collect", metavar="HOST:PORT",
+                      help="refresh the given agent (used internally)")
+    opts, args = parser.parse_args()
+    config = {"bulk": bool(opts.bulk)}
+    if opts.collect:
+        collect(opts.collect, opts.community, config)
+        sys.exit(0)
+    for kind in args:
+        if kind not in agent.kinds:
+            parser.error("unknown kind of load balancer: %s" % kind)
+    d = benchmark(args or sorted(agent.kinds.keys()), opts)
+    d.addErrback(lambda x: x.printTraceback())
+    d.addBoth(lambda x: reactor.stop())
+    reactor.run()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+Replay a recorded SNMP session against collectors.
+
+A recording made with the C{record} option of the collector is
+replayed with L{LoadBalancerCollector.refresh}: requests are answered
+from the recording with the recorded latency multiplied by the given
+scale (0 to answer at once). Results are written to a database
+discarding everything. Plugins detected during the recording are
+used.
+
+Wall time and the number of replayed requests are reported. With
+C{--profile}, the refresh is run under cProfile and the most
+expensive functions are displayed.
+
+Usage:
+ python benchmarks/replay.py [options] recording
+"""
+
+import sys
+import time
+import optparse
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from twisted.internet import defer, reactor
+
+from qcss3.collector.service import CollectorService, LoadBalancerCollector
+from qcss3.collector.recording import Recording, ReplayAgentProxy
+
+from collectors import NullPool
+
+class ReplayPool(NullPool):
+    """Database pool answering with plugins found in the recording"""
+
+    def __init__(self, recording):
+        NullPool.__init__(self)
+        self.recording = recording
+
+    def runQuery(self, query, *args, **kwargs):
+        self.statements += 1
+        trailer = self.recording.trailer
+        if "FROM plugin" in query and "plugins" in trailer:
+            return defer.succeed([(trailer['oid'],
+                                   md5(trailer['description']).hexdigest(),
+                                   trailer['plugins'])])
+        return defer.succeed([])
+
+class ReplayCollector(LoadBalancerCollector):
+    """Collector using a proxy replaying a recording"""
+
+    def __init__(self, recording, scale, *args):
+        LoadBalancerCollector.__init__(self, *args)
+        self.recording = recording
+        self.scale = scale
+
+    def buildProxy(self):
+        return ReplayAgentProxy(self.recording, self.scale)
+
+@defer.deferredGenerator
+def replay(recording, opts):
+    header = recording.header
+    print "%s: %d requests recorded in %.3f s" % (
+        header['lb'], len(recording.requests),
+        max([0] + [offset + duration
+                   for offset, duration, _, _, _, _ in recording.requests]))
+    pool = ReplayPool(recording)
+    service = CollectorService({}, pool)
+    for i in range(opts.times):
+        recording.rewind()
+        collector = ReplayCollector(recording, opts.scale,
+                                    header['lb'], header['ip'], "public", None,
+                                    {}, pool, service.plugins)
+        start = time.time()
+        d = defer.waitForDeferred(collector.refresh(header.get('vs'),
+                                                    header.get('rs'),
+                                                    header.get('status', False)))
+        yield d
+        d.getResult()
+        print "replay %d: %.3f s, %d requests replayed, %d not recorded" % (
+            i + 1, time.time() - start, recording.replayed, recording.misses)
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] recording")
+    parser.add_option("--scale", type="float", default=1.,
+                      help="factor applied to recorded latency, 0 to answer at once")
+    parser.add_option("--times", type="int", default=1,
+                      help="number of replays")
+    parser.add_option("--profile", type="int", default=0, metavar="N",
+                      help="profile replays and display the N most expensive functions")
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("a recording is expected")
+    recording = Recording(args[0])
+
+    def run():
+        d = replay(recording, opts)
+        d.addErrback(lambda x: x.printTraceback())
+        d.addBoth(lambda x: reactor.stop())
+        reactor.run()
+
+    if opts.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.runcall(run)
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats(
+            "cumulative").print_stats(opts.profile)
+    else:
+        run()
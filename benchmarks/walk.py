@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the walk path with OID as strings or as tuples.
+
+Without argument, responses of an agent are replayed: the walk and
+the storage of results into the cache of the proxy are measured with
+OID returned as strings (the default) and as tuples of integers
+(C{tupleoids}).
+
+With arguments, a real agent is walked with each combination of
+C{tupleoids} and C{direct}. This includes the cost of the SNMP
+module.
+
+Usage:
+ python benchmarks/walk.py [number of entries]
+ python benchmarks/walk.py host community oid [times]
+"""
+
+import sys
+import time
+import bisect
+
+from twisted.internet import defer, reactor
+
+from qcss3.collector.proxy import Walker, OidCache, AgentProxy, translateOid
+
+class ReplayProxy:
+    """
+    Proxy answering GETBULK requests from a table.
+
+    Answers are delivered when L{run} is called, like the reactor would.
+    """
+
+    def __init__(self, table, tuples, maxrep=50):
+        self.table = table
+        self.keys = [t for t, s, v in table]
+        self.tuples = tuples
+        self.maxrep = maxrep
+        self.pending = []
+
+    def getbulk(self, oid):
+        start = bisect.bisect_right(self.keys, tuple(translateOid(oid)))
+        r = {}
+        for t, s, v in self.table[start:start+self.maxrep]:
+            r[self.tuples and t or s] = v
+        d = defer.Deferred()
+        self.pending.append((d, r))
+        return d
+
+    def run(self):
+        while self.pending:
+            d, r = self.pending.pop(0)
+            d.callback(r)
+
+def replay(entries):
+    base = ".1.3.6.1.4.1.1872.2.5.4.1.1.2.2.1"
+    table = []
+    for i in range(1, entries + 1):
+        t = tuple(translateOid(base)) + (i % 10 + 1, i / 10, i % 7)
+        table.append((t, ".%s" % ".".join([str(x) for x in t]), i))
+    table.sort()
+    for tuples in [False, True]:
+        proxy = ReplayProxy(table, tuples)
+        cache = OidCache(tuples)
+        start = time.time()
+        d = Walker(proxy, base)()
+        d.addCallback(cache.update)
+        proxy.run()
+        cache.get("%s.1" % base)
+        print "%-8s %d entries walked and cached in %.3f second(s)" % (
+            tuples and "tuples" or "strings", len(cache), time.time() - start)
+
+@defer.deferredGenerator
+def live(host, community, oid, times):
+    for tupleoids in [False, True]:
+        for direct in [False, True]:
+            elapsed = 0
+            for i in range(times):
+                proxy = AgentProxy(host, community, 2,
+                                   tupleoids=tupleoids, direct=direct)
+                start = time.time()
+                d = defer.waitForDeferred(proxy.walk(oid))
+                yield d
+                results = d.getResult()
+                proxy.cache(oid)
+                elapsed += time.time() - start
+            print "tupleoids=%d direct=%d: %d entries in %.3f second(s)" % (
+                tupleoids, direct, len(results), elapsed / times)
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 2:
+        replay(len(sys.argv) > 1 and int(sys.argv[1]) or 100000)
+    else:
+        d = live(sys.argv[1], sys.argv[2], sys.argv[3],
+                 len(sys.argv) > 4 and int(sys.argv[4]) or 5)
+        d.addErrback(lambda x: x.printTraceback())
+        d.addBoth(lambda x: reactor.stop())
+        reactor.run()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of database writers.
+
+A large synthetic load balancer is written to a PostgreSQL database
+with the row writer (L{IDatabaseWriter}) and with the staging writer
+(L{IDatabaseBulkWriter}). Each writer is run three times: to seed an
+empty load balancer, to write the same load balancer again and to
+write it with some real servers having a new state and a new extra
+value. Then, the operational state of those real servers is set back
+with L{IDatabaseStatusWriter}. Wall time and number of SQL statements
+are reported.
+
+After each write, live rows are counted to check that no real server
+and no extra value has been lost.
+
+The database should use the schema from C{doc/database.sql}. Rows of
+the load balancers used by the benchmark (C{bench-rows} and
+C{bench-staging}) are removed at the end.
+
+Usage:
+ python benchmarks/writers.py [options]
+"""
+
+import time
+import optparse
+
+import psycopg2
+
+from qcss3.collector.datastore import LoadBalancer, VirtualServer, RealServer
+from qcss3.collector.database import IDatabaseWriter, IDatabaseBulkWriter, \
+    IDatabaseStatusWriter
+
+class CountingTransaction:
+    """Cursor counting statements"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.statements = 0
+
+    def execute(self, *args, **kwargs):
+        self.statements += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def copy_from(self, *args, **kwargs):
+        self.statements += 1
+        return self.cursor.copy_from(*args, **kwargs)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+def build(name, opts, changed=0):
+    """
+    Build a synthetic load balancer.
+
+    @param name: name of the load balancer
+    @param opts: options giving the size of the load balancer
+    @param changed: percentage of real servers to change
+    """
+    lb = LoadBalancer(name, "bench", "Synthetic load balancer")
+    every = changed and 100 / changed or 0
+    for v in range(opts.vs):
+        vs = VirtualServer("vs%d" % v, "10.%d.%d.%d:80" % (v / 65536,
+                                                            v / 256 % 256,
+                                                            v % 256),
+                           "TCP", "roundrobin")
+        for e in range(opts.extra):
+            vs.extra["extra %d" % e] = "value %d" % e
+        for r in range(opts.rs):
+            rs = RealServer("rs%d" % r, "192.168.%d.%d" % (r / 256, r % 256),
+                            8080, "TCP", 1, "up")
+            for e in range(opts.extra):
+                rs.extra["extra %d" % e] = "value %d" % e
+            if every and (v * opts.rs + r) % every == 0:
+                rs.state = "down"
+                rs.extra["extra 0"] = "changed"
+            vs.realservers["rs%d" % r] = rs
+        lb.virtualservers["vs%d" % v] = vs
+    return lb
+
+def write(connection, writer):
+    """
+    Write a load balancer in a transaction.
+
+    @return: wall time and number of statements
+    """
+    txn = CountingTransaction(connection.cursor())
+    start = time.time()
+    writer.write(txn)
+    connection.commit()
+    return time.time() - start, txn.statements
+
+def check(connection, name, opts):
+    """
+    Check that all live rows of a load balancer are present.
+
+    @return: a description of missing rows or C{"ok"}
+    """
+    cursor = connection.cursor()
+    missing = []
+    for table, expected in [("virtualserver", opts.vs),
+                            ("virtualserver_extra", opts.vs * opts.extra),
+                            ("realserver", opts.vs * opts.rs),
+                            ("realserver_extra", opts.vs * opts.rs * opts.extra)]:
+        cursor.execute("SELECT count(*) FROM %s "
+                       "WHERE lb=%%(name)s AND deleted='infinity'" % table,
+                       {'name': name})
+        count = cursor.fetchall()[0][0]
+        if count != expected:
+            missing.append("%d/%d %s" % (count, expected, table))
+    connection.commit()
+    return missing and "MISSING %s" % ", ".join(missing) or "ok"
+
+def cleanup(connection, names):
+    """Remove rows of the given load balancers"""
+    cursor = connection.cursor()
+    for name in names:
+        for table, column in [("loadbalancer", "name"),
+                              ("virtualserver", "lb"),
+                              ("virtualserver_extra", "lb"),
+                              ("realserver", "lb"),
+                              ("realserver_extra", "lb")]:
+            for suffix in ["", "_past"]:
+                cursor.execute("DELETE FROM %s%s WHERE %s=%%(name)s" % (
+                        table, suffix, column), {'name': name})
+        cursor.execute("DELETE FROM action WHERE lb=%(name)s", {'name': name})
+    connection.commit()
+
+def benchmark(connection, opts):
+    writers = [("rows", IDatabaseWriter),
+               ("staging", IDatabaseBulkWriter)]
+    names = ["bench-%s" % name for name, _ in writers]
+    cleanup(connection, names)
+    print "%d virtual servers, %d real servers, %d extra values each" % (
+        opts.vs, opts.vs * opts.rs, opts.extra)
+    print "%-9s %-10s %9s %9s  %s" % ("writer", "refresh", "time (s)", "SQL",
+                                      "rows")
+    try:
+        for name, interface in writers:
+            for refresh, changed, writer in [("seed", 0, interface),
+                                             ("unchanged", 0, interface),
+                                             ("changed", opts.changed, interface),
+                                             ("status", 0, IDatabaseStatusWriter)]:
+                lb = build("bench-%s" % name, opts, changed)
+                wall, statements = write(connection, writer(lb))
+                print "%-9s %-10s %9.3f %9d  %s" % (name, refresh, wall, statements,
+                                                    check(connection, lb.name, opts))
+                # Timestamps have a resolution of one second
+                time.sleep(1.1)
+    finally:
+        connection.rollback()
+        cleanup(connection, names)
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--dsn", default="dbname=qcss3 user=qcss3 password=qcss3",
+                      help="connection string of the database")
+    parser.add_option("--vs", type="int", default=200,
+                      help="number of virtual servers")
+    parser.add_option("--rs", type="int", default=20,
+                      help="number of real servers per virtual server")
+    parser.add_option("--extra", type="int", default=5,
+                      help="number of extra values per virtual or real server")
+    parser.add_option("--changed", type="int", default=5,
+                      help="percentage of real servers changed")
+    opts, args = parser.parse_args()
+    benchmark(psycopg2.connect(opts.dsn), opts)
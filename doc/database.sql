@@ -51,6 +51,13 @@
 -- using INCLUDING INDEXES). We don't include DEFAULTS because there
 -- is not direct insertion into past tables.
 
+-- Past tables are partitioned by month of deletion with inheritance:
+-- rows are stored in <table>_past_YYYYMM tables which inherit from
+-- <table>_past and have a CHECK constraint on `deleted'. They are
+-- created when needed by qcss3/core/archive.py which moves deleted
+-- rows from live tables in small batches and drops partitions older
+-- than the retention period. Past tables themselves stay empty.
+
 -- The configuration of PostgreSQL should use UTF-8 messages. For example:
 -- lc_messages = 'en_US.UTF-8'
 -- lc_monetary = 'en_US.UTF-8'
@@ -85,6 +92,7 @@ DROP TABLE IF EXISTS realserver_extra CASCADE;
 DROP TABLE IF EXISTS realserver_extra_past CASCADE;
 DROP VIEW IF EXISTS realserver_extra_full CASCADE;
 DROP TABLE IF EXISTS action CASCADE;
+DROP TABLE IF EXISTS plugin CASCADE;
 
 CREATE TABLE loadbalancer (
   name    text		   NOT NULL,
@@ -216,15 +224,27 @@ CREATE VIEW realserver_extra_full AS (SELECT * FROM realserver_extra UNION SELEC
 
 -- This table is not indexed by time. We could use foreign keys but
 -- with little added value. We prefer to not use it for consistency.
+-- Actions of a load balancer or a virtual server use an empty string
+-- for the missing virtual server or real server. Lookups use the
+-- primary key.
 CREATE TABLE action (
   lb          text      NOT NULL,
-  vs          text      NULL,
-  rs          text      NULL,
+  vs          text      NOT NULL DEFAULT '',
+  rs          text      NOT NULL DEFAULT '',
   action      text      NOT NULL,
   label       text      NOT NULL,
   PRIMARY KEY (lb, vs, rs, action)
 );
-CREATE INDEX action_lb_vs_rs ON action (lb, vs, rs);
+
+-- Plugins handling each load balancer. They are searched again when
+-- sysObjectID or the MD5 hash of sysDescr change.
+CREATE TABLE plugin (
+  lb          text      NOT NULL,
+  oid         text      NOT NULL,
+  description text      NOT NULL,
+  plugins     text      NOT NULL,
+  PRIMARY KEY (lb)
+);
 
 -- Special rules to propagate updates. These rules should work when
 -- port or equipment `deleted' column is set from infinity to
@@ -8,6 +8,9 @@ C{IDatabaseWriter(lb).write(txn)} where C{lb} is the load balancer and
 C{txn} a transaction to use.
 """
 
+import socket
+from cStringIO import StringIO
+
 from zope.interface import Interface, implements
 from twisted.python import components
 
@@ -16,32 +19,254 @@ from qcss3.collector.datastore import ILoadBalancer, IVirtualServer, IRealServer
 class IDatabaseWriter(Interface):
     """Interface to write an entity to the database"""
 
-    def write(txn, id=None):
+    def write(txn, id=None, live=None):
         """
         Dump the current entity to database using the given transaction.
 
+        Only rows that changed are written.
+
+        @param txn: transaction to use to dump to the database
+        @param id: unique id to use for the entity (if needed)
+        @param live: L{LiveRows} for the entity, loaded if not provided
+        """
+
+class IDatabaseBulkWriter(Interface):
+    """Interface to write a complete entity to the database at once"""
+
+    def write(txn, id=None):
+        """
+        Dump the current entity to database using the given
+        transaction with a few set-based statements.
+
+        @param txn: transaction to use to dump to the database
+        @param id: unique id to use for the entity (if needed)
+        """
+
+class IDatabaseStatusWriter(Interface):
+    """Interface to write the operational state of an entity to the database"""
+
+    def write(txn, id=None):
+        """
+        Dump the operational state of the current entity to database
+        using the given transaction. Entities not already present in
+        the database are ignored.
+
         @param txn: transaction to use to dump to the database
         @param id: unique id to use for the entity (if needed)
         """
 
+def text(value):
+    """
+    Convert a value to the text stored by PostgreSQL in a text column.
+
+    @param value: value to convert (not C{None})
+    @return: a string
+    """
+    if type(value) is bool:
+        return value and "true" or "false"
+    if type(value) is unicode:
+        return value.encode("utf-8")
+    return str(value)
+
+def inet(value):
+    """
+    Convert an IP address to the form used by PostgreSQL for C{inet}.
+
+    Only IPv6 addresses have several forms (case, leading zeros,
+    compression of zeros). Other values are returned unmodified.
+
+    @param value: IP address as a string
+    @return: canonical form of the IP address
+    """
+    try:
+        return socket.inet_ntop(socket.AF_INET6,
+                                socket.inet_pton(socket.AF_INET6, value))
+    except (socket.error, TypeError, ValueError):
+        return value
+
+def normalize(values):
+    """
+    Normalize values of a row to compare them with values from the
+    database.
+
+    @param values: sequence of values
+    @return: a tuple of strings or C{None}
+    """
+    result = []
+    for value in values:
+        if value is not None:
+            value = text(value)
+        result.append(value)
+    return tuple(result)
+
+class LiveRows:
+    """
+    Rows currently in the database for a load balancer, a virtual
+    server or a real server.
+
+    Without a transaction, no rows are loaded: everything will be
+    written.
+
+    Actions are also loaded. In the action table, an empty string
+    stands for the virtual server or the real server of actions of a
+    load balancer or of a virtual server.
+    """
+
+    def __init__(self, txn=None, lb=None, vs=None, rs=None):
+        """
+        Load rows from the database.
+
+        @param txn: transaction to use to load rows
+        @param lb: name of the load balancer
+        @param vs: if specified, load only rows for this virtual server
+        @param rs: if specified, load only rows for this real server
+        """
+        self.virtualservers = {}        # vs -> (name, vip, protocol, mode)
+        self.vsextra = {}               # vs -> {key: value}
+        self.realservers = {}           # (vs, rs) -> (name, rip, ...)
+        self.rsextra = {}               # (vs, rs) -> {key: value}
+        self.actions = {}               # (vs, rs) -> {action: label}
+        if txn is None:
+            return
+        params = {'lb': lb, 'vs': vs, 'rs': rs}
+        where = " AND ".join(["%s=%%(%s)s" % (k, k)
+                              for k in ['lb', 'vs', 'rs']
+                              if params[k] is not None])
+        if rs is None:
+            txn.execute("SELECT vs, name, vip, protocol, mode FROM virtualserver "
+                        "WHERE %s AND deleted='infinity'" % where, params)
+            for row in txn.fetchall():
+                self.virtualservers[row[0]] = normalize(row[1:])
+            txn.execute("SELECT vs, key, value FROM virtualserver_extra "
+                        "WHERE %s AND deleted='infinity'" % where, params)
+            for v, key, value in txn.fetchall():
+                self.vsextra.setdefault(v, {})[key] = value
+        txn.execute("SELECT vs, rs, name, rip, port, protocol, weight, rstate, sorry "
+                    "FROM realserver WHERE %s AND deleted='infinity'" % where, params)
+        for row in txn.fetchall():
+            self.realservers[tuple(row[:2])] = normalize(row[2:])
+        txn.execute("SELECT vs, rs, key, value FROM realserver_extra "
+                    "WHERE %s AND deleted='infinity'" % where, params)
+        for v, r, key, value in txn.fetchall():
+            self.rsextra.setdefault((v, r), {})[key] = value
+        txn.execute("SELECT vs, rs, action, label FROM action "
+                    "WHERE %s" % where, params)
+        for v, r, action, label in txn.fetchall():
+            self.actions.setdefault((v, r), {})[action] = label
+
+    def cleared(self):
+        """
+        Get rows left once the entity has been deleted.
+
+        Actions are not versioned and therefore are kept.
+
+        @return: a new L{LiveRows} with actions only
+        """
+        live = LiveRows()
+        live.actions = self.actions
+        return live
+
+class ExtraWriterMixIn:
+
+    def write_extra(self, txn, table, extra, live, params):
+        """Write changed extra information to an `_extra' table.
+
+        @param txn: transaction to use to write extra information
+        @param table: table to use (virtualserver_extra or realserver_extra)
+        @param extra: extra information to write
+        @param live: extra information currently in the database
+        @param params: mapping identifying the entity (lb, vs and maybe rs)
+        """
+        where = " AND ".join(["%s=%%(%s)s" % (k, k) for k in params])
+        for key in live:
+            if key in extra:
+                if normalize([extra[key]]) == normalize([live[key]]):
+                    # Unchanged
+                    continue
+            p = params.copy()
+            p['key'] = key
+            txn.execute("UPDATE %s SET deleted=CURRENT_TIMESTAMP "
+                        "WHERE %s AND key=%%(key)s "
+                        "AND deleted='infinity'" % (table, where), p)
+        for key in extra:
+            if key in live and \
+                    normalize([extra[key]]) == normalize([live[key]]):
+                continue
+            p = params.copy()
+            p.update({'key': key, 'value': extra[key]})
+            txn.execute("INSERT INTO %s (%s, key, value) VALUES "
+                        "(%s, %%(key)s, %%(value)s)" % (table,
+                                                       ", ".join(params.keys()),
+                                                       ", ".join(["%%(%s)s" % k
+                                                                  for k in params])),
+                        p)
+
+class ExtraStatusWriterMixIn:
+
+    def write_extra_status(self, txn, table, extra, params):
+        """Write changed extra information to an `_extra' table.
+
+        @param txn: transaction to use to write extra information
+        @param table: table to use (virtualserver_extra or realserver_extra)
+        @param extra: extra information to write
+        @param params: mapping identifying the entity (lb, vs and maybe rs)
+        """
+        where = " AND ".join(["%s=%%(%s)s" % (k, k) for k in params])
+        for key in extra:
+            p = params.copy()
+            p.update({'key': key, 'value': extra[key]})
+            txn.execute("SELECT 1 FROM %s WHERE %s AND key=%%(key)s "
+                        "AND value=%%(value)s::text "
+                        "AND deleted='infinity'" % (table, where), p)
+            if txn.fetchall():
+                # Unchanged
+                continue
+            txn.execute("UPDATE %s SET deleted=CURRENT_TIMESTAMP "
+                        "WHERE %s AND key=%%(key)s "
+                        "AND deleted='infinity'" % (table, where), p)
+            txn.execute("INSERT INTO %s (%s, key, value) VALUES "
+                        "(%s, %%(key)s, %%(value)s)" % (table,
+                                                       ", ".join(params.keys()),
+                                                       ", ".join(["%%(%s)s" % k
+                                                                  for k in params])),
+                        p)
+
 class ActionWriterMixIn:
 
-    def write_actions(self, txn, actions, lb, vs=None, rs=None):
-        """Write actions to `action' table.
+    def write_actions(self, txn, actions, live, lb, vs=None, rs=None):
+        """Write actions to `action' table if they changed.
+
+        Actions of the entity are replaced with one DELETE and one
+        INSERT for all actions.
 
         @param txn: transaction to use to write actions to database
         @param actions: actions to write
+        @param live: L{LiveRows} with actions currently in the database
         @param lb: loadbalancer
         @param vs: virtual server
         @param rs: real server
         """
-        txn.execute("DELETE FROM action WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s",
-                    {'lb': lb, 'vs': vs, 'rs': rs})
-        for key in actions:
-            txn.execute("INSERT INTO action VALUES "
-                        "(%(lb)s, %(vs)s, %(rs)s, %(key)s, %(value)s)",
-                        { 'lb': lb, 'vs': vs, 'rs': rs, 'key': key,
-                          'value': actions[key] })
+        vs = vs or ''
+        rs = rs or ''
+        current = live.actions.get((vs, rs), {})
+        if actions == current:
+            return
+        params = {'lb': lb, 'vs': vs, 'rs': rs}
+        if current:
+            txn.execute("DELETE FROM action "
+                        "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s", params)
+        if not actions:
+            return
+        values = []
+        i = 0
+        for action in actions:
+            params['action%d' % i] = action
+            params['label%d' % i] = actions[action]
+            values.append("SELECT %%(lb)s, %%(vs)s, %%(rs)s, "
+                          "%%(action%d)s, %%(label%d)s" % (i, i))
+            i += 1
+        txn.execute("INSERT INTO action (lb, vs, rs, action, label) %s" %
+                    " UNION ALL ".join(values), params)
 
 class LoadBalancerWriter(ActionWriterMixIn):
     implements(IDatabaseWriter)
@@ -49,112 +274,502 @@ class LoadBalancerWriter(ActionWriterMixIn):
     def __init__(self, loadbalancer):
         self.loadbalancer = loadbalancer
 
-    def write(self, txn, id=None):
-        """Dump the loadbalancer to the database"""
-        # Remove existing information
-        txn.execute("UPDATE loadbalancer SET deleted=CURRENT_TIMESTAMP "
+    def write(self, txn, id=None, live=None):
+        """
+        Dump the loadbalancer to the database
+
+        Rows of the load balancer currently in the database are
+        compared with the load balancer. Unchanged rows are only
+        marked as updated, virtual servers that disappeared are
+        deleted.
+
+        @param id: (name of load balancer,), defaults to the name of
+            the load balancer. Another name is used for an alias.
+        """
+        name = id and id[0] or self.loadbalancer.name
+        txn.execute("SELECT type FROM loadbalancer "
                     "WHERE name=%(name)s AND deleted='infinity'",
-                    {'name': self.loadbalancer.name})
-        # Insert new information
-        txn.execute("INSERT INTO loadbalancer "
-                    "(name, type, description) VALUES "
-                    "(%(name)s, %(kind)s, %(description)s)",
-                    { 'name': self.loadbalancer.name,
-                      'kind': self.loadbalancer.kind,
-                      'description': self.loadbalancer.description })
+                    {'name': name})
+        if normalize([self.loadbalancer.kind]) in \
+                [normalize(row) for row in txn.fetchall()]:
+            if live is None:
+                live = LiveRows(txn, name)
+        else:
+            # New or changed. Deleting the load balancer deletes
+            # everything below it, we need to write everything again.
+            txn.execute("UPDATE loadbalancer SET deleted=CURRENT_TIMESTAMP "
+                        "WHERE name=%(name)s AND deleted='infinity'",
+                        {'name': name})
+            txn.execute("INSERT INTO loadbalancer "
+                        "(name, type, description) VALUES "
+                        "(%(name)s, %(kind)s, %(description)s)",
+                        { 'name': name,
+                          'kind': self.loadbalancer.kind,
+                          'description': self.loadbalancer.description })
+            live = LiveRows(txn, name).cleared()
         # Then write virtual servers information
         virtualservers = self.loadbalancer.virtualservers
         for virtualserver in virtualservers:
             IDatabaseWriter(
                 virtualservers[virtualserver]).write(txn,
-                                                     (self.loadbalancer.name,
-                                                      virtualserver))
-        self.write_actions(txn, self.loadbalancer.actions, self.loadbalancer.name)
+                                                     (name,
+                                                      virtualserver),
+                                                     live)
+        for virtualserver in live.virtualservers:
+            if virtualserver not in virtualservers:
+                txn.execute("UPDATE virtualserver SET deleted=CURRENT_TIMESTAMP "
+                            "WHERE lb=%(lb)s AND vs=%(vs)s AND deleted='infinity'",
+                            {'lb': name, 'vs': virtualserver})
+                txn.execute("DELETE FROM action WHERE lb=%(lb)s AND vs=%(vs)s",
+                            {'lb': name, 'vs': virtualserver})
+        # Unchanged rows are now up-to-date
+        for table, column in [('loadbalancer', 'name'),
+                              ('virtualserver', 'lb'),
+                              ('realserver', 'lb')]:
+            txn.execute("UPDATE %s SET updated=CURRENT_TIMESTAMP "
+                        "WHERE %s=%%(name)s AND deleted='infinity'" % (table, column),
+                        {'name': name})
+        self.write_actions(txn, self.loadbalancer.actions, live, name)
 
-class VirtualServerWriter(ActionWriterMixIn):
+class VirtualServerWriter(ActionWriterMixIn, ExtraWriterMixIn):
     implements(IDatabaseWriter)
 
     def __init__(self, virtualserver):
         self.virtualserver = virtualserver
 
-    def write(self, txn, id=None):
+    def write(self, txn, id=None, live=None):
         """
         Dump the virtual server to the database.
 
+        If the virtual server itself has changed, it is deleted with
+        everything below it and written again. Otherwise, only changed
+        extra information and real servers are written.
+
         @param id: (name of loadbalancer, ID of the virtual server)
         """
         lb, vs = id
-        # Remove existing information
-        txn.execute("UPDATE virtualserver SET deleted=CURRENT_TIMESTAMP "
-                    "WHERE lb=%(lb)s AND vs=%(vs)s AND deleted='infinity'",
-                    {'lb': lb, 'vs': vs})
-        # Insert new information
-        txn.execute("INSERT INTO virtualserver "
-                    "(lb, vs, name, vip, protocol, mode) VALUES "
-                    "(%(lb)s, %(vs)s, %(name)s, %(vip)s, %(protocol)s, %(mode)s)",
-                    {'lb': lb, 'vs': vs,
-                     'name': self.virtualserver.name,
-                     'vip': self.virtualserver.vip,
-                     'protocol': self.virtualserver.protocol,
-                     'mode': self.virtualserver.mode})
-        # Insert extra information
-        for key in self.virtualserver.extra:
-            txn.execute("INSERT INTO virtualserver_extra "
-                        "(lb, vs, key, value) VALUES "
-                        "(%(lb)s, %(vs)s, %(key)s, %(value)s)",
-                        { 'lb': lb, 'vs': vs, 'key': key,
-                          'value': self.virtualserver.extra[key] })
-        # Insert real servers
+        toplevel = live is None
+        if toplevel:
+            live = LiveRows(txn, lb, vs)
+        params = {'lb': lb, 'vs': vs,
+                  'name': self.virtualserver.name,
+                  'vip': self.virtualserver.vip,
+                  'protocol': self.virtualserver.protocol,
+                  'mode': self.virtualserver.mode}
         realservers = self.virtualserver.realservers
+        if live.virtualservers.get(vs) != normalize([params['name'],
+                                                     params['vip'],
+                                                     params['protocol'],
+                                                     params['mode']]):
+            if vs in live.virtualservers:
+                # Also delete extra information and real servers
+                txn.execute("UPDATE virtualserver SET deleted=CURRENT_TIMESTAMP "
+                            "WHERE lb=%(lb)s AND vs=%(vs)s AND deleted='infinity'",
+                            params)
+            txn.execute("INSERT INTO virtualserver "
+                        "(lb, vs, name, vip, protocol, mode) VALUES "
+                        "(%(lb)s, %(vs)s, %(name)s, %(vip)s, %(protocol)s, %(mode)s)",
+                        params)
+            live = live.cleared()
+        else:
+            for v, rs in live.realservers.keys():
+                if v == vs and rs not in realservers:
+                    txn.execute("UPDATE realserver SET deleted=CURRENT_TIMESTAMP "
+                                "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s "
+                                "AND deleted='infinity'",
+                                {'lb': lb, 'vs': vs, 'rs': rs})
+                    if (vs, rs) in live.actions:
+                        txn.execute("DELETE FROM action "
+                                    "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s",
+                                    {'lb': lb, 'vs': vs, 'rs': rs})
+        self.write_extra(txn, "virtualserver_extra",
+                         self.virtualserver.extra, live.vsextra.get(vs, {}),
+                         {'lb': lb, 'vs': vs})
+        # Write real servers
         for realserver in realservers:
             IDatabaseWriter(
                 realservers[realserver]).write(txn,
-                                               (lb, vs, realserver))
-        self.write_actions(txn, self.virtualserver.actions, lb, vs)
+                                               (lb, vs, realserver),
+                                               live)
+        if toplevel:
+            for table in ['virtualserver', 'realserver']:
+                txn.execute("UPDATE %s SET updated=CURRENT_TIMESTAMP "
+                            "WHERE lb=%%(lb)s AND vs=%%(vs)s "
+                            "AND deleted='infinity'" % table,
+                            {'lb': lb, 'vs': vs})
+        self.write_actions(txn, self.virtualserver.actions, live, lb, vs)
 
-class RealOrSorryServerWriter(ActionWriterMixIn):
+class RealOrSorryServerWriter(ActionWriterMixIn, ExtraWriterMixIn):
     implements(IDatabaseWriter)
 
     def __init__(self, realserver):
         self.realserver = realserver
 
-    def write(self, txn, id=None):
+    def write(self, txn, id=None, live=None):
         """
         Dump the real/sorry server to the database.
 
+        If the real server itself has changed, it is deleted with its
+        extra information and written again. Otherwise, only changed
+        extra information is written.
+
         @param id: (name of load balancer,
             ID of the virtualserver, ID of the real server)
         """
         lb, vs, rs = id
-        # Remove existing information
-        txn.execute("UPDATE realserver SET deleted=CURRENT_TIMESTAMP "
-                    "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s "
-                    "AND deleted='infinity'",
-                    {'lb': lb, 'vs': vs, 'rs': rs})
-        # Insert new information
+        toplevel = live is None
+        if toplevel:
+            live = LiveRows(txn, lb, vs, rs)
         weight = None
         if IRealServer.providedBy(self.realserver):
             weight = self.realserver.weight
-        txn.execute("INSERT INTO realserver "
-                    "(lb, vs, rs, name, rip, port, protocol, weight, rstate, sorry) "
-                    "VALUES "
-                    "(%(lb)s, %(vs)s, %(rs)s, %(name)s, %(rip)s, "
-                    "%(port)s, %(protocol)s, %(weight)s, %(rstate)s, %(sorry)s)",
-                    {'lb': lb, 'vs': vs, 'rs': rs,
-                     'name': self.realserver.name,
-                     'rip': self.realserver.rip,
-                     'port': self.realserver.rport,
-                     'protocol': self.realserver.protocol,
-                     'weight':  weight,
-                     'rstate': self.realserver.state,
-                     'sorry': ISorryServer.providedBy(self.realserver) })
-        # Insert extra information
-        for key in self.realserver.extra:
-            txn.execute("INSERT INTO realserver_extra VALUES "
-                        "(%(lb)s, %(vs)s, %(rs)s, %(key)s, %(value)s)",
-                        { 'lb': lb, 'vs': vs, 'rs': rs, 'key': key,
-                          'value': self.realserver.extra[key] })
-        self.write_actions(txn, self.realserver.actions, lb, vs, rs)
+        params = {'lb': lb, 'vs': vs, 'rs': rs,
+                  'name': self.realserver.name,
+                  'rip': inet(self.realserver.rip),
+                  'port': self.realserver.rport,
+                  'protocol': self.realserver.protocol,
+                  'weight':  weight,
+                  'rstate': self.realserver.state,
+                  'sorry': ISorryServer.providedBy(self.realserver) }
+        extra = live.rsextra.get((vs, rs), {})
+        if live.realservers.get((vs, rs)) != normalize([params['name'],
+                                                        params['rip'],
+                                                        params['port'],
+                                                        params['protocol'],
+                                                        params['weight'],
+                                                        params['rstate'],
+                                                        params['sorry']]):
+            if (vs, rs) in live.realservers:
+                # Also delete extra information
+                txn.execute("UPDATE realserver SET deleted=CURRENT_TIMESTAMP "
+                            "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s "
+                            "AND deleted='infinity'", params)
+            txn.execute("INSERT INTO realserver "
+                        "(lb, vs, rs, name, rip, port, protocol, weight, rstate, sorry) "
+                        "VALUES "
+                        "(%(lb)s, %(vs)s, %(rs)s, %(name)s, %(rip)s, "
+                        "%(port)s, %(protocol)s, %(weight)s, %(rstate)s, %(sorry)s)",
+                        params)
+            extra = {}
+        elif toplevel:
+            txn.execute("UPDATE realserver SET updated=CURRENT_TIMESTAMP "
+                        "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s "
+                        "AND deleted='infinity'", params)
+        self.write_extra(txn, "realserver_extra",
+                         self.realserver.extra, extra,
+                         {'lb': lb, 'vs': vs, 'rs': rs})
+        self.write_actions(txn, self.realserver.actions, live, lb, vs, rs)
+
+def copyValue(value):
+    """
+    Format a value for C{COPY}.
+
+    @param value: value to format
+    @return: a string using the text format of C{COPY}
+    """
+    if value is None:
+        return "\\N"
+    value = text(value)
+    for char, escaped in [("\\", "\\\\"), ("\t", "\\t"),
+                          ("\n", "\\n"), ("\r", "\\r")]:
+        value = value.replace(char, escaped)
+    return value
+
+class StagingLoadBalancerWriter:
+    """
+    Write a complete load balancer through staging tables.
+
+    Rows of the load balancer are loaded with C{COPY} into temporary
+    tables. Each table is then reconciled with its staging table with
+    four statements: changed or vanished rows are deleted, identical
+    rows deleted earlier in the transaction are resurrected, new rows
+    are inserted and the remaining rows are marked as updated. Since
+    inserted rows never match a deleted row, the rules handling
+    insertion never apply. Actions are staged too and only changed
+    actions are replaced.
+    """
+    implements(IDatabaseBulkWriter)
+
+    # Table, columns identifying a row, other columns
+    tables = [("virtualserver", ["vs"],
+               ["name", "vip", "protocol", "mode"]),
+              ("virtualserver_extra", ["vs", "key"], ["value"]),
+              ("realserver", ["vs", "rs"],
+               ["name", "rip", "port", "protocol", "weight", "rstate", "sorry"]),
+              ("realserver_extra", ["vs", "rs", "key"], ["value"])]
+
+    def __init__(self, loadbalancer):
+        self.loadbalancer = loadbalancer
+
+    def rows(self):
+        """
+        Build rows of each table.
+
+        @return: a mapping from tables to lists of rows
+        """
+        rows = {}
+        for table, keys, columns in self.tables:
+            rows[table] = []
+        rows["action"] = [("", "", action, self.loadbalancer.actions[action])
+                          for action in self.loadbalancer.actions]
+        virtualservers = self.loadbalancer.virtualservers
+        for vs in virtualservers:
+            virtualserver = virtualservers[vs]
+            rows["virtualserver"].append((vs, virtualserver.name,
+                                          virtualserver.vip,
+                                          virtualserver.protocol,
+                                          virtualserver.mode))
+            for key in virtualserver.extra:
+                rows["virtualserver_extra"].append((vs, key,
+                                                    virtualserver.extra[key]))
+            for action in virtualserver.actions:
+                rows["action"].append((vs, "", action,
+                                       virtualserver.actions[action]))
+            realservers = virtualserver.realservers
+            for rs in realservers:
+                realserver = realservers[rs]
+                weight = None
+                if IRealServer.providedBy(realserver):
+                    weight = realserver.weight
+                rows["realserver"].append((vs, rs, realserver.name,
+                                           realserver.rip, realserver.rport,
+                                           realserver.protocol, weight,
+                                           realserver.state,
+                                           ISorryServer.providedBy(realserver)))
+                for key in realserver.extra:
+                    rows["realserver_extra"].append((vs, rs, key,
+                                                     realserver.extra[key]))
+                for action in realserver.actions:
+                    rows["action"].append((vs, rs, action,
+                                           realserver.actions[action]))
+        return rows
+
+    def stage(self, txn, table, columns, rows):
+        """
+        Create a staging table and load rows into it.
+
+        @param table: table to stage
+        @param columns: columns of the staging table
+        @param rows: rows to load
+        """
+        txn.execute("CREATE TEMPORARY TABLE staging_%s AS "
+                    "SELECT %s FROM %s LIMIT 0" % (table,
+                                                   ", ".join(columns),
+                                                   table))
+        if not rows:
+            return
+        data = StringIO()
+        for row in rows:
+            data.write("\t".join([copyValue(v) for v in row]))
+            data.write("\n")
+        data.seek(0)
+        txn.copy_from(data, "staging_%s" % table, columns=columns)
+
+    def reconcile(self, txn, lb, table, keys, columns):
+        """
+        Reconcile a table with its staging table.
+
+        @param lb: name of the load balancer
+        @param table: table to reconcile
+        @param keys: columns identifying a row
+        @param columns: other columns
+        """
+        same = " AND ".join(["s.%s=%s.%s" % (k, table, k) for k in keys])
+        identical = " AND ".join([same] +
+                                 ["(s.%s=%s.%s OR s.%s IS NULL AND %s.%s IS NULL)" % (
+                    (c, table, c)*2) for c in columns])
+        live = " AND ".join(["l.%s=s.%s" % (k, k) for k in keys])
+        params = {'lb': lb}
+        updated = ""
+        if table in ["virtualserver", "realserver"]:
+            updated = ", updated=CURRENT_TIMESTAMP"
+        # Delete changed or vanished rows (this cascades)
+        txn.execute("UPDATE %s SET deleted=CURRENT_TIMESTAMP "
+                    "WHERE lb=%%(lb)s AND deleted='infinity' "
+                    "AND NOT EXISTS (SELECT 1 FROM staging_%s s "
+                    "WHERE %s)" % (table, table, identical), params)
+        # Resurrect identical rows deleted in this transaction
+        txn.execute("UPDATE %s SET deleted='infinity'%s "
+                    "WHERE lb=%%(lb)s AND deleted=CURRENT_TIMESTAMP::abstime "
+                    "AND EXISTS (SELECT 1 FROM staging_%s s WHERE %s "
+                    "AND NOT EXISTS (SELECT 1 FROM %s l WHERE l.lb=%%(lb)s "
+                    "AND %s AND l.deleted='infinity'))" % (table, updated,
+                                                           table, identical,
+                                                           table, live),
+                    params)
+        # Insert new rows. Identical rows deleted in this transaction
+        # are now alive, the rule handling insertion cannot match.
+        txn.execute("INSERT INTO %s (lb, %s) SELECT %%(lb)s, %s "
+                    "FROM staging_%s s WHERE NOT EXISTS "
+                    "(SELECT 1 FROM %s l WHERE l.lb=%%(lb)s "
+                    "AND %s AND l.deleted='infinity')" % (
+                table, ", ".join(keys + columns),
+                ", ".join(["s.%s" % c for c in keys + columns]),
+                table, table, live), params)
+
+    def reconcile_actions(self, txn, lb):
+        """
+        Replace actions of entities whose actions have changed.
+
+        @param lb: name of the load balancer
+        """
+        params = {'lb': lb}
+        txn.execute("CREATE TEMPORARY TABLE changed_action AS "
+                    "SELECT vs, rs FROM action a WHERE lb=%(lb)s "
+                    "AND NOT EXISTS (SELECT 1 FROM staging_action s "
+                    "WHERE s.vs=a.vs AND s.rs=a.rs AND s.action=a.action "
+                    "AND s.label=a.label) "
+                    "UNION SELECT vs, rs FROM staging_action s "
+                    "WHERE NOT EXISTS (SELECT 1 FROM action a WHERE a.lb=%(lb)s "
+                    "AND a.vs=s.vs AND a.rs=s.rs AND a.action=s.action "
+                    "AND a.label=s.label)", params)
+        txn.execute("DELETE FROM action WHERE lb=%(lb)s "
+                    "AND EXISTS (SELECT 1 FROM changed_action c "
+                    "WHERE c.vs=action.vs AND c.rs=action.rs)", params)
+        txn.execute("INSERT INTO action (lb, vs, rs, action, label) "
+                    "SELECT %(lb)s, s.vs, s.rs, s.action, s.label "
+                    "FROM staging_action s, changed_action c "
+                    "WHERE c.vs=s.vs AND c.rs=s.rs", params)
+        txn.execute("DROP TABLE changed_action")
+
+    def write(self, txn, id=None):
+        """
+        Dump the loadbalancer to the database
+
+        @param id: (name of load balancer,), defaults to the name of
+            the load balancer. Another name is used for an alias.
+        """
+        name = id and id[0] or self.loadbalancer.name
+        txn.execute("SELECT type FROM loadbalancer "
+                    "WHERE name=%(name)s AND deleted='infinity'",
+                    {'name': name})
+        if normalize([self.loadbalancer.kind]) not in \
+                [normalize(row) for row in txn.fetchall()]:
+            txn.execute("UPDATE loadbalancer SET deleted=CURRENT_TIMESTAMP "
+                        "WHERE name=%(name)s AND deleted='infinity'",
+                        {'name': name})
+            txn.execute("INSERT INTO loadbalancer "
+                        "(name, type, description) VALUES "
+                        "(%(name)s, %(kind)s, %(description)s)",
+                        { 'name': name,
+                          'kind': self.loadbalancer.kind,
+                          'description': self.loadbalancer.description })
+        rows = self.rows()
+        for table, keys, columns in self.tables:
+            self.stage(txn, table, keys + columns, rows[table])
+        self.stage(txn, "action", ["vs", "rs", "action", "label"],
+                   rows["action"])
+        for table, keys, columns in self.tables:
+            self.reconcile(txn, name, table, keys, columns)
+        self.reconcile_actions(txn, name)
+        for table in [t[0] for t in self.tables] + ["action"]:
+            txn.execute("DROP TABLE staging_%s" % table)
+        # Unchanged rows are now up-to-date
+        for table, column in [('loadbalancer', 'name'),
+                              ('virtualserver', 'lb'),
+                              ('realserver', 'lb')]:
+            txn.execute("UPDATE %s SET updated=CURRENT_TIMESTAMP "
+                        "WHERE %s=%%(name)s AND deleted='infinity'" % (table, column),
+                        {'name': name})
+
+class LoadBalancerStatusWriter:
+    implements(IDatabaseStatusWriter)
+
+    def __init__(self, loadbalancer):
+        self.loadbalancer = loadbalancer
+
+    def write(self, txn, id=None):
+        """
+        Dump the operational state of the loadbalancer to the database
+
+        @param id: (name of load balancer,), defaults to the name of
+            the load balancer. Another name is used for an alias.
+        """
+        name = id and id[0] or self.loadbalancer.name
+        virtualservers = self.loadbalancer.virtualservers
+        for virtualserver in virtualservers:
+            IDatabaseStatusWriter(
+                virtualservers[virtualserver]).write(txn,
+                                                     (name,
+                                                      virtualserver))
+
+class VirtualServerStatusWriter(ExtraStatusWriterMixIn):
+    implements(IDatabaseStatusWriter)
+
+    def __init__(self, virtualserver):
+        self.virtualserver = virtualserver
+
+    def write(self, txn, id=None):
+        """
+        Dump the operational state of the virtual server to the database.
+
+        @param id: (name of loadbalancer, ID of the virtual server)
+        """
+        lb, vs = id
+        txn.execute("SELECT 1 FROM virtualserver "
+                    "WHERE lb=%(lb)s AND vs=%(vs)s AND deleted='infinity'",
+                    {'lb': lb, 'vs': vs})
+        if not txn.fetchall():
+            # Not known yet, we need a complete refresh.
+            return
+        self.write_extra_status(txn, "virtualserver_extra",
+                                self.virtualserver.extra,
+                                {'lb': lb, 'vs': vs})
+        realservers = self.virtualserver.realservers
+        for realserver in realservers:
+            IDatabaseStatusWriter(
+                realservers[realserver]).write(txn,
+                                               (lb, vs, realserver))
+
+class RealOrSorryServerStatusWriter(ExtraStatusWriterMixIn):
+    implements(IDatabaseStatusWriter)
+
+    def __init__(self, realserver):
+        self.realserver = realserver
+
+    def write(self, txn, id=None):
+        """
+        Dump the operational state of the real/sorry server to the database.
+
+        If the state has changed, the current row is deleted and
+        copied with the new state. Extra information is copied
+        too. Otherwise, we just tell that the row is up-to-date.
+
+        @param id: (name of load balancer,
+            ID of the virtualserver, ID of the real server)
+        """
+        lb, vs, rs = id
+        params = {'lb': lb, 'vs': vs, 'rs': rs,
+                  'rstate': self.realserver.state}
+        txn.execute("SELECT rstate FROM realserver "
+                    "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s "
+                    "AND deleted='infinity'", params)
+        result = txn.fetchall()
+        if not result:
+            # Not known yet, we need a complete refresh.
+            return
+        if result[0][0] == self.realserver.state:
+            txn.execute("UPDATE realserver SET updated=CURRENT_TIMESTAMP "
+                        "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s "
+                        "AND deleted='infinity'", params)
+        else:
+            txn.execute("UPDATE realserver SET deleted=CURRENT_TIMESTAMP "
+                        "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s "
+                        "AND deleted='infinity'", params)
+            txn.execute("INSERT INTO realserver "
+                        "(lb, vs, rs, name, rip, port, protocol, weight, rstate, sorry) "
+                        "SELECT lb, vs, rs, name, rip, port, protocol, weight, "
+                        "%(rstate)s, sorry FROM realserver "
+                        "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s "
+                        "AND deleted=CURRENT_TIMESTAMP::abstime", params)
+            # Extra information has been deleted, restore it
+            txn.execute("INSERT INTO realserver_extra (lb, vs, rs, key, value) "
+                        "SELECT lb, vs, rs, key, value FROM realserver_extra "
+                        "WHERE lb=%(lb)s AND vs=%(vs)s AND rs=%(rs)s "
+                        "AND deleted=CURRENT_TIMESTAMP::abstime", params)
+        self.write_extra_status(txn, "realserver_extra",
+                                self.realserver.extra,
+                                {'lb': lb, 'vs': vs, 'rs': rs})
 
 components.registerAdapter(
     LoadBalancerWriter,
@@ -172,3 +787,23 @@ components.registerAdapter(
     RealOrSorryServerWriter,
     ISorryServer, 
     IDatabaseWriter)
+components.registerAdapter(
+    StagingLoadBalancerWriter,
+    ILoadBalancer,
+    IDatabaseBulkWriter)
+components.registerAdapter(
+    LoadBalancerStatusWriter,
+    ILoadBalancer,
+    IDatabaseStatusWriter)
+components.registerAdapter(
+    VirtualServerStatusWriter,
+    IVirtualServer,
+    IDatabaseStatusWriter)
+components.registerAdapter(
+    RealOrSorryServerStatusWriter,
+    IRealServer,
+    IDatabaseStatusWriter)
+components.registerAdapter(
+    RealOrSorryServerStatusWriter,
+    ISorryServer,
+    IDatabaseStatusWriter)
@@ -10,3 +10,6 @@ class NoPlugin(CollectorException):
 
 class UnknownLoadBalancer(CollectorException):
     pass
+
+class AgentDown(CollectorException):
+    pass
@@ -8,6 +8,8 @@ class ICollector(Interface):
     """Interface for a collector gathering load balancer information"""
 
     oids = Attribute("OID mapping to be used when collecting")
+    statusoids = Attribute("Names of OID carrying the operational state")
+    statusextras = Attribute("Keys of extra attributes carrying the operational state")
 
     def collect(vs=None, rs=None):
         """
@@ -19,6 +21,18 @@ class ICollector(Interface):
             C{IVirtualServer}, C{IRealServer} or C{ISorryServer}.
         """
 
+    def collect_status():
+        """
+        Collect only the operational state of the whole load balancer.
+
+        Only OID from C{statusoids} are retrieved again. Other
+        information is taken from the previous collection, if any.
+
+        @return: an object implementing C{ILoadBalancer}. Extra
+            attributes of virtual servers and real servers only
+            contain keys from C{statusextras}.
+        """
+
     def execute(action, actionargs=None, vs=None, rs=None):
         """
         Execute an action
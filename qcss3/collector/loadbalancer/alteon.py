@@ -80,6 +80,15 @@ class AlteonCollector(GenericCollector):
         'slbStatRServerFailures': '.1.3.6.1.4.1.1872.2.5.4.2.2.1.4',
         }
 
+    statusoids = [
+        'slbVirtServicesInfoState',
+        'slbRealServerInfoState',
+        'slbOperGroupRealServerState',
+        'slbOperRealServerStatus',
+        'slbStatRServerFailures',
+        ]
+    statusextras = [ 'failures' ]
+
     kind = "AAS"
     modes = {
         1: "round robin",
@@ -263,22 +272,21 @@ class AlteonCollector(GenericCollector):
         Process data when no virtual server and no real server are provided.
         """
         # Retrieve all data
-        for oid in self.oids:
-            if not oid.startswith("slb"):
-                continue
-            w = defer.waitForDeferred(self.proxy.walk(self.oids[oid]))
-            yield w
-            w.getResult()
+        w = defer.waitForDeferred(self.walk(*[oid for oid in self.oids
+                                              if oid.startswith("slb")]))
+        yield w
+        w.getResult()
 
         # For each virtual server, build it
+        builders = []
         for v in self.cache('slbCurCfgVirtServerIpAddress'):
             for s in self.cache(('slbCurCfgVirtServiceRealGroup', v)):
                 g = self.cache(('slbCurCfgVirtServiceRealGroup', v, s))
-                vs = defer.waitForDeferred(self.process_vs(v, s, g))
-                yield vs
-                vs = vs.getResult()
-                if vs is not None:
-                    self.lb.virtualservers["v%ds%dg%d" % (v, s, g)] = vs
+                builders.append(("v%ds%dg%d" % (v, s, g),
+                                 self.process_vs, (v, s, g)))
+        vs = defer.waitForDeferred(self.build_virtualservers(builders))
+        yield vs
+        vs.getResult()
         yield self.lb
         return
 
@@ -293,7 +301,7 @@ class AlteonCollector(GenericCollector):
         @return: a maybe deferred C{IVirtualServer} or C{None}
         """
         # Retrieve some data if needed
-        c = defer.waitForDeferred(self.cache_or_get(
+        c = defer.waitForDeferred(self.prefetch(
             ('slbCurCfgVirtServerVname', v),
             ('slbCurCfgVirtServiceHname', v, s),
             ('slbCurCfgGroupName', g),
@@ -301,7 +309,6 @@ class AlteonCollector(GenericCollector):
             ('slbCurCfgVirtServiceVirtPort', v, s),
             ('slbCurCfgVirtServiceUDPBalance', v, s),
             ('slbCurCfgVirtServiceRealPort', v, s),
-            ('slbCurCfgVirtServiceUDPBalance', v, s),
             ('slbCurCfgVirtServicePBind', v, s),
             ('slbCurCfgGroupMetric', g),
             ('slbCurCfgVirtServerState', v),
@@ -343,9 +350,35 @@ class AlteonCollector(GenericCollector):
             self.cache(('slbCurCfgVirtServicePBind', v, s)),
             "unknown")
 
+        # Retrieve real servers, backup servers and the backup group
+        # at once, then servers backing up real servers or in the
+        # backup group.
+        reals = list(self.bitmap(self.cache(('slbCurCfgGroupRealServers', g))))
+        backups = [b for b in [self.cache(('slbCurCfgGroupBackupServer', g))] if b]
+        group = self.cache(('slbCurCfgGroupBackupGroup', g))
+        oids = [('slbCurCfgRealServerBackUp', r) for r in reals]
+        for r in reals + backups:
+            oids.extend(self.realserver_oids(v, s, g, r))
+        if group:
+            oids.append(('slbCurCfgGroupRealServers', group))
+        c = defer.waitForDeferred(self.prefetch(*oids))
+        yield c
+        c.getResult()
+        backups = [self.cache(('slbCurCfgRealServerBackUp', r)) for r in reals
+                   if self.is_cached(('slbCurCfgRealServerBackUp', r))]
+        if group and self.is_cached(('slbCurCfgGroupRealServers', group)):
+            backups.extend(self.bitmap(self.cache(('slbCurCfgGroupRealServers',
+                                                   group))))
+        oids = []
+        for r in backups:
+            if r:
+                oids.extend(self.realserver_oids(v, s, g, r))
+        c = defer.waitForDeferred(self.prefetch(*oids))
+        yield c
+        c.getResult()
+
         # Find and attach real servers
-        reals = self.cache(('slbCurCfgGroupRealServers', g))
-        for r in self.bitmap(reals):
+        for r in reals:
             rs = defer.waitForDeferred(self.process_rs(v, s, g, r))
             yield rs
             rs = rs.getResult()
@@ -396,6 +429,32 @@ class AlteonCollector(GenericCollector):
         yield vs
         return
 
+    def realserver_oids(self, v, s, g, r):
+        """
+        OID needed to build a real server.
+
+        @param v: virtual server
+        @param s: service
+        @param g: group
+        @param r: real server
+        @return: a list of OID for L{cache_or_get}
+        """
+        return [('slbCurCfgRealServerIpAddr', r),
+                ('slbCurCfgRealServerName', r),
+                ('slbCurCfgVirtServiceRealPort', v, s),
+                ('slbCurCfgVirtServiceUDPBalance', v, s),
+                ('slbCurCfgRealServerWeight', r),
+                ('slbVirtServicesInfoState', v, s, r),
+                ('slbCurCfgGroupRealServerState', g, r),
+                ('slbOperGroupRealServerState', g, r),
+                ('slbOperRealServerStatus', r),
+                ('slbRealServerInfoState', r),
+                ('slbCurCfgRealServerState', r),
+                ('slbCurCfgRealServerPingInterval', r),
+                ('slbCurCfgRealServerFailRetry', r),
+                ('slbCurCfgRealServerSuccRetry', r),
+                ('slbStatRServerFailures', r)]
+
     @defer.deferredGenerator
     def process_rs(self, v, s, g, r, backup=False):
         """
@@ -410,21 +469,7 @@ class AlteonCollector(GenericCollector):
         """
         # Retrieve some data if needed:
         c = defer.waitForDeferred(self.cache_or_get(
-            ('slbCurCfgRealServerIpAddr', r),
-            ('slbCurCfgRealServerName', r),
-            ('slbCurCfgVirtServiceRealPort', v, s),
-            ('slbCurCfgVirtServiceUDPBalance', v, s),
-            ('slbCurCfgRealServerWeight', r),
-            ('slbVirtServicesInfoState', v, s, r),
-            ('slbCurCfgGroupRealServerState', g, r),
-            ('slbOperGroupRealServerState', g, r),
-            ('slbOperRealServerStatus', r),
-            ('slbRealServerInfoState', r),
-            ('slbCurCfgRealServerState', r),
-            ('slbCurCfgRealServerPingInterval', r),
-            ('slbCurCfgRealServerFailRetry', r),
-            ('slbCurCfgRealServerSuccRetry', r),
-            ('slbStatRServerFailures', r)))
+                *self.realserver_oids(v, s, g, r)))
         yield c
         c.getResult()
 
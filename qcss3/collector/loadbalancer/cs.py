@@ -40,6 +40,8 @@ class ArrowOrCsCollector(GenericCollector):
     baseoid = NotImplementedError
     kind = NotImplementedError
 
+    statusoids = [ 'apSvcState' ]
+
     modes = {
         1: 'roundrobin',
         2: 'aca',
@@ -170,19 +172,19 @@ class ArrowOrCsCollector(GenericCollector):
         @return: a deferred C{ILoadBalancer}
         """
         # Retrieve all data
-        for oid in self.oids:
-            w = defer.waitForDeferred(self.proxy.walk(self.oids[oid]))
-            yield w
-            w.getResult()
+        w = defer.waitForDeferred(self.walk(*self.oids.keys()))
+        yield w
+        w.getResult()
 
         # For each virtual server, build it
+        builders = []
         for o in self.cache('apCntIPAddress'):
             owner, content = oid2str(o)
-            vs = defer.waitForDeferred(self.process_vs(owner, content))
-            yield vs
-            vs = vs.getResult()
-            if vs is not None:
-                self.lb.virtualservers["%s|%s" % (owner, content)] = vs
+            builders.append(("%s|%s" % (owner, content),
+                             self.process_vs, (owner, content)))
+        vs = defer.waitForDeferred(self.build_virtualservers(builders))
+        yield vs
+        vs.getResult()
         yield self.lb
         return
 
@@ -226,14 +228,25 @@ class ArrowOrCsCollector(GenericCollector):
             self.cache(('apCntContentType', oowner, ocontent))]
 
         # Find and attach real servers
-        if not self.is_cached(('apCntsvcSvcName', oowner, ocontent)):
+        if not self.is_cached(('apCntsvcSvcName', oowner, ocontent)) and \
+                not self.is_missing(('apCntsvcSvcName', oowner, ocontent)):
             services = defer.waitForDeferred(
                 self.proxy.walk("%s.%s.%s" % (self.oids['apCntsvcSvcName'],
                                               oowner, ocontent)))
             yield services
             services.getResult()
-        for r in self.cache(('apCntsvcSvcName', oowner, ocontent)):
-            service = oid2str(r)
+        services = [oid2str(r)
+                    for r in self.cache(('apCntsvcSvcName', oowner, ocontent))]
+        backups = [s for s in self.cache(('apCntPrimarySorryServer', oowner, ocontent),
+                                         ('apCntSecondSorryServer', oowner, ocontent))
+                   if s]
+        oids = []
+        for service in services + backups:
+            oids.extend(self.realserver_oids(service))
+        c = defer.waitForDeferred(self.prefetch(*oids))
+        yield c
+        c.getResult()
+        for service in services:
             rs = defer.waitForDeferred(self.process_rs(owner, content, service))
             yield rs
             rs = rs.getResult()
@@ -254,6 +267,16 @@ class ArrowOrCsCollector(GenericCollector):
         yield vs
         return
 
+    def realserver_oids(self, service):
+        """
+        OID needed to build a real server.
+
+        @param service: service name
+        @return: a list of OID for L{cache_or_get}
+        """
+        oservice = str2oid(service)
+        return [(o, oservice) for o in self.oids if o.startswith("apSvc")]
+
     @defer.deferredGenerator
     def process_rs(self, owner, content, service, backup=False):
         """
@@ -267,12 +290,7 @@ class ArrowOrCsCollector(GenericCollector):
         """
         oservice = str2oid(service)
         # Retrieve some data if needed:
-        oids = []
-        for o in self.oids:
-            if o.startswith("apSvc"):
-                oids.append((o, oservice))
-        oids = tuple(oids)
-        c = defer.waitForDeferred(self.cache_or_get(*oids))
+        c = defer.waitForDeferred(self.prefetch(*self.realserver_oids(service)))
         yield c
         c.getResult()
 
@@ -63,6 +63,28 @@ class F5LTMCollector(GenericCollector):
         'ltmVsStatusDetailReason': '.1.3.6.1.4.1.3375.2.2.10.13.2.1.5',
         }
 
+    statusoids = [
+        'ltmPoolStatusAvailState',
+        'ltmPoolStatusEnabledState',
+        'ltmPoolStatusDetailReason',
+        'ltmPoolMemberSessionStatus',
+        'ltmPoolMbrStatusAvailState',
+        'ltmPoolMbrStatusEnabledState',
+        'ltmPoolMbrStatusDetailReason',
+        'ltmVsStatusAvailState',
+        'ltmVsStatusEnabledState',
+        'ltmVsStatusDetailReason',
+        ]
+    statusextras = [
+        'vs availability state',
+        'vs enabled state',
+        'virtual server detailed reason',
+        'pool availability state',
+        'pool enabled state',
+        'pool detailed reason',
+        'detailed reason',
+        ]
+
     kind = "F5 LTM"
     modes = {
 		0: 'round robin',
@@ -146,12 +168,12 @@ class F5LTMCollector(GenericCollector):
         Process data when no virtual server and no real server are provided.
         """
         # Retrieve all data
-        for oid in self.oids:
-            w = defer.waitForDeferred(self.proxy.walk(self.oids[oid]))
-            yield w
-            w.getResult()
+        w = defer.waitForDeferred(self.walk(*self.oids.keys()))
+        yield w
+        w.getResult()
 
         # For each virtual server, build it
+        builders = []
         for ov in self.cache('ltmVirtualServAddrType'):
             # Grab HTTP class
             try:
@@ -160,14 +182,14 @@ class F5LTMCollector(GenericCollector):
                 classes = []
             for httpclass in classes + [None]:
                 v = oid2str(ov)
-                vs = defer.waitForDeferred(self.process_vs(v, httpclass))
-                yield vs
-                vs = vs.getResult()
-                if vs is not None:
-                    if httpclass is not None:
-                        self.lb.virtualservers["%s;%s" % (v, httpclass)] = vs
-                    else:
-                        self.lb.virtualservers[v] = vs
+                if httpclass is not None:
+                    key = "%s;%s" % (v, httpclass)
+                else:
+                    key = v
+                builders.append((key, self.process_vs, (v, httpclass)))
+        vs = defer.waitForDeferred(self.build_virtualservers(builders))
+        yield vs
+        vs.getResult()
         yield self.lb
         return
 
@@ -187,8 +209,9 @@ class F5LTMCollector(GenericCollector):
             if o.startswith("ltmVirtualServ") or o.startswith("ltmVs"):
                 if not o.startswith("ltmVirtualServProfile"):
                     oids.append((o, ov))
-        oids = tuple(oids)
-        c = defer.waitForDeferred(self.cache_or_get(*oids))
+        if httpclass is not None:
+            oids.append(('ltmHttpClassPoolName', str2oid(httpclass)))
+        c = defer.waitForDeferred(self.prefetch(*oids))
         yield c
         c.getResult()
 
@@ -220,8 +243,17 @@ class F5LTMCollector(GenericCollector):
             if o.startswith("ltmPool") and not o.startswith("ltmPoolMbr") and \
                     not o.startswith("ltmPoolMember"):
                 oids.append((o, op))
-        oids = tuple(oids)
-        c = defer.waitForDeferred(self.cache_or_get(*oids))
+        if not self.is_cached(('ltmPoolMbrStatusAvailState', op)) and \
+                not self.is_missing(('ltmPoolMbrStatusAvailState', op)):
+            # F5 is buggy here, we need to walk all pool members
+            oids.extend([o for o in self.oids
+                         if o.startswith('ltmPoolMbr') or
+                         o.startswith('ltmPoolMember')])
+        if not self.is_cached(('ltmVirtualServProfileType', ov)) and \
+                not self.is_missing(('ltmVirtualServProfileType', ov)):
+            # See get_protocol()
+            oids.append('ltmVirtualServProfileType')
+        c = defer.waitForDeferred(self.prefetch(*oids))
         yield c
         c.getResult()
 
@@ -258,24 +290,22 @@ class F5LTMCollector(GenericCollector):
             self.cache(('ltmPoolStatusDetailReason', op))
 
         # Find and attach real servers
-        if not self.is_cached(('ltmPoolMbrStatusAvailState', op)):
-            for o in self.oids:
-                if o.startswith('ltmPoolMbr') or o.startswith('ltmPoolMember'):
-                    # F5 is buggy here, we need to walk all pool members
-                    # pm = defer.waitForDeferred(
-                    #    self.proxy.walk("%s.%s" % (self.oids[o], op)))
-                    pm = defer.waitForDeferred(
-                        self.proxy.walk(self.oids[o]))
-                    yield pm
-                    pm.getResult()
         if not self.is_cached(('ltmPoolMbrStatusAvailState', op)):
             print "pool %s is empty..." % p
             yield None
             return
+        members = []
         for r in self.cache(('ltmPoolMbrStatusAvailState', op)):
             rip = socket.inet_ntop(r[0] == 1 and socket.AF_INET or socket.AF_INET6,
                                    struct.pack("B"*r[1], *r[-(r[1]+1):-1]))
-            port = r[-1]
+            members.append((rip, r[-1]))
+        oids = []
+        for rip, port in members:
+            oids.extend(self.realserver_oids(op, ip2oid(rip), port))
+        c = defer.waitForDeferred(self.prefetch(*oids))
+        yield c
+        c.getResult()
+        for rip, port in members:
             rs = defer.waitForDeferred(self.process_rs(v, httpclass, rip, port))
             yield rs
             rs = rs.getResult()
@@ -285,6 +315,23 @@ class F5LTMCollector(GenericCollector):
         yield vs
         return
 
+    def realserver_oids(self, op, orip, port):
+        """
+        OID needed to build a pool member.
+
+        @param op: pool as an OID string
+        @param orip: IP of the member as an OID string
+        @param port: port of the member
+        @return: a list of OID for L{cache_or_get}
+        """
+        oids = []
+        for o in self.oids:
+            if o.startswith("ltmPoolMbr") or o.startswith("ltmPoolMember"):
+                oids.append((o, op, orip, port))
+            elif o.startswith("ltmNodeAddr"):
+                oids.append((o, orip))
+        return oids
+
     @defer.deferredGenerator
     def process_rs(self, v, httpclass, rip, port):
         """
@@ -306,21 +353,7 @@ class F5LTMCollector(GenericCollector):
         yield p
         p = p.getResult()
         op = str2oid(p)
-        oids = []
-        for o in self.oids:
-            if o.startswith("ltmPoolMbr") or o.startswith("ltmPoolMember"):
-                oids.append((o, op, orip, port))
-        oids = tuple(oids)
-        c = defer.waitForDeferred(self.cache_or_get(*oids))
-        yield c
-        c.getResult()
-
-        oids = []
-        for o in self.oids:
-            if o.startswith("ltmNodeAddr"):
-                oids.append((o, orip))
-        oids = tuple(oids)
-        c = defer.waitForDeferred(self.cache_or_get(*oids))
+        c = defer.waitForDeferred(self.prefetch(*self.realserver_oids(op, orip, port)))
         yield c
         c.getResult()
 
@@ -364,9 +397,10 @@ class F5LTMCollector(GenericCollector):
         @param ov: virtual server as an OID string
         @return: deferred protocol
         """
-        if not self.is_cached(('ltmVirtualServProfileType', ov)):
+        if not self.is_cached(('ltmVirtualServProfileType', ov)) and \
+                not self.is_missing(('ltmVirtualServProfileType', ov)):
             # This OID is buggy. It is not possible to walk it
-            c = defer.waitForDeferred(self.proxy.walk(self.oids['ltmVirtualServProfileType']))
+            c = defer.waitForDeferred(self.walk('ltmVirtualServProfileType'))
             yield c
             c.getResult()
         for k in self.cache(('ltmVirtualServProfileType', ov)):
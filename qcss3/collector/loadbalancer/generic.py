@@ -10,8 +10,9 @@ vice-versa.
 """
 
 import socket
-from twisted.internet import defer
+from twisted.internet import defer, task
 
+from qcss3.collector import snmp
 from qcss3.collector.datastore import LoadBalancer
 
 def str2oid(string):
@@ -79,12 +80,26 @@ class GenericCollector:
     This generic collector needs several class variables:
      - C{oids} should be a mapping between OID names and numerical OID.
      - C{kind} should be a string defining the kind of load balancer
+     - C{statusoids} should be a list of OID names carrying the
+       operational state
+     - C{statusextras} should be a list of extra attributes carrying
+       the operational state
+
+    A collector using this class should walk OID in C{process_all()}
+    with L{walk} to be able to collect only the operational state and
+    should build virtual servers with L{build_virtualservers}. To
+    refresh a part of the load balancer, OID needed to build an
+    entity should be declared to L{prefetch} before being used.
     """
 
+    statusoids = ()
+    statusextras = ()
+
     def __init__(self, config, proxy, name, description):
         self.config = config
         self.proxy = proxy
         self.lb = LoadBalancer(name, self.kind, description)
+        self.rows = {}          # Number of rows of walked tables
 
     def _extend_oids(self, *oids):
         newoids = []
@@ -97,6 +112,178 @@ class GenericCollector:
                 newoids.append(tuple(no))
         return tuple(newoids)
 
+    @defer.deferredGenerator
+    def walk(self, *oids):
+        """
+        Walk the given OIDs, unless they have already been walked.
+
+        Columns of the same table are walked together.
+
+        @param oids: names of OID to walk
+        """
+        tables = {}
+        for o in oids:
+            if self.proxy.walked(self.oids[o]):
+                continue
+            table = ".".join(self.oids[o].split(".")[:-1])
+            tables.setdefault(table, []).append(self.oids[o])
+        for table in tables:
+            if len(tables[table]) == 1:
+                w = defer.waitForDeferred(self.proxy.walk(tables[table][0]))
+            else:
+                w = defer.waitForDeferred(self.proxy.walkmany(tables[table]))
+            yield w
+            w.getResult()
+            self.rows[table] = max([self._count(o) for o in tables[table]])
+
+    def _count(self, oid):
+        try:
+            return len(self.proxy.cache(oid))
+        except (KeyError, TypeError):
+            return 0
+
+    def walkable(self, table, rows, columns):
+        """
+        Tell if walking columns of a table is expected to need fewer
+        requests than getting some of its rows.
+
+        @param table: OID of the table
+        @param rows: number of rows needed
+        @param columns: number of columns needed
+        @return: C{False} if the size of the table is unknown
+        """
+        size = self.rows.get(table, None)
+        if size is None:
+            return False
+        tuning = self.proxy.tuning
+        gets = (rows*columns + tuning.varbinds - 1) / tuning.varbinds
+        if self.proxy.version != 2:
+            walks = (size + 1) * columns
+        elif self.proxy.use_getbulk and tuning.bulk:
+            walks = size / tuning.maxrep + 1
+        else:
+            walks = size + 1
+        return walks <= gets
+
+    @defer.deferredGenerator
+    def prefetch(self, *oids):
+        """
+        Fetch OID needed to build an entity in as few round trips as
+        possible.
+
+        OID are given like for L{cache_or_get}. An OID name without
+        index stands for the whole column. OID already cached or known
+        to not exist are skipped.
+
+        For each table, requested rows are fetched with GET requests
+        unless walking the needed columns is expected to be cheaper
+        (see L{walkable}). Whole columns are always walked. GET
+        requests and walks of different tables are all sent at once.
+        """
+        tables = {}
+        for o in oids:
+            if type(o) is not tuple:
+                if self.proxy.walked(self.oids[o]):
+                    continue
+                o = (o,)
+            elif self.is_cached(o) or self.is_missing(o):
+                continue
+            table = ".".join(self.oids[o[0]].split(".")[:-1])
+            columns, rows, whole, gets = tables.setdefault(table,
+                                                           ({}, {}, [], []))
+            columns[o[0]] = True
+            if len(o) == 1:
+                whole.append(o[0])
+            else:
+                rows[o[1:]] = True
+                gets.append(o)
+
+        dl = []
+        gets = []
+        for table in tables:
+            columns, rows, whole, tgets = tables[table]
+            if whole or self.walkable(table, len(rows), len(columns)):
+                dl.append(self.walk(*columns.keys()))
+            else:
+                gets.extend(tgets)
+        if gets:
+            d = self.proxy.get(list(self._extend_oids(*gets)))
+            # Missing OID will be reported as None by cache_or_get()
+            d.addErrback(lambda x: x.trap(snmp.SNMPNoSuchInstance,
+                                          snmp.SNMPNoSuchObject) and None)
+            dl.append(d)
+        if dl:
+            d = defer.DeferredList(dl, fireOnOneErrback=True, consumeErrors=True)
+            d.addErrback(lambda x: x.value.subFailure)
+            d = defer.waitForDeferred(d)
+            yield d
+            d.getResult()
+
+    @defer.deferredGenerator
+    def collect_status(self):
+        """
+        Collect only the operational state of the load balancer.
+
+        OID carrying the state are flushed from the cache and
+        C{process_all()} is run again. Other OID are only walked if
+        they are not in the cache.
+        """
+        self.proxy.flush(*[self.oids[o] for o in self.statusoids])
+        self.lb = LoadBalancer(self.lb.name, self.kind, self.lb.description)
+        lb = defer.waitForDeferred(self.process_all())
+        yield lb
+        lb = lb.getResult()
+        for vs in lb.virtualservers.values():
+            for entity in [vs] + vs.realservers.values():
+                for key in entity.extra.keys():
+                    if key not in self.statusextras:
+                        del entity.extra[key]
+        yield lb
+        return
+
+    @defer.deferredGenerator
+    def build_virtualservers(self, builders):
+        """
+        Build virtual servers and attach them to the load balancer.
+
+        Virtual servers are built concurrently. The number of virtual
+        servers built at the same time is set with C{concurrency} in
+        configuration. They are attached in the order of C{builders}.
+        No more virtual server is built once one of them has failed.
+
+        @param builders: list of tuples C{(key, function, args)} where
+           C{function(*args)} returns a (deferred) virtual server or
+           C{None} and C{key} is the key of the virtual server
+        """
+        results = [None]*len(builders)
+        failed = []
+
+        def build(i, function, args):
+            d = defer.maybeDeferred(function, *args)
+            d.addCallbacks(lambda vs: results.__setitem__(i, vs),
+                           lambda x: failed.append(x) or x)
+            return d
+
+        def doWork():
+            for i in range(len(builders)):
+                if failed:
+                    return
+                yield build(i, *builders[i][1:])
+
+        dl = []
+        work = doWork()
+        for i in xrange(self.config.get("concurrency", 10)):
+            d = task.coiterate(work)
+            dl.append(d)
+        d = defer.DeferredList(dl, fireOnOneErrback=True, consumeErrors=True)
+        d.addErrback(lambda x: x.value.subFailure)
+        d = defer.waitForDeferred(d)
+        yield d
+        d.getResult()
+        for i in range(len(builders)):
+            if results[i] is not None:
+                self.lb.virtualservers[builders[i][0]] = results[i]
+
     def is_cached(self, *oids):
         try:
             r = self.cache(*oids)
@@ -108,15 +295,47 @@ class GenericCollector:
                     return False
         return True
 
+    def is_missing(self, *oids):
+        """
+        Tell if OID are known to not exist on the load balancer.
+
+        An OID does not exist if the agent said so or if it is absent
+        from a subtree that has been walked. This is remembered for
+        the lifetime of the proxy cache.
+
+        @return: C{True} if all OID are known to not exist
+        """
+        for o in self._extend_oids(*oids):
+            if not self.proxy.missing(o):
+                return False
+        return True
+
     @defer.deferredGenerator
     def cache_or_get(self, *oids):
+        """
+        Retrieve OID from proxy cache or, if they are not available,
+        from the load balancer. OID known to not exist are not
+        requested again: with several OID, they are reported as
+        C{None}, otherwise C{SNMPNoSuchInstance} is raised like when
+        requesting them.
+        """
         if self.is_cached(*oids):
             yield self.cache(*oids)
             return
+        elif len(oids) == 1 and self.is_missing(*oids):
+            raise snmp.SNMPNoSuchInstance("No such instance exists")
         else:
-            g = defer.waitForDeferred(self.proxy.get(list(self._extend_oids(*oids))))
-            yield g
-            g.getResult()
+            missing = [o for o in oids
+                       if not self.is_cached(o) and not self.is_missing(o)]
+            if missing:
+                d = self.proxy.get(list(self._extend_oids(*missing)))
+                if len(oids) > 1:
+                    # Missing OID should be reported as None
+                    d.addErrback(lambda x: x.trap(snmp.SNMPNoSuchInstance,
+                                                  snmp.SNMPNoSuchObject) and None)
+                g = defer.waitForDeferred(d)
+                yield g
+                g.getResult()
             yield self.cache(*oids)
             return
 
@@ -54,6 +54,20 @@ class HAProxyCollector(GenericCollector):
         alServerDownTime='.1.3.6.1.4.1.23263.4.2.1.3.4.1.26',
         )
 
+    statusoids = [
+        'alFrontendStatus',
+        'alBackendStatus',
+        'alBackendDownTime',
+        'alServerStatus',
+        'alServerDownTime',
+        ]
+    statusextras = [
+        'status',
+        'backend status',
+        'down time',
+        'backend down time',
+        ]
+
     kind = "HAProxy"
 
     def parse(self, vs=None, rs=None):
@@ -103,18 +117,16 @@ class HAProxyCollector(GenericCollector):
         @return: a deferred C{ILoadBalancer}
         """
         # Retrieve all data
-        for oid in self.oids:
-            w = defer.waitForDeferred(self.proxy.walk(self.oids[oid]))
-            yield w
-            w.getResult()
+        w = defer.waitForDeferred(self.walk(*self.oids.keys()))
+        yield w
+        w.getResult()
 
         # For each virtual server, build it
-        for pid, front in self.cache('alFrontendName'):
-            vs = defer.waitForDeferred(self.process_vs(pid, front))
-            yield vs
-            vs = vs.getResult()
-            if vs is not None:
-                self.lb.virtualservers["p%d,f%d" % (pid, front)] = vs
+        builders = [("p%d,f%d" % (pid, front), self.process_vs, (pid, front))
+                    for pid, front in self.cache('alFrontendName')]
+        vs = defer.waitForDeferred(self.build_virtualservers(builders))
+        yield vs
+        vs.getResult()
         yield self.lb
         return
 
@@ -149,7 +161,8 @@ class HAProxyCollector(GenericCollector):
         vs.extra["status"] = self.cache(('alFrontendStatus', pid, front))
 
         # Find and attach real servers
-        if not self.is_cached(('alBackendName', pid, 1)):
+        if not self.is_cached(('alBackendName', pid, 1)) and \
+                not self.is_missing(('alBackendName', pid)):
             backends = defer.waitForDeferred(
                 self.proxy.walk("%s.%d" % (self.oids['alBackendName'], pid)))
             yield backends
@@ -159,7 +172,8 @@ class HAProxyCollector(GenericCollector):
                     bname.startswith("%s--" % fname) or \
                     bname.startswith("%s--" % sfname):
                 # This backend matches. We need to fetch associated servers
-                if not self.is_cached(('alServerName', pid, bid, 1)):
+                if not self.is_cached(('alServerName', pid, bid, 1)) and \
+                        not self.is_missing(('alServerName', pid, bid)):
                     servers = defer.waitForDeferred(
                         self.proxy.walk("%s.%d.%d" % (self.oids['alServerName'], pid, bid)))
                     yield servers
@@ -172,6 +186,12 @@ class HAProxyCollector(GenericCollector):
                     log.msg("In %r, for backend %s, no servers, skip it" % (self.lb.name, bname))
                     yield None
                     return
+                oids = []
+                for rid in servers:
+                    oids.extend(self.realserver_oids(pid, bid, rid))
+                c = defer.waitForDeferred(self.prefetch(*oids))
+                yield c
+                c.getResult()
                 for rid in servers:
                     # Fetch information for each real server
                     rs = defer.waitForDeferred(self.process_rs(pid, bid, rid))
@@ -183,26 +203,36 @@ class HAProxyCollector(GenericCollector):
         yield vs
         return
 
-    @defer.deferredGenerator
-    def process_rs(self, pid, bid, rid):
+    def realserver_oids(self, pid, bid, rid):
         """
-        Process data for a given virtual server and real server.
+        OID needed to build a real server.
 
         @param pid: process ID of the instance managing the real server
         @param bid: backend ID of the real server
         @param rid: server ID of the real server
-
-        @return: a deferred C{IRealServer} or None
+        @return: a list of OID for L{cache_or_get}
         """
-        # Retrieve some data if needed:
         oids = []
         for o in self.oids:
             if o.startswith("alBackend"):
                 oids.append((o, pid, bid))
             elif o.startswith("alServer"):
                 oids.append((o, pid, bid, rid))
-        oids = tuple(oids)
-        c = defer.waitForDeferred(self.cache_or_get(*oids))
+        return oids
+
+    @defer.deferredGenerator
+    def process_rs(self, pid, bid, rid):
+        """
+        Process data for a given virtual server and real server.
+
+        @param pid: process ID of the instance managing the real server
+        @param bid: backend ID of the real server
+        @param rid: server ID of the real server
+
+        @return: a deferred C{IRealServer} or None
+        """
+        # Retrieve some data if needed:
+        c = defer.waitForDeferred(self.prefetch(*self.realserver_oids(pid, bid, rid)))
         yield c
         c.getResult()
 
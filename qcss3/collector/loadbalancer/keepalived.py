@@ -74,6 +74,21 @@ class KeepalivedCollector(GenericCollector):
         'realServerFailedChecks': '.1.3.6.1.4.1.9586.100.5.3.4.1.13',
         }
 
+    statusoids = [
+        'virtualServerStatus',
+        'virtualServerRealServersUp',
+        'virtualServerQuorumStatus',
+        'realServerStatus',
+        'realServerWeight',
+        'realServerFailedChecks',
+        ]
+    statusextras = [
+        'virtual server status',
+        'quorum status',
+        'real servers',
+        'failed checks',
+        ]
+
     kind = "KeepAlived"
     grouptypes = {
         1: "fwmark",
@@ -155,18 +170,16 @@ class KeepalivedCollector(GenericCollector):
         @return: a deferred C{ILoadBalancer}
         """
         # Retrieve all data
-        for oid in self.oids:
-            w = defer.waitForDeferred(self.proxy.walk(self.oids[oid]))
-            yield w
-            w.getResult()
+        w = defer.waitForDeferred(self.walk(*self.oids.keys()))
+        yield w
+        w.getResult()
 
         # For each virtual server, build it
-        for v in self.cache('virtualServerType'):
-            vs = defer.waitForDeferred(self.process_vs(v))
-            yield vs
-            vs = vs.getResult()
-            if vs is not None:
-                self.lb.virtualservers["v%d" % v] = vs
+        builders = [("v%d" % v, self.process_vs, (v,))
+                    for v in self.cache('virtualServerType')]
+        vs = defer.waitForDeferred(self.build_virtualservers(builders))
+        yield vs
+        vs.getResult()
         yield self.lb
         return
 
@@ -207,7 +220,8 @@ class KeepalivedCollector(GenericCollector):
             name = self.cache(('virtualServerNameOfGroup', v))
 
             # We need to search for the group name in all groups
-            if not self.is_cached(('virtualServerGroupName', 1)):
+            if not self.is_cached(('virtualServerGroupName', 1)) and \
+                    not self.is_missing('virtualServerGroupName'):
                 groups = defer.waitForDeferred(self.proxy.walk(
                         self.oids['virtualServerGroupName']))
                 yield groups
@@ -216,7 +230,8 @@ class KeepalivedCollector(GenericCollector):
             for g in self.cache('virtualServerGroupName'):
                 if self.cache(('virtualServerGroupName', g)) == name:
                     # We found our group! Let's retrieve some information on it
-                    if not self.is_cached(('virtualServerGroupMemberType', g)):
+                    if not self.is_cached(('virtualServerGroupMemberType', g)) and \
+                            not self.is_missing(('virtualServerGroupMemberType', g)):
                         for o in self.oids:
                             if o.startswith('virtualServerGroupMember'):
                                 groups = defer.waitForDeferred(self.proxy.walk(
@@ -311,12 +326,20 @@ class KeepalivedCollector(GenericCollector):
                 ('virtualServerRealServersTotal', v)))
 
         # Find and attach real servers
-        if not self.is_cached(('realServerType', v, 1)):
+        if not self.is_cached(('realServerType', v, 1)) and \
+                not self.is_missing(('realServerType', v)):
             reals = defer.waitForDeferred(
                 self.proxy.walk("%s.%d" % (self.oids['realServerType'], v)))
             yield reals
             reals.getResult()
-        for r in self.cache(('realServerType', v)):
+        reals = self.cache(('realServerType', v)).keys()
+        oids = []
+        for r in reals:
+            oids.extend(self.realserver_oids(v, r))
+        c = defer.waitForDeferred(self.prefetch(*oids))
+        yield c
+        c.getResult()
+        for r in reals:
             rs = defer.waitForDeferred(self.process_rs(v, r))
             yield rs
             rs = rs.getResult()
@@ -326,6 +349,20 @@ class KeepalivedCollector(GenericCollector):
         yield vs
         return
 
+    def realserver_oids(self, v, r):
+        """
+        OID needed to build a real server.
+
+        @param v: virtual server
+        @param r: real server
+        @return: a list of OID for L{cache_or_get}
+        """
+        oids = [('virtualServerProtocol', v)]
+        for o in self.oids:
+            if o.startswith("realServer"):
+                oids.append((o, v, r))
+        return oids
+
     @defer.deferredGenerator
     def process_rs(self, v, r):
         """
@@ -337,12 +374,7 @@ class KeepalivedCollector(GenericCollector):
         @return: a deferred C{IRealServer} or None
         """
         # Retrieve some data if needed:
-        oids = []
-        for o in self.oids:
-            if o.startswith("realServer"):
-                oids.append((o, v, r))
-        oids = tuple(oids)
-        c = defer.waitForDeferred(self.cache_or_get(*oids))
+        c = defer.waitForDeferred(self.prefetch(*self.realserver_oids(v, r)))
         yield c
         c.getResult()
 
@@ -429,8 +461,9 @@ class KeepalivedCollector(GenericCollector):
             return
         if action == "enableall" or action == "disableall":
             # We need to find all the appropriate servers. We walk
-            # realServerAdress for this, right now.
-            d = defer.waitForDeferred(self.proxy.walk(self.oids['realServerAddress']))
+            # realServerAdress for this since servers are matched by
+            # address.
+            d = defer.waitForDeferred(self.prefetch('realServerAddress'))
             yield d
             d.getResult()
             match = []
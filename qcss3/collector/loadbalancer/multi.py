@@ -28,34 +28,39 @@ class MultiCollector:
             collector = p.buildCollector(config, proxy, name, description)
             self.collectors[p] = collector
 
-    def collect(self, vs, rs):
+    def packresults(self, results):
+        """
+        Pack results from several collectors into one load balancer.
 
-        def packresults(results):
-            kinds = []
-            extra = {}
-            actions = {}
-            virtualservers = {}
-            for (success, value) in results:
-                if not success: # An errback has been fired in this case
-                    continue
-                kinds.append(value.kind)
-                extra.update([("%s@%s" % (k, value.kind), v)
-                              for (k,v) in value.extra.items()])
-                actions.update([("%s@%s" % (k, value.kind), v)
-                                for (k,v) in value.actions.items()])
-                virtualservers.update([("%s@%s" % (k, value.kind), v)
-                                       for (k,v) in value.virtualservers.items()])
-            lb = LoadBalancer(self.name, " + ".join(kinds), self.description)
-            lb.extra = extra
-            lb.actions = actions
-            lb.virtualservers = virtualservers
-            return lb
+        @param results: results of a C{DeferredList} of load balancers
+        @return: a load balancer
+        """
+        kinds = []
+        extra = {}
+        actions = {}
+        virtualservers = {}
+        for (success, value) in results:
+            if not success: # An errback has been fired in this case
+                continue
+            kinds.append(value.kind)
+            extra.update([("%s@%s" % (k, value.kind), v)
+                          for (k,v) in value.extra.items()])
+            actions.update([("%s@%s" % (k, value.kind), v)
+                            for (k,v) in value.actions.items()])
+            virtualservers.update([("%s@%s" % (k, value.kind), v)
+                                   for (k,v) in value.virtualservers.items()])
+        lb = LoadBalancer(self.name, " + ".join(kinds), self.description)
+        lb.extra = extra
+        lb.actions = actions
+        lb.virtualservers = virtualservers
+        return lb
 
+    def collect(self, vs, rs):
         if vs is None:
             # Collect all load balancers
             d = defer.DeferredList([collector.collect(None, None)
                                     for collector in self.collectors.values()])
-            d.addCallback(packresults)
+            d.addCallback(self.packresults)
             return d
         # Collect a given virtual server. Let's spot the collector that handles it
         rvs, rkind = vs.rsplit("@", 1)
@@ -63,6 +68,17 @@ class MultiCollector:
             if self.collectors[c].kind == rkind:
                 return self.collectors[c].collect(rvs, rs)
 
+    def collect_status(self):
+        """
+        Collect only the operational state with each collector.
+
+        @return: a load balancer packed with L{packresults} (deferred)
+        """
+        d = defer.DeferredList([collector.collect_status()
+                                for collector in self.collectors.values()])
+        d.addCallback(self.packresults)
+        return d
+
     def execute(self, action, actionargs=None, vs=None, rs=None):
         if vs is None:
             # Actions are suffixed by the backend to use
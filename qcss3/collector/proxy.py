@@ -2,26 +2,485 @@
 SNMP proxy
 """
 
+import time
+import bisect
+
 import snmp
 from snmp import AgentProxy as original_AgentProxy
-from twisted.internet import defer
+from twisted.internet import defer, reactor
+from twisted.python import log, failure
+
+from qcss3.collector.exception import AgentDown
 
 def translateOid(oid):
     return [int(x) for x in oid.split(".") if x]
 
+def oidTuple(oid):
+    """Convert an OID (as a string or as a tuple) into a tuple of integers"""
+    if type(oid) is tuple:
+        return oid
+    return tuple(translateOid(oid))
+
+def oidString(oid):
+    """Convert an OID (as a string or as a tuple) into a string"""
+    if type(oid) is tuple:
+        return ".%s" % ".".join([str(o) for o in oid])
+    return oid
+
+class OidCache(object):
+    """
+    Cache of OID values.
+
+    Values are stored in a dictionary whose keys are OID as strings
+    or, if C{tuples} is C{True}, as tuples of integers. To answer
+    prefix queries by bisection, a sorted list of those keys, as
+    tuples of integers, is maintained. New keys are merged into the
+    sorted list only when needed.
+    """
+
+    def __init__(self, tuples=False):
+        self.tuples = tuples
+        self.clear()
+
+    def clear(self):
+        self._values = {}
+        self._index = []        # Sorted list of (tuple, key)
+        self._pending = []      # Keys not yet in the index
+
+    def _key(self, oid):
+        if self.tuples:
+            return oidTuple(oid)
+        return oidString(oid)
+
+    def _sorted(self):
+        if self._pending:
+            if self.tuples:
+                self._index.extend([(o, o) for o in self._pending])
+            else:
+                self._index.extend([(tuple(translateOid(o)), o)
+                                    for o in self._pending])
+            self._index.sort()
+            self._pending = []
+        return self._index
+
+    def _range(self, oid):
+        """Return the bounds of the subtree of C{oid} in the index"""
+        index = self._sorted()
+        start = bisect.bisect_left(index, (oid,))
+        end = bisect.bisect_left(index, (oid + (1L << 32,),), start)
+        return start, end
+
+    def update(self, results):
+        """
+        Add new values.
+
+        @param results: a dictionary mapping OID to values
+        """
+        values = self._values
+        for o in results:
+            k = self._key(o)
+            if k not in values:
+                self._pending.append(k)
+            values[k] = results[o]
+
+    def get(self, oid):
+        """
+        Get a value or a subtree.
+
+        @param oid: OID as a string
+        @return: the value or, for a subtree, a dictionary whose keys
+           are prefix-stripped OID as a tuple of integers or as a
+           simple integer.
+        """
+        c = self._values.get(self._key(oid), None)
+        if c is not None:
+            return c
+        # Check if we have a prefix
+        oid = oidTuple(oid)
+        start, end = self._range(oid)
+        index = self._index
+        values = self._values
+        l = len(oid)
+        r = {}
+        for i in xrange(start, end):
+            t, o = index[i]
+            if len(t) == l + 1:
+                r[t[l]] = values[o]
+            elif len(t) > l:
+                r[t[l:]] = values[o]
+        if not r:
+            raise KeyError("%r is not available in cache" % oidString(oid))
+        return r
+
+    def remove(self, oid):
+        """
+        Remove an OID and its subtree.
+
+        @param oid: OID as a string
+        """
+        start, end = self._range(oidTuple(oid))
+        for t, o in self._index[start:end]:
+            del self._values[o]
+        del self._index[start:end]
+
+    def __len__(self):
+        return len(self._values)
+
+class BulkTuning(object):
+    """
+    Transport parameters learned for an agent.
+
+    The number of repetitions for GETBULK is grown while responses
+    are full and the round-trip time stays flat. It is shrunk when
+    the agent answers with tooBig or does not answer. If the agent
+    rejects GETBULK, GETNEXT is used instead until GETBULK is probed
+    again C{reprobe} seconds later.
+
+    The number of OID in a GET request is also shrunk when the agent
+    answers with tooBig.
+    """
+
+    minimum = 1
+    initial = 10
+    maximum = 100
+    maxvarbinds = 30
+    reprobe = 3600
+
+    def __init__(self, ip):
+        self.ip = ip
+        self.disabled = None    # When GETBULK was disabled
+        self.maxrep = self.initial
+        self.ceiling = self.maximum
+        self.varbinds = self.maxvarbinds
+        self.rtt = None
+
+    def success(self, rtt, full):
+        """
+        Account a successful GETBULK request.
+
+        @param rtt: round-trip time of the request
+        @param full: C{True} if the agent returned as many values as asked
+        """
+        flat = self.rtt is None or rtt <= self.rtt * 1.5
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt = 0.875*self.rtt + 0.125*rtt
+        if full and flat and self.maxrep < self.ceiling:
+            self.maxrep = min(self.ceiling, self.maxrep + (self.maxrep + 1)/2)
+
+    def shrink(self, toobig=False):
+        """
+        Reduce the number of repetitions for GETBULK.
+
+        @param toobig: C{True} if the agent answered with tooBig. In
+           this case, the current value is never tried again.
+        @return: C{False} if the number of repetitions was already minimal
+        """
+        if toobig:
+            self.ceiling = max(self.minimum, self.maxrep - 1)
+        if self.maxrep <= self.minimum:
+            return False
+        self.maxrep = max(self.minimum, self.maxrep / 2)
+        log.msg("Use %d repetitions for GETBULK with %s" % (self.maxrep, self.ip))
+        return True
+
+    def toobig(self, varbinds):
+        """
+        Account a GET request answered with tooBig.
+
+        @param varbinds: number of OID in the request
+        """
+        if varbinds / 2 < self.varbinds:
+            self.varbinds = max(1, varbinds / 2)
+            log.msg("Use at most %d OID in GET requests with %s" % (self.varbinds,
+                                                                    self.ip))
+
+    def disable(self):
+        """Use GETNEXT instead of GETBULK for this agent for a while"""
+        if self.disabled is None:
+            log.msg("Use GETNEXT instead of GETBULK with %s" % self.ip)
+        self.disabled = time.time()
+
+    def _get_bulk(self):
+        if self.disabled is not None and \
+                time.time() - self.disabled >= self.reprobe:
+            log.msg("Try GETBULK again with %s" % self.ip)
+            self.disabled = None
+        return self.disabled is None
+    bulk = property(_get_bulk)
+
+    def state(self):
+        """Return learned parameters as a dictionary"""
+        return {'bulk': self.bulk,
+                'max repetitions': self.maxrep,
+                'max varbinds': self.varbinds,
+                'rtt': self.rtt is not None and round(self.rtt, 3) or None}
+
+class RetransmitTimer(object):
+    """
+    Retransmission timeout learned for an agent.
+
+    The timeout is computed from the smoothed round-trip time and its
+    variance, like TCP does (RFC 6298). It is doubled on each retry,
+    up to C{maxtimeout}. Retried requests are not used to measure the
+    round-trip time since we don't know which one was answered.
+
+    After C{down} requests in a row without answer, the agent is
+    considered down and requests fail at once during C{holddown}
+    seconds. Set C{down} to 0 to never consider an agent down.
+    """
+
+    timeout = 1.
+    mintimeout = 0.2
+    maxtimeout = 10.
+    retries = 2
+    down = 3
+    holddown = 60
+
+    def __init__(self, ip):
+        self.ip = ip
+        self.srtt = None
+        self.rttvar = None
+        self.rto = self.timeout
+        self.timeouts = 0
+        self.since = None
+
+    def configure(self, overrides):
+        """
+        Override default parameters for this agent.
+
+        @param overrides: dictionary whose keys are C{timeout},
+           C{mintimeout}, C{maxtimeout}, C{retries}, C{down} or C{holddown}
+        """
+        for key in overrides:
+            if key not in ["timeout", "mintimeout", "maxtimeout",
+                           "retries", "down", "holddown"]:
+                raise ValueError("unknown transport parameter %r for %s" % (key,
+                                                                            self.ip))
+            setattr(self, key, overrides[key])
+        if self.srtt is None:
+            self.rto = self.timeout
+
+    def sample(self, rtt):
+        """
+        Account the round-trip time of a request answered at first try.
+
+        @param rtt: round-trip time in seconds
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75*self.rttvar + 0.25*abs(self.srtt - rtt)
+            self.srtt = 0.875*self.srtt + 0.125*rtt
+        self.rto = min(self.maxtimeout,
+                       max(self.mintimeout, self.srtt + max(0.01, 4*self.rttvar)))
+
+    def backoff(self, retry):
+        """
+        Get the timeout to use for a request.
+
+        @param retry: number of times the request has already been sent
+        @return: timeout in seconds
+        """
+        return min(self.maxtimeout, self.rto * (2 ** retry))
+
+    def alive(self):
+        """Account an answer from the agent"""
+        if self.since is not None:
+            log.msg("%s is answering again" % self.ip)
+        self.timeouts = 0
+        self.since = None
+
+    def expired(self):
+        """Account a request without answer after all retries"""
+        self.timeouts += 1
+        if self.down and self.timeouts >= self.down:
+            if self.since is None:
+                log.msg("%s did not answer to %d requests in a row, "
+                        "consider it down" % (self.ip, self.timeouts))
+            self.since = time.time()
+
+    def isdown(self):
+        """
+        Tell if the agent should be considered down.
+
+        @return: C{True} if requests should fail without being sent
+        """
+        return self.since is not None and \
+            time.time() - self.since < self.holddown
+
+    def state(self):
+        """Return learned parameters as a dictionary"""
+        state = {'rto': round(self.rto, 3),
+                 'down': self.isdown(),
+                 'srtt': None,
+                 'rttvar': None}
+        if self.srtt is not None:
+            state['srtt'] = round(self.srtt, 3)
+            state['rttvar'] = round(self.rttvar, 3)
+        return state
+
 class WalkAgentProxy(original_AgentProxy):
     """Act like AgentProxy but handles walking itself"""
 
     use_getbulk = True
+    tunings = {}
+    timers = {}
+    recorder = None             # See qcss3.collector.recording
+
+    def __init__(self, *args, **kwargs):
+        # Retries are handled by us, see _request()
+        kwargs["retries"] = 0
+        original_AgentProxy.__init__(self, *args, **kwargs)
+
+    @classmethod
+    def forget(cls, ip):
+        """
+        Forget transport parameters learned for an agent.
+
+        @param ip: IP of the agent
+        """
+        cls.tunings.pop(ip, None)
+        cls.timers.pop(ip, None)
+
+    def _get_tuning(self):
+        if self.ip not in self.tunings:
+            self.tunings[self.ip] = BulkTuning(self.ip)
+        return self.tunings[self.ip]
+    tuning = property(_get_tuning)
+
+    def _get_timer(self):
+        if self.ip not in self.timers:
+            self.timers[self.ip] = RetransmitTimer(self.ip)
+        return self.timers[self.ip]
+    timer = property(_get_timer)
+
+    def _request(self, request, *args):
+        """
+        Send a request to the agent.
+
+        The request is retried with an increasing timeout if the
+        agent does not answer. If the agent is considered down, the
+        request fails with L{AgentDown} without being sent.
+
+        @param request: unbound method of the SNMP module to use
+        @return: the result of the request (deferred)
+        """
+        timer = self.timer
+        if timer.isdown():
+            return defer.fail(AgentDown("%s is considered down" % self.ip))
+        return self._attempt(timer, 0, request, *args)
+
+    def _attempt(self, timer, retry, request, *args):
+
+        def success(results):
+            if not retry:
+                timer.sample(time.time() - start)
+            timer.alive()
+            return results
+
+        def error(failure):
+            if str(failure.value) != "Timeout":
+                if failure.check(snmp.SNMPException) and \
+                        failure.type is not snmp.SNMPException:
+                    # This is an error reported by the agent
+                    timer.alive()
+                return failure
+            if retry < timer.retries:
+                return self._attempt(timer, retry + 1, request, *args)
+            timer.expired()
+            return failure
+
+        self.timeout = timer.backoff(retry)
+        start = time.time()
+        d = self._send(request, *args)
+        d.addCallbacks(success, error)
+        return d
+
+    def _send(self, request, *args):
+        """
+        Send a request on the wire.
+
+        If a recorder is attached to the proxy, the request and its
+        result are recorded.
+
+        @param request: unbound method of the SNMP module to use
+        @return: the result of the request (deferred)
+        """
+        d = request(self, *args)
+        if self.recorder is not None:
+            self.recorder.record(request.__name__, args, d)
+        return d
+
+    def get(self, oid):
+        return self._request(original_AgentProxy.get, oid)
+
+    def getnext(self, oid):
+        return self._request(original_AgentProxy.getnext, oid)
+
+    def set(self, *args):
+        return self._request(original_AgentProxy.set, *args)
 
     def getbulk(self, oid, *args):
-        if self.use_getbulk and self.version == 2:
-            return original_AgentProxy.getbulk(self, oid, *args)
+        """
+        GETBULK request.
+
+        Unless specified, the number of repetitions is learned for
+        each agent. GETNEXT is used if the agent does not support
+        GETBULK.
+        """
+        if self.use_getbulk and self.version == 2 and self.tuning.bulk:
+            if args:
+                return self._request(original_AgentProxy.getbulk, oid, *args)
+            return self._getbulk(oid, self.tuning)
+        return self._getnext(oid)
+
+    def _getnext(self, oid):
         d = self.getnext(oid)
         d.addErrback(lambda x: x.trap(snmp.SNMPEndOfMibView,
                                       snmp.SNMPNoSuchName) and {})
         return d
 
+    def _getbulk(self, oid, tuning, retried=False):
+
+        def success(results):
+            count = type(oid) is list and len(oid) or 1
+            tuning.success(time.time() - start,
+                           len(results) >= maxrep*count)
+            return results
+
+        def fallback(failure):
+            # Try GETNEXT, if it works, the agent does not handle
+            # GETBULK properly.
+            d = self._getnext(oid)
+            d.addCallbacks(lambda x: tuning.disable() or x,
+                           lambda x: failure)
+            return d
+
+        def error(failure):
+            if failure.check(snmp.SNMPTooBig):
+                if tuning.shrink(True):
+                    return self._getbulk(oid, tuning, retried)
+                return fallback(failure)
+            if failure.check(snmp.SNMPGenerr, snmp.SNMPBadValue):
+                # The agent rejects the GETBULK PDU
+                return fallback(failure)
+            if failure.check(snmp.SNMPException) and \
+                    str(failure.value) == "Timeout":
+                # Only retry once: the agent may just be down. A
+                # timeout does not tell that GETBULK is unsupported.
+                if not retried and tuning.shrink():
+                    return self._getbulk(oid, tuning, True)
+            return failure
+
+        maxrep = tuning.maxrep
+        start = time.time()
+        d = self._request(original_AgentProxy.getbulk, oid, maxrep)
+        d.addCallbacks(success, error)
+        return d
+
     def walk(self, oid):
         """
         Real walking.
@@ -30,15 +489,42 @@ class WalkAgentProxy(original_AgentProxy):
         """
         return Walker(self, oid)()
 
+    def walkmany(self, oids):
+        """
+        Walk several columns of a table at once.
+
+        Each GETBULK request contains all the columns that are not
+        completely walked. With SNMPv1, each column is walked
+        separately.
+
+        Return the list of oid retrieved
+        """
+        if self.version != 2:
+            d = defer.DeferredList([Walker(self, oid)() for oid in oids],
+                                   fireOnOneErrback=True, consumeErrors=True)
+            d.addCallback(lambda x: reduce(lambda r, y: r.update(y[1]) or r, x, {}))
+            d.addErrback(lambda x: x.value.subFailure)
+            return d
+        return TableWalker(self, oids)()
+
 class AgentProxy(WalkAgentProxy):
     """
     Intelligent SNMP proxy.
 
     Features:
       - GET, GETBULK, GETNEXT
-      - WALK
+      - WALK, including several columns at once
+      - GET requests made at the same time are merged
+      - requests identical to a request in progress are not sent again
       - cache results
       - SET with a different proxy
+      - timeout learned for each agent, fail at once if it is down
+
+    If C{tupleoids} is set, OID are returned by the agent as tuples of
+    integers. This avoids to convert them into strings and back when
+    walking. Results of walks also use such tuples. If C{direct} is
+    set, results are delivered as soon as they are received instead
+    of the next reactor turn.
 
     Each operation can an OID or a list of OID. Each OID can be a
     string or a tuple. In this case, the tuple elements will be
@@ -50,16 +536,246 @@ class AgentProxy(WalkAgentProxy):
      - [(".1.3.6.1.2.1.1", 1, 0), ".1.3.6.1.2.1.1.3.0"]
     """
 
+    use_tupleoids = False
+    use_direct = False
+
     def __init__(self, *args, **kwargs):
-        self._cache = {}
+        kwargs.setdefault("tupleoids", self.use_tupleoids)
+        kwargs.setdefault("direct", self.use_direct)
+        self._cache = OidCache(kwargs["tupleoids"])
+        self._walked = {}       # Walked subtrees
+        self._missing = {}      # OID reported as missing by the agent
+        self._gets = []         # GET requests to be sent
+        self._getcall = None
+        self._inflight = {}     # Requests in progress
         self._wproxy = None     # Write proxy
         if "wcommunity" in kwargs:
             self._wcommunity = kwargs["wcommunity"]
             del kwargs["wcommunity"]
         else:
             self._wcommunity = None
+        if "transport" in kwargs:
+            transport = kwargs["transport"]
+            del kwargs["transport"]
+        else:
+            transport = {}
         self.writable = self._wcommunity is not None
-        return WalkAgentProxy.__init__(self, *args, **kwargs)
+        WalkAgentProxy.__init__(self, *args, **kwargs)
+        self.timer.configure(transport)
+
+    def _batched_get(self, oid):
+        """
+        GET request.
+
+        The request is sent at the next reactor turn, merged with
+        other GET requests made in the meantime. Duplicate OID are
+        requested once and OID are packed in as few requests as
+        allowed by the agent.
+        """
+        if type(oid) is not list:
+            oid = [oid]
+        d = defer.Deferred()
+        self._gets.append((oid, d))
+        if self._getcall is None:
+            self._getcall = reactor.callLater(0, self._send_gets)
+        return d
+
+    def _single_flight(self, key, request):
+        """
+        Run a request unless the same request is already in progress.
+
+        @param key: key identifying the request
+        @param request: function to call to run the request
+        @return: a deferred firing with the result of the request
+        """
+        if key in self._inflight:
+            return self._join(key)
+        self._inflight[key] = []
+        d = self._join(key)
+        # A request failing at once should not stay in progress
+        r = defer.maybeDeferred(request)
+        r.addBoth(self._land, key)
+        return d
+
+    def _join(self, key):
+        """Get a deferred firing with the result of a request in progress"""
+        d = defer.Deferred()
+        self._inflight[key].append(d)
+        return d
+
+    def _land(self, result, key):
+        """Dispatch the result of a request to all its waiters"""
+        for d in self._inflight.pop(key):
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            elif type(result) is dict:
+                d.callback(result.copy())
+            else:
+                d.callback(result)
+
+    def _send_gets(self):
+        self._getcall = None
+        gets, self._gets = self._gets, []
+        oids = []
+        seen = {}
+        valid = []
+        for o, d in gets:
+            try:
+                ts = [tuple(translateOid(oo)) for oo in o]
+            except:
+                d.errback(failure.Failure())
+                continue
+            valid.append((o, d))
+            for oo, t in zip(o, ts):
+                if t not in seen and ('get', t) not in self._inflight:
+                    self._inflight['get', t] = []
+                    oids.append((oo, t))
+                seen[t] = True
+        gets = valid
+        keys = seen.keys()
+        dl = [self._join(('get', t)) for t in keys]
+        size = self.tuning.varbinds
+        for i in range(0, len(oids), size):
+            chunk = oids[i:i+size]
+            # Keys of the chunk are in progress: they should land even
+            # when the request fails at once
+            d = defer.maybeDeferred(self._send_get, [o for o, t in chunk])
+            d.addCallbacks(lambda results, chunk:
+                               [self._land(results.get(t, (o, None, None)), ('get', t))
+                                for o, t in chunk],
+                           lambda fail, chunk:
+                               [self._land(fail, ('get', t)) for o, t in chunk],
+                           callbackArgs=(chunk,), errbackArgs=(chunk,))
+        d = defer.DeferredList(dl, consumeErrors=True)
+        d.addCallback(lambda x: dict(zip(keys,
+                                         [y[0] and y[1] or (None, None, y[1])
+                                          for y in x])))
+        d.addCallback(self._dispatch_gets, gets)
+        d.addErrback(lambda x: [dd.errback(x) for o, dd in gets if not dd.called])
+
+    def _send_get(self, oids):
+        """
+        Send a GET request on the wire.
+
+        The request is split if the agent answers with tooBig or, for
+        SNMPv1, if one of the OID does not exist. This function never
+        fails.
+
+        @return: a dictionary mapping each OID as a tuple to the OID
+            returned by the agent, its value and a failure (deferred)
+        """
+
+        def success(results):
+            r = {}
+            for o in results:
+                r[oidTuple(o)] = (o, results[o], None)
+            return r
+
+        def error(fail):
+            if len(oids) > 1 and fail.check(snmp.SNMPTooBig, snmp.SNMPNoSuchName):
+                if fail.check(snmp.SNMPTooBig):
+                    self.tuning.toobig(len(oids))
+                half = len(oids) / 2
+                d = defer.DeferredList([self._send_get(oids[:half]),
+                                        self._send_get(oids[half:])])
+                d.addCallback(lambda x: reduce(lambda r, y: r.update(y[1]) or r, x, {}))
+                return d
+            return dict([(tuple(translateOid(o)), (o, None, fail))
+                         for o in oids])
+
+        d = WalkAgentProxy.get(self, oids)
+        d.addCallbacks(success, error)
+        return d
+
+    def _dispatch_gets(self, r, gets):
+        for oids, d in gets:
+            answer = {}
+            fail = None
+            for o in oids:
+                key, value, f = r[tuple(translateOid(o))]
+                if f is not None and (len(oids) == 1 or
+                                      not f.check(snmp.SNMPNoSuchInstance,
+                                                  snmp.SNMPNoSuchObject)):
+                    fail = f
+                    break
+                answer[o] = value
+            if fail is None and len(oids) == 1 and answer[o] is None:
+                # This is what a GET for a single OID does
+                fail = failure.Failure(snmp.SNMPNoSuchInstance("No such instance exists"))
+            if fail is not None:
+                d.errback(fail)
+            else:
+                d.callback(answer)
+
+    def _shared_getnext(self, oid):
+        """GETNEXT request, shared with an identical request in progress"""
+        oids = type(oid) is list and oid or [oid]
+        key = ('getnext',) + tuple(sorted([tuple(translateOid(o)) for o in oids]))
+        return self._single_flight(key, lambda: WalkAgentProxy.getnext(self, oid))
+
+    def _covering_walk(self, oid):
+        """
+        Search for a walk in progress covering the given OID.
+
+        @param oid: OID as a tuple of integers
+        @return: the key of the walk in progress or C{None}
+        """
+        for key in self._inflight:
+            if key[0] == 'walk':
+                prefixes = [key[1]]
+            elif key[0] == 'walkmany':
+                prefixes = key[1]
+            else:
+                continue
+            for prefix in prefixes:
+                if oid[:len(prefix)] == prefix:
+                    return key
+        return None
+
+    def _subtree(self, results, oids):
+        """Keep only results in the subtree of one of the given OID"""
+        r = {}
+        for o in results:
+            t = oidTuple(o)
+            for oid in oids:
+                if t[:len(oid)] == oid:
+                    r[o] = results[o]
+                    break
+        return r
+
+    def _shared_walk(self, oid):
+        """
+        Walk, shared with a walk in progress of the same subtree or
+        of a parent.
+        """
+        t = tuple(translateOid(oid))
+        key = self._covering_walk(t)
+        if key is not None:
+            d = self._join(key)
+            d.addCallback(self._subtree, [t])
+            return d
+        return self._single_flight(('walk', t),
+                                   lambda: WalkAgentProxy.walk(self, oid))
+
+    def _shared_walkmany(self, oids):
+        """
+        Walk of several columns, shared with walks in progress
+        covering all those columns.
+        """
+        ts = [tuple(translateOid(o)) for o in oids]
+        keys = [self._covering_walk(t) for t in ts]
+        if None not in keys:
+            unique = {}
+            for key in keys:
+                unique[key] = True
+            d = defer.DeferredList([self._join(key) for key in unique],
+                                   fireOnOneErrback=True, consumeErrors=True)
+            d.addCallback(lambda x: reduce(lambda r, y: r.update(y[1]) or r, x, {}))
+            d.addErrback(lambda x: x.value.subFailure)
+            d.addCallback(self._subtree, ts)
+            return d
+        return self._single_flight(('walkmany', tuple(ts)),
+                                   lambda: WalkAgentProxy.walkmany(self, oids))
 
     def _normalize_oid(f):
         def new_f(self, oid, *args):
@@ -79,25 +795,33 @@ class AgentProxy(WalkAgentProxy):
             return d
         return new_f
 
-    @_normalize_oid
-    def _really_cache(self, oid):
+    def _record_walk(f):
+        def new_f(self, oid, *args):
+            d = f(self, oid, *args)
+            if type(oid) is list:
+                d.addCallback(lambda x: self._walked.update(
+                        dict([(o, True) for o in oid])) or x)
+            else:
+                d.addCallback(lambda x: self._walked.update({oid: True}) or x)
+            return d
+        return new_f
 
-        def str2tuple(oid):
-            oid = tuple([int(o) for o in oid.split(".")])
-            if len(oid) == 1:
-                return oid[0]
-            return oid
+    def _record_missing(f):
+        def new_f(self, oid, *args):
+            def missing(failure):
+                failure.trap(snmp.SNMPNoSuchInstance, snmp.SNMPNoSuchObject)
+                self._missing[type(oid) is list and oid[0] or oid] = True
+                return failure
+            d = f(self, oid, *args)
+            d.addCallbacks(lambda x: self._missing.update(
+                    dict([(o, True) for o in x if x[o] is None])) or x,
+                           missing)
+            return d
+        return new_f
 
-        c = self._cache.get(oid, None)
-        if c is not None:
-            return self._cache[oid]
-        # Check if we have a prefix
-        r = [(str2tuple(c[(len(oid)+1):]), self._cache[c])
-             for c in self._cache
-             if c.startswith("%s." % oid)]
-        if not r:
-            raise KeyError("%r is not available in cache" % oid)
-        return dict(r)
+    @_normalize_oid
+    def _really_cache(self, oid):
+        return self._cache.get(oid)
 
     def cache(self, *oid):
         """
@@ -124,34 +848,150 @@ class AgentProxy(WalkAgentProxy):
             return r
         return self._really_cache(oid[0])
 
+    def table(self, oids):
+        """
+        Walk several columns of the same table at once.
+
+        Results are cached like for L{walk}.
+
+        @param oids: list of columns to walk
+        @return: a dictionary whose keys are indexes (as a tuple of
+           integers or as a simple integer) and values are
+           dictionaries mapping columns to their values (deferred)
+        """
+
+        def rows(results):
+            r = {}
+            for oid in oids:
+                try:
+                    column = self._really_cache(oid)
+                except KeyError:
+                    continue
+                if type(column) is not dict:
+                    continue
+                for index in column:
+                    r.setdefault(index, {})[oid] = column[index]
+            return r
+
+        oids = [type(o) is tuple and ".".join([str(a) for a in o]) or o
+                for o in oids]
+        d = self.walkmany(oids)
+        d.addCallback(rows)
+        return d
+
+    @_normalize_oid
+    def walked(self, oid):
+        """
+        Tell if an OID has been completely walked.
+
+        @param oid: an OID
+        @return: C{True} if the OID or one of its parent has been walked
+        """
+        for w in self._walked:
+            if oid == w or oid.startswith("%s." % w):
+                return True
+        return False
+
+    @_normalize_oid
+    def missing(self, oid):
+        """
+        Tell if an OID is known to not exist.
+
+        An OID does not exist if the agent said so or if it is not in
+        the cache while one of its parent has been walked.
+
+        @param oid: an OID
+        @return: C{True} if the OID is known to not exist
+        """
+        if oid in self._missing:
+            return True
+        if not self.walked(oid):
+            return False
+        try:
+            self._cache.get(oid)
+        except KeyError:
+            return True
+        return False
+
+    @_normalize_oid
+    def _flush(self, oid):
+        self._cache.remove(oid)
+        for m in self._missing.keys():
+            if m == oid or m.startswith("%s." % oid):
+                del self._missing[m]
+        for w in self._walked.keys():
+            if w == oid or w.startswith("%s." % oid) or oid.startswith("%s." % w):
+                del self._walked[w]
+
+    def flush(self, *oid):
+        """
+        Remove OIDs from the cache.
+
+        Each OID is removed with its subtree. The OID is also not
+        considered as walked anymore.
+
+        @param oid: OID to remove. If no OID is provided, the whole
+           cache is flushed.
+        """
+        if not oid:
+            self._cache.clear()
+            self._walked = {}
+            self._missing = {}
+            return
+        for o in oid:
+            self._flush(o)
+
+    def stash(self):
+        """
+        Put the content of the cache aside and start with an empty one.
+
+        @return: the previous content, to give to L{unstash}
+        """
+        content = (self._cache, self._walked, self._missing)
+        self._cache = OidCache(self._cache.tuples)
+        self._walked = {}
+        self._missing = {}
+        return content
+
+    def unstash(self, content):
+        """
+        Replace the content of the cache by a content put aside with
+        L{stash}.
+        """
+        self._cache, self._walked, self._missing = content
+
     @_normalize_oid
     def set(self, *args, **kwargs):
         """
         Set a value using SNMP SET.
 
         A specific proxy is used for this operation since we need a
-        different community. This operation is only available if we
-        have a write community.
+        different community. It is kept for the lifetime of this
+        proxy. This operation is only available if we have a write
+        community.
         """
         if self._wcommunity is None:
             raise TypeError("no write community is defined")
         if self._wproxy is None:
             # We should instiante a write proxy
             self._wproxy = WalkAgentProxy(self.ip, self._wcommunity, self.version)
+        self._wproxy.version = self.version
         return self._wproxy.set(*args, **kwargs)
 
-    get     = _cache_results(_normalize_oid(WalkAgentProxy.get))
+    get     = _cache_results(_normalize_oid(_record_missing(_batched_get)))
     # getbulk and getnext are not cached because we could cache results that we don't want
-    getnext = _normalize_oid(WalkAgentProxy.getnext)
+    getnext = _normalize_oid(_shared_getnext)
     getbulk = _normalize_oid(WalkAgentProxy.getbulk)
-    walk    = _cache_results(_normalize_oid(WalkAgentProxy.walk))
+    walk    = _cache_results(_normalize_oid(_record_walk(_shared_walk)))
+    walkmany = _cache_results(_normalize_oid(_record_walk(_shared_walkmany)))
         
 class Walker(object):
     """SNMP walker class"""
 
     def __init__(self, proxy, baseoid):
         self.baseoid = baseoid
-        self.lastoid = baseoid
+        self.prefix = tuple(translateOid(baseoid))
+        self.lastoid = self.prefix
         self.proxy = proxy
         self.results = {}
         self.defer = defer.Deferred()
@@ -166,22 +1006,24 @@ class Walker(object):
 
     def getMore(self, x):
         stop = False
+        prefix = self.prefix
+        l = len(prefix)
         for o in x:
             if o in self.results:
                 stop = True
                 continue
-            if translateOid(o)[:len(translateOid(self.baseoid))] != \
-                    translateOid(self.baseoid):
+            t = oidTuple(o)
+            if t[:l] != prefix:
                 stop = True
                 continue
             self.results[o] = x[o]
-            if translateOid(self.lastoid) < translateOid(o):
-                self.lastoid = o
+            if self.lastoid < t:
+                self.lastoid = t
         if stop or not x:
             self.defer.callback(self.results)
             self.defer = None
             return
-        d = self.proxy.getbulk(self.lastoid)
+        d = self.proxy.getbulk(oidString(self.lastoid))
         d.addErrback(lambda x: x.trap(snmp.SNMPEndOfMibView,
                                       snmp.SNMPNoSuchName) and {})
         d.addCallback(self.getMore)
@@ -193,3 +1035,59 @@ class Walker(object):
         self.defer = None
 
         
+
+class TableWalker(object):
+    """
+    SNMP walker for several columns at once.
+
+    Each request contains the last OID retrieved for each column that
+    is not completely walked yet. A column is completely walked when
+    a response does not contain any new OID in its subtree.
+    """
+
+    def __init__(self, proxy, baseoids):
+        self.proxy = proxy
+        self.baseoids = [(tuple(translateOid(o)), o) for o in baseoids]
+        self.lastoids = dict([(o, (tuple(translateOid(o)), o)) for o in baseoids])
+        self.results = {}
+        self.defer = defer.Deferred()
+
+    def __call__(self):
+        self.query()
+        return self.defer
+
+    def query(self):
+        # The lowest OID is first: if this one reaches the end of
+        # the MIB, the other ones will reach it too.
+        lastoids = self.lastoids.values()
+        lastoids.sort()
+        d = self.proxy.getbulk([oidString(o) for t, o in lastoids])
+        d.addErrback(lambda x: x.trap(snmp.SNMPEndOfMibView,
+                                      snmp.SNMPNoSuchName) and {})
+        d.addCallback(self.getMore)
+        d.addErrback(self.fireError)
+
+    def getMore(self, x):
+        progress = {}
+        for o in x:
+            to = oidTuple(o)
+            for prefix, base in self.baseoids:
+                if to[:len(prefix)] != prefix:
+                    continue
+                self.results[o] = x[o]
+                if base in self.lastoids and self.lastoids[base][0] < to:
+                    self.lastoids[base] = (to, o)
+                    progress[base] = True
+                break
+        for base in self.lastoids.keys():
+            if base not in progress:
+                del self.lastoids[base]
+        if not self.lastoids:
+            self.defer.callback(self.results)
+            self.defer = None
+            return
+        self.query()
+
+    def fireError(self, error):
+        self.defer.errback(error)
+        self.defer = None
@@ -0,0 +1,207 @@
+"""
+Record and replay SNMP sessions
+
+Each request sent to an agent (including retries) is recorded with
+its arguments, its duration and its outcome. A recording is a gzipped
+stream of pickles: a header, one tuple per request and a trailer.
+
+A recording can be replayed with L{ReplayAgentProxy}: requests are
+answered from the recording instead of the network, with the
+original latency or a scaled one. This allows to profile collectors
+offline against the data of a real device.
+"""
+
+import gzip
+import time
+import cPickle
+
+import snmp
+from twisted.internet import defer, reactor
+from twisted.python import log, failure
+
+from qcss3.collector.proxy import AgentProxy, oidString
+
+def requestKey(method, args):
+    """
+    Build a key identifying a request.
+
+    @param method: name of the method (C{get}, C{getnext}, ...)
+    @param args: arguments of the request, the first one being an OID
+       or a list of OID
+    @return: the key of the request and the key of the request without
+       its additional arguments
+    """
+    oid = args[0]
+    if type(oid) is list:
+        oid = tuple(sorted([oidString(o) for o in oid]))
+    else:
+        oid = oidString(oid)
+    return (method, oid) + tuple(args[1:]), (method, oid)
+
+class Recorder(object):
+    """Record requests sent to an agent into a file"""
+
+    def __init__(self, path, **header):
+        """
+        Create a new recording.
+
+        @param path: file to write
+        @param header: additional information to store in the header
+        """
+        self.path = path
+        self.file = gzip.open(path, "wb")
+        self.start = time.time()
+        self.count = 0
+        header.update({'version': 1, 'start': self.start})
+        cPickle.dump(header, self.file, 2)
+
+    def record(self, method, args, d):
+        """
+        Record a request when its result is known.
+
+        @param method: name of the method used to send the request
+        @param args: arguments of the request
+        @param d: deferred firing with the result of the request
+        """
+
+        def done(result):
+            if self.file is None:
+                # Recording already closed
+                return result
+            if isinstance(result, failure.Failure):
+                outcome = None
+                error = (result.type.__name__, str(result.value))
+            else:
+                outcome = result
+                error = None
+            cPickle.dump((start - self.start, time.time() - start,
+                          method, args, outcome, error),
+                         self.file, 2)
+            self.count += 1
+            return result
+
+        args = tuple([type(a) is list and list(a) or a for a in args])
+        start = time.time()
+        d.addBoth(done)
+
+    def close(self, **trailer):
+        """
+        Close the recording.
+
+        @param trailer: information to store at the end of the recording
+        """
+        if self.file is None:
+            return
+        cPickle.dump(trailer, self.file, 2)
+        self.file.close()
+        self.file = None
+
+class Recording(object):
+    """
+    Recording loaded from a file.
+
+    @ivar header: information stored at the beginning of the recording
+    @ivar trailer: information stored at the end of the recording
+    @ivar requests: list of recorded requests as tuples (offset,
+       duration, method, arguments, result, error)
+    """
+
+    def __init__(self, path):
+        f = gzip.open(path, "rb")
+        self.header = cPickle.load(f)
+        self.trailer = {}
+        self.requests = []
+        while True:
+            try:
+                entry = cPickle.load(f)
+            except EOFError:
+                break
+            if type(entry) is dict:
+                self.trailer = entry
+                break
+            self.requests.append(entry)
+        f.close()
+        self.rewind()
+
+    def rewind(self):
+        """Make all requests available again"""
+        self.answers = {}       # Recorded answers for each request
+        self.loose = {}         # Same without additional arguments
+        for entry in self.requests:
+            key, loose = requestKey(entry[2], entry[3])
+            self.answers.setdefault(key, []).append(entry)
+            self.loose.setdefault(loose, []).append(entry)
+        self.replayed = 0
+        self.misses = 0
+
+    def answer(self, method, args):
+        """
+        Find the recorded answer to a request.
+
+        Identical requests are answered in the order they were
+        recorded. Once all of them have been used, the last one is
+        used again. If the request was not recorded with the same
+        additional arguments (for example, the number of repetitions
+        of GETBULK), an answer to the same OID is used.
+
+        @param method: name of the method used to send the request
+        @param args: arguments of the request
+        @return: recorded request or C{None}
+        """
+        key, loose = requestKey(method, args)
+        answers = self.answers.get(key) or self.loose.get(loose)
+        if not answers:
+            self.misses += 1
+            return None
+        self.replayed += 1
+        entry = answers[0]
+        if len(answers) > 1:
+            answers.pop(0)
+        return entry
+
+class ReplayAgentProxy(AgentProxy):
+    """
+    Proxy answering requests from a recording.
+
+    Answers are delivered after the recorded duration multiplied by
+    C{scale}. Requests that were not recorded time out.
+    """
+
+    def __init__(self, recording, scale=1., **kwargs):
+        """
+        Create a new proxy replaying a recording.
+
+        @param recording: a L{Recording}
+        @param scale: factor to apply to recorded durations, 0 to
+           answer at once
+        """
+        self.recording = recording
+        self.scale = scale
+        kwargs.setdefault("ip", recording.header.get("ip", "127.0.0.1"))
+        kwargs.setdefault("community", "public")
+        kwargs.setdefault("version", 1)
+        kwargs.setdefault("tupleoids", recording.header.get("tupleoids", False))
+        AgentProxy.__init__(self, **kwargs)
+
+    def _send(self, request, *args):
+        entry = self.recording.answer(request.__name__, args)
+        if entry is None:
+            log.msg("%s%r was not recorded" % (request.__name__, args))
+            delay = self.timeout
+            result = failure.Failure(snmp.SNMPException("Timeout"))
+        else:
+            offset, delay, method, recorded, outcome, error = entry
+            if error is None:
+                result = outcome
+            else:
+                exception = getattr(snmp, error[0], snmp.SNMPException)
+                result = failure.Failure(exception(error[1]))
+        d = defer.Deferred()
+        if isinstance(result, failure.Failure):
+            fire = d.errback
+        else:
+            fire = d.callback
+            if type(result) is dict:
+                result = result.copy()
+        reactor.callLater(delay * self.scale, fire, result)
+        return d
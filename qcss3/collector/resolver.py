@@ -0,0 +1,149 @@
+"""
+Caching DNS resolver
+
+Names of load balancers are resolved once and kept in cache for the
+TTL of the answer. Watched names are resolved again in background
+before they expire. If a name cannot be resolved anymore, the last
+known address is used.
+"""
+
+import time
+
+from twisted.internet import defer, reactor
+from twisted.names import client, dns, error
+from twisted.python import log
+
+class CachingResolver(object):
+    """
+    Resolve names into IPv4 addresses with a cache.
+
+    The TTL of an answer is at least C{minttl} seconds. A watched
+    name is resolved again when C{prefetch} of its TTL has elapsed.
+    When this fails, it is retried every C{minttl} seconds while the
+    last known address is still served.
+    """
+
+    minttl = 30
+    prefetch = 0.8
+
+    def __init__(self, servers=None, resolver=None):
+        """
+        Create a new caching resolver.
+
+        @param servers: list of C{(host, port)} of DNS servers to
+           use. If not specified, use C{/etc/resolv.conf}. Names are
+           searched in C{/etc/hosts} first.
+        @param resolver: resolver to use instead of the one built by
+           L{twisted.names.client.createResolver}
+        """
+        if resolver is None:
+            resolver = client.createResolver(servers=servers or None)
+        self.resolver = resolver
+        self.cache = {}         # name -> (address, expiration)
+        self.pending = {}       # Queries in progress
+        self.watched = {}       # Names to resolve again in background
+        self.calls = {}         # Background queries
+
+    def resolve(self, name):
+        """
+        Resolve a name.
+
+        @param name: name to resolve
+        @return: an IPv4 address as a string (deferred)
+        """
+        if name in self.cache:
+            address, expiration = self.cache[name]
+            if time.time() < expiration:
+                return defer.succeed(address)
+        return self.query(name)
+
+    def cached(self, name):
+        """
+        Get the last known address of a name, even if expired.
+
+        @param name: name to look for
+        @return: an IPv4 address or C{None}
+        """
+        if name in self.cache:
+            return self.cache[name][0]
+        return None
+
+    def query(self, name):
+        """
+        Send a query for the given name, unless one is in progress.
+
+        @param name: name to resolve
+        @return: an IPv4 address as a string (deferred)
+        """
+        d = defer.Deferred()
+        if name in self.pending:
+            self.pending[name].append(d)
+            return d
+        self.pending[name] = [d]
+        q = self.resolver.lookupAddress(name)
+        q.addCallback(self.answer, name)
+        q.addErrback(self.failure, name)
+        q.addBoth(self.land, name)
+        return d
+
+    def land(self, result, name):
+        """Dispatch the result of a query to all its waiters"""
+        for d in self.pending.pop(name):
+            d.callback(result)
+
+    def answer(self, (answers, authority, additional), name):
+        """Store the address received for a name"""
+        records = [r for r in answers if r.type == dns.A]
+        if not records:
+            raise error.DNSNameError("no address for %s" % name)
+        address = records[0].payload.dottedQuad()
+        ttl = max(self.minttl, min([r.ttl for r in records]))
+        old = self.cached(name)
+        if old is not None and old != address:
+            log.msg("Address of %s changed from %s to %s" % (name, old, address))
+        self.cache[name] = (address, time.time() + ttl)
+        self.schedule(name, ttl * self.prefetch)
+        return address
+
+    def failure(self, failure, name):
+        """Serve the last known address of a name, if any"""
+        self.schedule(name, self.minttl)
+        address = self.cached(name)
+        if address is None:
+            return failure
+        log.msg("Unable to resolve %s, keep using %s:\n%s" % (name, address,
+                                                              failure))
+        return address
+
+    def schedule(self, name, delay):
+        """Schedule a background query for a watched name"""
+        if name not in self.watched:
+            return
+        if name in self.calls and self.calls[name].active():
+            self.calls[name].cancel()
+        self.calls[name] = reactor.callLater(delay, self.background, name)
+
+    def background(self, name):
+        del self.calls[name]
+        d = self.query(name)
+        d.addErrback(lambda x: log.msg("Unable to resolve %s:\n%s" % (name, x)))
+        return d
+
+    def watch(self, names):
+        """
+        Resolve names now and keep them fresh in background.
+
+        @param names: list of names to watch
+        """
+        for name in names:
+            self.watched[name] = True
+            if name not in self.calls:
+                self.calls[name] = reactor.callLater(0, self.background, name)
+
+    def stop(self):
+        """Stop resolving names in background"""
+        self.watched = {}
+        for name in self.calls.keys():
+            if self.calls[name].active():
+                self.calls[name].cancel()
+            del self.calls[name]
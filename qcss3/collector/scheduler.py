@@ -0,0 +1,171 @@
+"""
+Background refresh of load balancers
+
+This service keeps the data of each load balancer fresh by refreshing
+it periodically through the collector service. The interval can be
+set for each load balancer or for each kind of load balancer. A
+random jitter is added to avoid refreshing all load balancers at the
+same time.
+
+Between two complete refreshes, the operational state of each load
+balancer can be refreshed more often.
+"""
+
+import time
+import random
+
+from twisted.internet import defer, task, reactor
+from twisted.application import service
+from twisted.python import log
+
+class SchedulerService(service.Service):
+    """Service to refresh load balancers in background"""
+
+    def __init__(self, config, collector, dbpool):
+        """
+        Create a new scheduler.
+
+        @param config: scheduler configuration section
+        @param collector: collector service to use to refresh load balancers
+        @param dbpool: dbpool
+        """
+        self.config = config
+        self.collector = collector
+        self.dbpool = dbpool
+        self.setName("Refresh scheduler")
+        self.semaphore = defer.DeferredSemaphore(self.config.get("parallel", 5))
+        self.calls = {}
+        self.expirecall = None
+
+    def startService(self):
+        service.Service.startService(self)
+        for lb in self.collector.config.get("lb", {}):
+            if self.config.get("warmup", True):
+                # Warm-up: refresh everything as soon as possible
+                self.schedule(lb, 0)
+            else:
+                self.schedule(lb, self.interval(lb))
+            if self.config.get("status", None):
+                self.schedule(lb, self.config["status"], True)
+        self.expirecall = task.LoopingCall(self.expire)
+        self.expirecall.start(self.config.get("expire", 3600), now=False)
+
+    def stopService(self):
+        for key in self.calls.keys():
+            self.calls[key].cancel()
+            del self.calls[key]
+        if self.expirecall is not None and self.expirecall.running:
+            self.expirecall.stop()
+        self.expirecall = None
+        return service.Service.stopService(self)
+
+    def interval(self, lb, kind=None):
+        """
+        Get the interval between two refreshes of a load balancer.
+
+        The interval is searched first in C{lb} mapping of the
+        configuration, then in C{kind} mapping. If several kinds
+        match (for a load balancer handled by several plugins), the
+        smallest interval is used. Otherwise, C{interval} is used.
+
+        @param lb: name of the load balancer
+        @param kind: kind of the load balancer (as stored in database)
+        @return: interval in seconds
+        """
+        intervals = self.config.get("lb", {})
+        if lb in intervals:
+            return intervals[lb]
+        kinds = self.config.get("kind", {})
+        matching = [kinds[k] for k in (kind or "").split(" + ") if k in kinds]
+        if matching:
+            return min(matching)
+        return self.config.get("interval", 1200)
+
+    def schedule(self, lb, delay, status=False):
+        """
+        Schedule the next refresh of a load balancer.
+
+        @param lb: name of the load balancer
+        @param delay: delay before refreshing, jitter will be added
+        @param status: if C{True}, schedule a refresh of the
+            operational state only
+        """
+        if not self.running:
+            return
+        delay = delay + random.uniform(0, self.config.get("jitter", 60))
+        if status:
+            self.calls[lb, status] = reactor.callLater(delay, self.poll_status, lb)
+        else:
+            self.calls[lb, status] = reactor.callLater(delay, self.poll, lb)
+
+    def kind(self, lb):
+        """
+        Get the kind of a load balancer from the database.
+
+        @param lb: name of the load balancer
+        @return: the kind of the load balancer or C{None} (deferred)
+        """
+        d = self.dbpool.runQuery("SELECT type FROM loadbalancer "
+                                 "WHERE name=%(name)s AND deleted='infinity'",
+                                 {'name': lb})
+        d.addCallbacks(lambda x: x and x[0][0] or None,
+                       lambda x: None)
+        return d
+
+    def ready(self):
+        """
+        Wait for the collector to accept more results.
+
+        Refreshes are delayed while too many results are waiting to
+        be written to the database.
+        """
+        return self.collector.queue.ready()
+
+    def poll(self, lb):
+        """
+        Refresh a load balancer and schedule the next refresh.
+
+        The number of load balancers refreshed at the same time is
+        bounded by C{parallel}. We use L{CollectorService.refresh} to
+        be able to reuse a refresh already in progress.
+
+        @param lb: name of the load balancer
+        """
+        del self.calls[lb, False]
+        start = time.time()
+        d = self.ready()
+        d.addCallback(lambda x: self.semaphore.run(self.collector.refresh, lb))
+        d.addCallbacks(lambda x: log.msg(
+                "Background refresh of %s done in %d second(s)" % (lb,
+                                                                   time.time() - start)),
+                       lambda x: log.msg(
+                "Error while refreshing %s in background:\n%s" % (lb, x)))
+        d.addCallback(lambda x: self.kind(lb))
+        d.addCallback(lambda kind: self.schedule(lb, self.interval(lb, kind)))
+        return d
+
+    def poll_status(self, lb):
+        """
+        Refresh the operational state of a load balancer and schedule
+        the next refresh of the operational state.
+
+        @param lb: name of the load balancer
+        """
+        del self.calls[lb, True]
+        d = self.ready()
+        d.addCallback(lambda x: self.semaphore.run(self.collector.refresh_status, lb))
+        d.addErrback(lambda x: log.msg(
+                "Error while refreshing state of %s in background:\n%s" % (lb, x)))
+        d.addCallback(lambda x: self.schedule(lb, self.config["status"], True))
+        return d
+
+    def expire(self):
+        """
+        Expire old load balancers.
+
+        When refreshing load balancers one by one, old load balancers
+        are never expired. Do it periodically.
+        """
+        d = self.dbpool.runInteraction(self.collector.expire)
+        d.addErrback(lambda x: log.msg("Error while expiring old entries:\n%s" % x))
+        return d
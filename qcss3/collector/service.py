@@ -2,20 +2,28 @@
 Main service for collector
 """
 
+import os
 import time
 import socket
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 
-from twisted.internet import defer
+from twisted.internet import defer, task
 from twisted.application import internet, service
 from twisted.plugin import getPlugins
-from twisted.names import client
 from twisted.python import log
 
 import qcss3.collector.loadbalancer
 from qcss3.collector.loadbalancer.multi import MultiCollectorFactory
-from qcss3.collector.proxy import AgentProxy
+from qcss3.collector.proxy import AgentProxy, BulkTuning, RetransmitTimer
+from qcss3.collector.resolver import CachingResolver
+from qcss3.collector.recording import Recorder
+from qcss3.collector.writebehind import WriteBehindQueue
 from qcss3.collector.datastore import LoadBalancer
-from qcss3.collector.database import IDatabaseWriter
+from qcss3.collector.database import IDatabaseWriter, IDatabaseStatusWriter, \
+    IDatabaseBulkWriter
 from qcss3.collector.exception import NoPlugin, UnknownLoadBalancer
 from qcss3.collector.icollector import ICollectorFactory
 
@@ -27,37 +35,96 @@ class CollectorService(service.Service):
         self.dbpool = dbpool
         self.setName("SNMP collector")
         self.inprogress = {}
-        self.cachedcollectors = {}
+        self.collectors = {}    # Registry of collectors
+        self.lastused = {}      # Last use of each collector
+        self.plugins = list(getPlugins(ICollectorFactory,
+                                       qcss3.collector.loadbalancer))
         AgentProxy.use_getbulk = self.config.get("bulk", True)
-
-    def get_collector(self, lb, caching=False):
+        BulkTuning.initial = self.config.get("repetitions", 10)
+        BulkTuning.maximum = self.config.get("maxrepetitions", 100)
+        BulkTuning.maxvarbinds = self.config.get("varbinds", 30)
+        BulkTuning.reprobe = self.config.get("reprobe", 3600)
+        AgentProxy.use_tupleoids = self.config.get("tupleoids", False)
+        AgentProxy.use_direct = self.config.get("direct", False)
+        RetransmitTimer.timeout = self.config.get("timeout", 1)
+        RetransmitTimer.mintimeout = self.config.get("mintimeout", 0.2)
+        RetransmitTimer.maxtimeout = self.config.get("maxtimeout", 10)
+        RetransmitTimer.retries = self.config.get("retries", 2)
+        RetransmitTimer.down = self.config.get("down", 3)
+        RetransmitTimer.holddown = self.config.get("holddown", 60)
+        dnsconfig = self.config.get("dns", {})
+        CachingResolver.minttl = dnsconfig.get("minttl", 30)
+        CachingResolver.prefetch = dnsconfig.get("prefetch", 0.8)
+        servers = []
+        for server in dnsconfig.get("servers", []):
+            if ":" in server:
+                host, port = server.split(":", 1)
+                servers.append((host, int(port)))
+            else:
+                servers.append((server, 53))
+        self.resolver = CachingResolver(servers)
+        writesconfig = self.config.get("writes", {})
+        self.queue = WriteBehindQueue(dbpool,
+                                      writesconfig.get("batch", 20),
+                                      writesconfig.get("delay", 0.5),
+                                      writesconfig.get("pending", 200))
+
+    def startService(self):
+        service.Service.startService(self)
+        # Keep addresses of load balancers fresh
+        names = []
+        for lb in self.config.get("lb", {}):
+            try:
+                socket.inet_aton(lb)
+            except:
+                names.append(lb)
+        self.resolver.watch(names)
+
+    def stopService(self):
+        self.resolver.stop()
+        service.Service.stopService(self)
+        # Write pending results
+        return self.queue.drain()
+
+    def get_collector(self, lb):
         """
         Get a collector for the given load balancer.
 
-        This method support caching collectors. A cached collector is
-        only shared between codes requesting a cached collector.
+        Collectors are kept in a registry for the lifetime of the
+        process. A collector keeps its SNMP sessions, the description
+        of the load balancer and the plugins handling it. A new
+        collector is built when the address of the load balancer
+        changes. The least recently used collectors are evicted when
+        they are idle for too long or when there are too many of them.
+
+        Aliases of a load balancer share the same collector. It
+        writes its results under each of their names.
 
         @param lb: name of the load balancer
-        @param caching: if C{True}, may return a cached collector
         @return: a L{LoadBalancerCollector} (deferred)
         """
         if lb not in self.config.get("lb", {}):
             raise UnknownLoadBalancer, "%s is not not a known loadbalancer" % lb
 
-        # Cache
-        clbs = self.cachedcollectors.keys()[:]
-        for clb in clbs:
-            _, age = self.cachedcollectors[clb]
-            if time.time() - age > 10:
-                del self.cachedcollectors[clb]
-        if caching:
-            if lb in self.cachedcollectors:
-                lb, _ = self.cachedcollectors[lb]
-                # See below for why we do this
+        lb = self.canonical(lb)
+        names = self.aliases().get(lb, [lb])
+        self.evict()
+        self.lastused[lb] = time.time()
+        if lb in self.collectors:
+            collector = self.collectors[lb]
+            if isinstance(collector, defer.Deferred):
+                # Collector is being built. See below for why we do this.
                 d = defer.Deferred()
-                lb.addCallbacks(lambda x: d.callback(x) and x or x,
-                                lambda x: d.errback(x) and x or x)
+                collector.addCallbacks(lambda x: d.callback(x) and x or x,
+                                       lambda x: d.errback(x) and x or x)
                 return d
+            address = self.resolver.cached(lb)
+            if address is None or address == collector.ip or \
+                    collector.busy.locked:
+                collector.names = names
+                return defer.succeed(collector)
+            log.msg("Build a new collector for %s at %s" % (lb, address))
+            del self.collectors[lb]
 
         # Communities
         community = self.config.get("lb", {})[lb]
@@ -70,24 +137,142 @@ class CollectorService(service.Service):
         try:
             socket.inet_aton(lb)
         except:
-            d.addCallback(lambda x, lb: client.getHostByName(lb), lb)
+            d.addCallback(lambda x, lb: self.resolver.resolve(lb), lb)
         d.addCallback(lambda ip: LoadBalancerCollector(lb, ip,
                                                        community, wcommunity,
                                                        self.config,
-                                                       self.dbpool))
-
-        # Cache handling
-        if caching:
-            # We don't store the deferred as is because we need to
-            # keep its result. We create a new deferred that will be
-            # triggered when we get our result.
-            dd = defer.Deferred()
-            d.addCallbacks(lambda x: dd.callback(x) and x or x,
-                           lambda x: dd.errback(x) and x or x)
-            self.cachedcollectors[lb] = (dd, time.time())
-
+                                                       self.dbpool,
+                                                       self.plugins,
+                                                       self.queue))
+
+        # We don't store the deferred as is because we need to keep
+        # its result. We create a new deferred that will be triggered
+        # when we get our result. Once built, the collector replaces
+        # it in the registry.
+        dd = defer.Deferred()
+        d.addCallbacks(lambda x: dd.callback(x) and x or x,
+                       lambda x: dd.errback(x) and x or x)
+        self.collectors[lb] = dd
+        d.addCallbacks(lambda x: self.collectors.update({lb: x}) or x,
+                       lambda x: self.collectors.pop(lb, True) and x)
+        d.addCallback(lambda x: setattr(x, "names", names) or x)
         return d
 
+    def address(self, lb):
+        """
+        Get the address of a load balancer without resolving it.
+
+        @param lb: name of the load balancer
+        @return: an IP address or C{None} if not resolved yet
+        """
+        try:
+            socket.inet_aton(lb)
+        except:
+            return self.resolver.cached(lb)
+        return lb
+
+    def aliases(self):
+        """
+        Get load balancers that are the same agent.
+
+        Load balancers are the same agent when they have the same
+        address and the same communities. Those not resolved yet are
+        not considered as aliases.
+
+        @return: a mapping from the name of the load balancer
+           collected for a group of aliases to the sorted list of
+           names in this group. Load balancers without alias are not
+           included.
+        """
+        agents = {}
+        lbs = self.config.get("lb", {})
+        for lb in lbs:
+            address = self.address(lb)
+            if address is None:
+                continue
+            community = lbs[lb]
+            if type(community) is list:
+                community = tuple(community)
+            agents.setdefault((address, community), []).append(lb)
+        aliases = {}
+        for names in agents.values():
+            if len(names) > 1:
+                names.sort()
+                aliases[names[0]] = names
+        return aliases
+
+    def canonical(self, lb):
+        """
+        Get the name of the load balancer to collect for the given one.
+
+        @param lb: name of the load balancer
+        @return: the first name of the group of aliases of this load
+           balancer or its own name if it has no alias
+        """
+        for names in self.aliases().values():
+            if lb in names:
+                return names[0]
+        return lb
+
+    def evict(self):
+        """
+        Evict collectors from the registry.
+
+        Collectors not used for C{idle} seconds are evicted. If there
+        are still more than C{collectors} collectors, the least
+        recently used ones are evicted. Collectors being built or
+        busy are never evicted. SNMP sessions of an evicted collector
+        are closed once nobody uses it anymore. Transport parameters
+        learned for its agent are forgotten unless another collector
+        uses the same agent.
+        """
+        now = time.time()
+        idle = self.config.get("idle", 3600)
+        candidates = []
+        for lb in self.collectors:
+            collector = self.collectors[lb]
+            if isinstance(collector, defer.Deferred) or collector.busy.locked:
+                continue
+            candidates.append((self.lastused.get(lb, 0), lb))
+        candidates.sort()
+        excess = len(self.collectors) - self.config.get("collectors", 100)
+        evicted = []
+        for used, lb in candidates:
+            if now - used <= idle and excess <= 0:
+                break
+            log.msg("Evict idle collector for %s" % lb)
+            evicted.append(self.collectors[lb].ip)
+            del self.collectors[lb]
+            self.lastused.pop(lb, None)
+            excess -= 1
+        if evicted:
+            used = {}
+            for collector in self.collectors.values():
+                if not isinstance(collector, defer.Deferred):
+                    used[collector.ip] = True
+            for ip in evicted:
+                if ip not in used:
+                    AgentProxy.forget(ip)
+
+    def transport(self, lb):
+        """
+        Get transport parameters learned for a load balancer.
+
+        @param lb: name of the load balancer
+        @return: a dictionary of parameters or C{None} if nothing has
+           been learned yet
+        """
+        lb = self.canonical(lb)
+        collector = self.collectors.get(lb, None)
+        if collector is None or isinstance(collector, defer.Deferred):
+            return None
+        proxy = collector.proxy
+        if proxy is None:
+            return None
+        state = proxy.tuning.state()
+        state.update(proxy.timer.state())
+        return state
+
     def actions(self, action, lb, vs=None, rs=None, actionargs=None):
         """
         Execute an action one.
@@ -109,11 +294,15 @@ class CollectorService(service.Service):
         @param lb: loadbalancer name
         @param vs: if specified, the index of the virtual server
         @param rs: if specified, the index of the real server
-        @param caching: may reuse an existing collector (with its own existing cache!)
+        @param caching: may reuse values cached by the collector during a
+           previous refresh
 
         If the name of the loadbalancer is not specified, each load
-        balancer is refreshed.
+        balancer is refreshed. Refreshing an alias of a load balancer
+        refreshes the load balancer and all its aliases.
         """
+        if lb is not None:
+            lb = self.canonical(lb)
         # If we already have a refresh in progress, return it. If we
         # ask to refresh a real server and the corresponding load
         # balancer is refreshing, we wait for the load balancer
@@ -137,20 +326,11 @@ class CollectorService(service.Service):
             log.msg("Start refresh of real server %r in %r for %r" % (rs, vs, lb))
 
         if lb is None:
-            lbs = self.config.get("lb", {}).keys()
+            d = self.refresh_all(caching)
         else:
-            lbs = [lb]
-
-        d = defer.succeed(lb)
-        for alb in lbs:
-            d.addCallback(lambda _, alb: self.get_collector(alb, caching), alb)
-            d.addCallback(lambda collector: collector.refresh(vs, rs))
-            if lb is None:
-                # Don't raise an exception if we are refreshing all load balancers
-                d.addErrback(lambda x, lb: log.msg(
-                        "Error while exploring %s:\n%s" % (lb, x)), alb)
-        if lb is None:
-            d.addCallback(lambda x: self.dbpool.runInteraction(self.expire))
+            d = defer.maybeDeferred(self.get_collector, lb)
+            d.addCallback(lambda collector: self.refresh_collector(collector, vs, rs,
+                                                                   caching))
 
         # Add our deferred to the list of refresh in progress and
         # remove it when everything is done.
@@ -158,9 +338,111 @@ class CollectorService(service.Service):
         d.addBoth(lambda x: self.inprogress.pop((lb, vs, rs), True) and x)
         return d
 
+    def refresh_all(self, caching=False):
+        """
+        Refresh all load balancers.
+
+        Load balancers are refreshed in parallel. The number of load
+        balancers refreshed at the same time is set with C{parallel}
+        in configuration. An error while refreshing a load balancer
+        does not stop the global refresh. Old entries are expired
+        once all load balancers have been refreshed. All names are
+        resolved first to collect only once load balancers having
+        aliases.
+
+        @param caching: may reuse values cached by collectors
+        """
+
+        def refresh(alb):
+            start = time.time()
+            d = defer.maybeDeferred(self.get_collector, alb)
+            d.addCallback(lambda collector: self.refresh_collector(collector,
+                                                                   caching=caching))
+            d.addCallbacks(lambda x: log.msg(
+                    "Refresh of %s done in %d second(s)" % (alb,
+                                                            time.time() - start)),
+                           # Don't raise an exception if we are
+                           # refreshing all load balancers
+                           lambda x: log.msg(
+                    "Error while exploring %s (after %d second(s)):\n%s" % (alb,
+                                                                          time.time() - start,
+                                                                          x)))
+            return d
+
+        def doWork(lbs):
+            for alb in lbs:
+                yield refresh(alb)
+
+        def work(x):
+            skip = {}
+            for names in self.aliases().values():
+                log.msg("Collect %s only once" % ", ".join(names))
+                for alb in names[1:]:
+                    skip[alb] = True
+            work = doWork([alb for alb in self.config.get("lb", {})
+                           if alb not in skip])
+            dl = []
+            coop = task.Cooperator()
+            for i in xrange(self.config.get("parallel", 10)):
+                d = coop.coiterate(work)
+                dl.append(d)
+            return defer.DeferredList(dl)
+
+        names = []
+        for alb in self.config.get("lb", {}):
+            try:
+                socket.inet_aton(alb)
+            except:
+                names.append(alb)
+        d = defer.DeferredList([self.resolver.resolve(alb) for alb in names],
+                               consumeErrors=True)
+        d.addCallback(work)
+        d.addCallback(lambda x: self.dbpool.runInteraction(self.expire))
+        return d
+
+    def refresh_collector(self, collector, vs=None, rs=None, caching=False):
+        """
+        Refresh the given collector.
+
+        @param collector: a L{LoadBalancerCollector}
+        @param vs: if specified, the index of the virtual server
+        @param rs: if specified, the index of the real server
+        @param caching: if C{True}, do not flush values cached by the
+           collector before refreshing
+        """
+        return collector.refresh(vs, rs, flush=not caching)
+
+    def refresh_status(self, lb):
+        """
+        Refresh only the operational state of the specified LB.
+
+        The collector of this load balancer is kept between refreshes
+        and already knows everything except the operational state. If
+        it has not collected anything yet, a complete collection is
+        done but only the operational state is written.
+
+        @param lb: loadbalancer name
+        """
+        lb = self.canonical(lb)
+        # If we already have a refresh in progress, return it.
+        if (lb, None, None) in self.inprogress:
+            return self.inprogress[lb, None, None]
+        if (lb, None, None, True) in self.inprogress:
+            return self.inprogress[lb, None, None, True]
+
+        log.msg("Start status refresh of load balancer %r" % lb)
+        d = defer.maybeDeferred(self.get_collector, lb)
+        d.addCallback(lambda collector: collector.refresh(status=True))
+        self.inprogress[lb, None, None, True] = d
+        d.addBoth(lambda x: self.inprogress.pop((lb, None, None, True), True) and x)
+        return d
+
     def expire(self, txn):
         """
         Expire old load balancers that were not updated after a long time
+
+        Deleted rows are moved to past tables by
+        L{qcss3.core.archive.ArchiveService}.
         """
         txn.execute("""
 UPDATE loadbalancer
@@ -169,17 +451,21 @@ WHERE CURRENT_TIMESTAMP - interval '%(expire)s days' > updated
 AND deleted='infinity'
 """,
                                      {'expire': self.config.get("expire", 1)})
-        # Move old entries to _past tables
-        for table in ["loadbalancer", "virtualserver", "virtualserver_extra",
-                      "realserver", "realserver_extra"]:
-            txn.execute("INSERT INTO %s_past "
-                        "SELECT * FROM %s WHERE deleted != 'infinity'" % ((table,)*2))
-            txn.execute("DELETE FROM %s WHERE deleted != 'infinity'" % table)
 
 class LoadBalancerCollector:
-    """Service to collect data for a given load balancer"""
+    """
+    Service to collect data for a given load balancer
 
-    def __init__(self, lb, ip, community, wcommunity, config, dbpool):
+    A collector is long-lived: the proxy, its SNMP sessions and the
+    plugins handling the load balancer are kept between refreshes.
+    Refreshes and actions are run one at a time.
+
+    Results are written under each name in C{names}: the name of the
+    load balancer and the names of its aliases.
+    """
+
+    def __init__(self, lb, ip, community, wcommunity, config, dbpool, plugins,
+                 queue=None):
         """
         Create a new load balancer collector
 
@@ -189,17 +475,26 @@ class LoadBalancerCollector:
         @param wcommunity: RW community for SNMP (C{None} for a read-only collector)
         @param config: collector configuration section
         @param dbpool: dbpool
+        @param plugins: list of available L{ICollectorFactory}
+        @param queue: L{WriteBehindQueue} to use to write results,
+           results are written at once if C{None}
         """
         self.lb = lb
+        self.names = [lb]
         self.ip = ip
         self.community = community
         self.wcommunity = wcommunity
         self.config = config
         self.dbpool = dbpool
+        self.plugins = plugins
+        self.queue = queue
         self.proxy = None
         self.collector = None
         self.description = None
+        self.detected = None
+        self.recorder = None
         self.lock = defer.DeferredLock()
+        self.busy = defer.DeferredLock()
 
     def getProxy(self):
         """
@@ -211,16 +506,22 @@ class LoadBalancerCollector:
         """
         if self.proxy is not None:
             return defer.succeed(self.proxy)
-        proxy = AgentProxy(ip=self.ip,
-                           community=self.community,
-                           wcommunity=self.wcommunity,
-                           version=1)
+        proxy = self.buildProxy()
+        proxy.recorder = self.recorder
         d = proxy.get(['.1.3.6.1.2.1.1.1.0', # description
                        '.1.3.6.1.2.1.1.2.0', # OID
                        ])
         d.addCallback(lambda x: self.saveProxy(proxy, x))
         return d
 
+    def buildProxy(self):
+        """Build a new proxy to access the load balancer"""
+        return AgentProxy(ip=self.ip,
+                          community=self.community,
+                          wcommunity=self.wcommunity,
+                          version=1,
+                          transport=self.config.get("transport", {}).get(self.lb, {}))
+
     def saveProxy(self, proxy, results):
         """
         Save proxy into the current object.
@@ -242,15 +543,18 @@ class LoadBalancerCollector:
             yield self.collector
             return
 
-        plugins = []
-        for plugin in getPlugins(ICollectorFactory,
-                                 qcss3.collector.loadbalancer):
-            d = defer.waitForDeferred(defer.maybeDeferred(
-                    plugin.canBuildCollector, self.proxy, self.description, self.oid))
-            yield d
-            d = d.getResult()
-            if d:
-                plugins.append(plugin)
+        plugins = defer.waitForDeferred(self.detectedPlugins())
+        yield plugins
+        plugins = plugins.getResult()
+        if plugins is None:
+            plugins = defer.waitForDeferred(self.probePlugins())
+            yield plugins
+            plugins = plugins.getResult()
+            if plugins:
+                d = self.dbpool.runInteraction(self.saveDetection, plugins)
+                d.addErrback(lambda x: log.msg(
+                        "Unable to save plugins for %s:\n%s" % (self.lb, x)))
+        self.detected = plugins
         if len(plugins) == 1:
             print "Using %s to collect data from %s" % (str(plugins[0].__class__),
                                                         self.lb)
@@ -270,24 +574,200 @@ class LoadBalancerCollector:
         yield self.collector
         return
 
+    def pluginName(self, plugin):
+        """Get the name of a plugin as stored in database"""
+        return "%s.%s" % (plugin.__class__.__module__, plugin.__class__.__name__)
+
+    def detectedPlugins(self):
+        """
+        Get plugins detected during a previous collection.
+
+        Plugins are stored in database with sysObjectID and a hash of
+        sysDescr. They are not used if one of those has changed or if
+        one of the plugins is not available anymore.
+
+        @return: a list of plugins or C{None} if the load balancer
+           should be probed again (deferred)
+        """
+
+        def check(result):
+            if not result:
+                return None
+            oid, description, names = result[0]
+            if oid != str(self.oid) or \
+                    description != md5(str(self.description)).hexdigest():
+                log.msg("%s has changed, search plugins again" % self.lb)
+                return None
+            available = dict([(self.pluginName(p), p) for p in self.plugins])
+            plugins = []
+            for name in names.split():
+                if name not in available:
+                    return None
+                plugins.append(available[name])
+            return plugins
+
+        d = self.dbpool.runQuery("SELECT oid, description, plugins "
+                                 "FROM plugin WHERE lb=%(lb)s",
+                                 {'lb': self.lb})
+        d.addCallbacks(check,
+                       lambda x: log.msg(
+                "Unable to get plugins for %s:\n%s" % (self.lb, x)))
+        return d
+
+    def probePlugins(self):
+        """
+        Ask each plugin if it can handle the load balancer.
+
+        All plugins are asked at the same time.
+
+        @return: the list of plugins handling the load balancer (deferred)
+        """
+        d = defer.DeferredList([defer.maybeDeferred(plugin.canBuildCollector,
+                                                    self.proxy,
+                                                    self.description,
+                                                    self.oid)
+                                for plugin in self.plugins],
+                               fireOnOneErrback=True, consumeErrors=True)
+        d.addCallback(lambda x: [plugin
+                                 for plugin, (_, result) in zip(self.plugins, x)
+                                 if result])
+        d.addErrback(lambda x: x.value.subFailure)
+        return d
+
+    def saveDetection(self, txn, plugins):
+        """
+        Save detected plugins into database.
+
+        @param plugins: list of plugins handling the load balancer
+        """
+        txn.execute("DELETE FROM plugin WHERE lb=%(lb)s", {'lb': self.lb})
+        txn.execute("INSERT INTO plugin (lb, oid, description, plugins) "
+                    "VALUES (%(lb)s, %(oid)s, %(description)s, %(plugins)s)",
+                    {'lb': self.lb,
+                     'oid': str(self.oid),
+                     'description': md5(str(self.description)).hexdigest(),
+                     'plugins': " ".join([self.pluginName(p) for p in plugins])})
+
     def writeData(self, data, vs=None, rs=None):
         if data is not None:
-            return self.dbpool.runInteraction(IDatabaseWriter(data).write,
-                                              [a for a in [self.lb, vs, rs] if a])
+            writer = None
+            if vs is None and self.config.get("staging", False):
+                # Complete refresh, write through staging tables
+                writer = IDatabaseBulkWriter(data, None)
+            if writer is None:
+                writer = IDatabaseWriter(data)
+            return self.runWrite((vs, rs, False), self._write, writer, vs, rs)
+
+    def writeStatus(self, data):
+        if data is not None:
+            return self.runWrite((None, None, True),
+                                 self._write, IDatabaseStatusWriter(data))
 
-    def refresh(self, vs=None, rs=None):
+    def runWrite(self, key, function, *args):
+        """
+        Run a write in a transaction, through the write-behind queue
+        if there is one.
+
+        @param key: C{(vs, rs, status)} identifying what is written
+        @param function: function to call with a transaction and C{args}
+        """
+        if self.queue is None:
+            return self.dbpool.runInteraction(function, *args)
+        return self.queue.write((self.lb,) + key, function, *args)
+
+    def _write(self, txn, writer, vs=None, rs=None):
+        """Write data under each name of the load balancer"""
+        for name in self.names:
+            writer.write(txn, [a for a in [name, vs, rs] if a])
+
+    def flush(self):
+        """Flush values cached by the proxy, if any"""
+        if self.proxy is not None:
+            self.proxy.flush()
+
+    def refresh(self, vs=None, rs=None, status=False, flush=True):
         """
         Refresh the data from LB
 
         @param vs: if specified, collect only the specified virtual server
         @param rs: if specified, collect only the specified real server
+        @param status: if C{True}, refresh only the operational state
+            of the whole load balancer. Cached values are kept.
+        @param flush: if C{True}, flush values cached during previous
+            refreshes. When refreshing a virtual or a real server,
+            they are only ignored during this refresh.
         """
+        return self.busy.run(self._refresh, vs, rs, status, flush)
+
+    def _refresh(self, vs, rs, status, flush):
+        proxy = self.proxy
+        content = None
+        if flush and not status:
+            if vs is None or proxy is None:
+                self.flush()
+            else:
+                # Only this entity needs fresh values. Values cached
+                # for the whole load balancer are put back afterwards
+                # to not walk everything again for the next status
+                # refresh.
+                content = proxy.stash()
+        self.startRecording(vs, rs, status)
         d = self.getProxy()
         d.addCallback(lambda x: self.findCollector())
-        d.addCallback(lambda x: x.collect(vs, rs))
-        d.addCallback(lambda x: self.writeData(x, vs, rs))
+        if status:
+            d.addCallback(lambda x: x.collect_status())
+            d.addCallback(lambda x: self.writeStatus(x))
+        else:
+            d.addCallback(lambda x: x.collect(vs, rs))
+            d.addCallback(lambda x: self.writeData(x, vs, rs))
+        if content is not None:
+            d.addBoth(lambda x: proxy.unstash(content) or x)
+        d.addBoth(self.stopRecording)
         return d
 
+    def startRecording(self, vs=None, rs=None, status=False):
+        """
+        Start to record SNMP requests if enabled for this load balancer.
+
+        Recordings are written in the directory configured for the
+        load balancer in C{record}. They can be replayed with
+        L{qcss3.collector.recording.ReplayAgentProxy}.
+        """
+        directory = self.config.get("record", {}).get(self.lb, None)
+        if directory is None:
+            return
+        path = os.path.join(directory, "%s-%s%s.snmp.gz" % (
+                self.lb, time.strftime("%Y%m%d-%H%M%S"),
+                status and "-status" or ""))
+        try:
+            self.recorder = Recorder(path, lb=self.lb, ip=self.ip,
+                                     vs=vs, rs=rs, status=status,
+                                     tupleoids=AgentProxy.use_tupleoids)
+        except IOError, e:
+            log.msg("Unable to record SNMP requests for %s: %s" % (self.lb, e))
+            return
+        if self.proxy is not None:
+            self.proxy.recorder = self.recorder
+
+    def stopRecording(self, result):
+        """Stop to record SNMP requests, if needed"""
+        if self.recorder is None:
+            return result
+        trailer = {}
+        if self.detected:
+            trailer['plugins'] = " ".join([self.pluginName(p)
+                                           for p in self.detected])
+            trailer['oid'] = str(self.oid)
+            trailer['description'] = str(self.description)
+        self.recorder.close(**trailer)
+        log.msg("%d SNMP requests for %s recorded in %s" % (self.recorder.count,
+                                                            self.lb,
+                                                            self.recorder.path))
+        self.recorder = None
+        if self.proxy is not None:
+            self.proxy.recorder = None
+        return result
+
 
     def actions(self, action, vs=None, rs=None, actionargs=None):
         """
@@ -325,7 +805,10 @@ class LoadBalancerCollector:
             return None
 
         # Otherwise, get a proxy, find a collector and get things done
-        d = self.getProxy()
-        d.addCallback(lambda x: self.findCollector())
-        d.addCallback(lambda x: execute_and_refresh(x))
-        return d
+        def execute():
+            self.flush()
+            d = self.getProxy()
+            d.addCallback(lambda x: self.findCollector())
+            d.addCallback(lambda x: execute_and_refresh(x))
+            return d
+        return self.busy.run(execute)
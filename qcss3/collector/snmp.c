@@ -17,6 +17,7 @@
  */
 
 #include <Python.h>
+#include <structmember.h>
 #include <net-snmp/net-snmp-config.h>
 #include <net-snmp/net-snmp-includes.h>
 
@@ -55,120 +56,64 @@ static struct ErrorException SnmpErrorToException[] = {
 static PyObject *DeferModule;
 static PyObject *FailureModule;
 static PyObject *reactor;
-static PyObject *SnmpFds;
-static PyObject *timeoutId;
-static PyObject *timeoutFunction;
 
 /* Types */
 typedef struct {
 	PyObject_HEAD
+	void *sess;		/* Opaque pointer for snmp_sess_* API */
 	struct snmp_session *ss;
 	PyObject *defers;
+	PyObject *reader;
+	PyObject *timeoutId;
+	int tupleoids;		/* Return OID as tuples of integers */
+	int direct;		/* Fire deferreds from the read callback */
 } SnmpObject;
 
 typedef struct {
 	PyObject_HEAD
 	int fd;
+	SnmpObject *session;	/* Borrowed reference */
 } SnmpReaderObject;
 static PyTypeObject SnmpReaderType;
 
+/* Schedule the next timeout of a session. Each session has its own
+ * timeout. */
 static int
-Snmp_updatereactor(void)
+Snmp_updatetimeout(SnmpObject *self)
 {
-	int maxfd = 0, block = 0, fd, result, i;
-	PyObject *keys, *key, *tmp;
-	SnmpReaderObject *reader;
+	int maxfd = 0, block = 1;
 	fd_set fdset;
 	struct timeval timeout;
 	double to;
+	PyObject *tmp, *function;
 
-	FD_ZERO(&fdset);
-	block = 1;
-	snmp_select_info(&maxfd, &fdset, &timeout, &block);
-	for (fd = 0; fd < maxfd; fd++) {
-		if (FD_ISSET(fd, &fdset)) {
-			result = PyDict_Contains(SnmpFds, PyInt_FromLong(fd));
-			if (result == -1)
-				return -1;
-			if (!result) {
-				/* Add this fd to the reactor */
-				if ((reader = (SnmpReaderObject *)
-					PyObject_CallObject((PyObject *)&SnmpReaderType,
-					    NULL)) == NULL)
-					return -1;
-				reader->fd = fd;
-				if ((key =
-					PyInt_FromLong(fd)) == NULL) {
-					Py_DECREF(reader);
-					return -1;
-				}
-				if (PyDict_SetItem(SnmpFds, key, (PyObject*)reader) != 0) {
-					Py_DECREF(reader);
-					Py_DECREF(key);
-					return -1;
-				}
-				Py_DECREF(key);
-				if ((tmp = PyObject_CallMethod(reactor,
-					    "addReader", "O", (PyObject*)reader)) ==
-				    NULL) {
-					Py_DECREF(reader);
-					return -1;
-				}
-				Py_DECREF(tmp);
-				Py_DECREF(reader);
-			}
-		}
-	}
-	if ((keys = PyDict_Keys(SnmpFds)) == NULL)
-		return -1;
-	for (i = 0; i < PyList_Size(keys); i++) {
-		if ((key = PyList_GetItem(keys, i)) == NULL) {
-			Py_DECREF(keys);
-			return -1;
-		}
-		fd = PyInt_AsLong(key);
-		if (PyErr_Occurred()) {
-			Py_DECREF(keys);
-			return -1;
-		}
-		if ((fd >= maxfd) || (!FD_ISSET(fd, &fdset))) {
-			/* Delete this fd from the reactor */
-			if ((reader = (SnmpReaderObject*)PyDict_GetItem(SnmpFds,
-				    key)) == NULL) {
-				Py_DECREF(keys);
-				return -1;
-			}
-			if ((tmp = PyObject_CallMethod(reactor,
-				    "removeReader", "O", (PyObject*)reader)) == NULL) {
-				Py_DECREF(keys);
-				return -1;
-			}
-			Py_DECREF(tmp);
-			if (PyDict_DelItem(SnmpFds, key) == -1) {
-				Py_DECREF(keys);
-				return -1;
-			}
-		}
-	}
-	Py_DECREF(keys);
-	/* Setup timeout */
-	if (timeoutId) {
-		if ((tmp = PyObject_CallMethod(timeoutId, "cancel", NULL)) == NULL) {
+	if (self->timeoutId) {
+		if ((tmp = PyObject_CallMethod(self->timeoutId,
+			    "cancel", NULL)) == NULL) {
 			/* Don't really know what to do. It seems better to
 			 * raise an exception at this point. */
-			Py_CLEAR(timeoutId);
+			Py_CLEAR(self->timeoutId);
 			return -1;
 		}
 		Py_DECREF(tmp);
-		Py_CLEAR(timeoutId);
+		Py_CLEAR(self->timeoutId);
 	}
+	if (self->sess == NULL)
+		return 0;
+	FD_ZERO(&fdset);
+	timerclear(&timeout);
+	snmp_sess_select_info(self->sess, &maxfd, &fdset, &timeout, &block);
 	if (!block) {
 		to = (double)timeout.tv_sec +
 		    (double)timeout.tv_usec/(double)1000000;
-		if ((timeoutId = PyObject_CallMethod(reactor, "callLater", "dO",
-			    to, timeoutFunction)) == NULL) {
+		if ((function = PyObject_GetAttrString((PyObject *)self,
+			    "_timeout")) == NULL)
+			return -1;
+		self->timeoutId = PyObject_CallMethod(reactor, "callLater", "dO",
+		    to, function);
+		Py_DECREF(function);
+		if (self->timeoutId == NULL)
 			return -1;
-		}
 	}
 	return 0;
 }
@@ -176,9 +121,23 @@ Snmp_updatereactor(void)
 static void
 Snmp_dealloc(SnmpObject* self)
 {
-	if (self->ss)
-		snmp_close(self->ss);
-	Snmp_updatereactor();
+	SnmpReaderObject *reader;
+	PyObject *tmp;
+
+	/* A pending timeout keeps a reference to us, there is none. */
+	Py_CLEAR(self->timeoutId);
+	if (self->reader) {
+		reader = (SnmpReaderObject *)self->reader;
+		reader->session = NULL;
+		if ((tmp = PyObject_CallMethod(reactor,
+			    "removeReader", "O", self->reader)) == NULL)
+			PyErr_Clear();
+		else
+			Py_DECREF(tmp);
+		Py_CLEAR(self->reader);
+	}
+	if (self->sess)
+		snmp_sess_close(self->sess);
 	Py_XDECREF(self->defers);
 	self->ob_type->tp_free((PyObject*)self);
 }
@@ -190,8 +149,13 @@ Snmp_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
 
 	self = (SnmpObject *)type->tp_alloc(type, 0);
 	if (self != NULL) {
+		self->sess = NULL;
 		self->ss = NULL;
 		self->defers = NULL;
+		self->reader = NULL;
+		self->timeoutId = NULL;
+		self->tupleoids = 0;
+		self->direct = 0;
 	}
 	return (PyObject *)self;
 }
@@ -206,21 +170,44 @@ Snmp_raise_error(struct snmp_session *session)
 	free(err);
 }
 
+static void
+Snmp_raise_sess_error(void *sess)
+{
+	int liberr, snmperr;
+	char *err;
+	snmp_sess_error(sess, &liberr, &snmperr, &err);
+	PyErr_Format(SnmpException, "%s", err);
+	free(err);
+}
+
 static int
 Snmp_init(SnmpObject *self, PyObject *args, PyObject *kwds)
 {
 	PyObject *host=NULL, *community=NULL;
 	char *chost=NULL, *ccommunity=NULL;
 	int version = 2;
+	int retries = -1;
+	double timeout = -1;
 	struct snmp_session session;
+	netsnmp_transport *transport;
+	SnmpReaderObject *reader;
+	PyObject *tmp;
 
-	static char *kwlist[] = {"ip", "community", "version", NULL};
+	static char *kwlist[] = {"ip", "community", "version",
+				 "tupleoids", "direct", "timeout", "retries",
+				 NULL};
 		
-	if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|i", kwlist, 
-		&host, &community, &version))
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|iiidi", kwlist, 
+		&host, &community, &version, &self->tupleoids, &self->direct,
+		&timeout, &retries))
 		return -1;
 
 	snmp_sess_init(&session);
+	/* Negative values mean net-snmp defaults */
+	if (timeout >= 0)
+		session.timeout = (long)(timeout * 1000000);
+	if (retries >= 0)
+		session.retries = retries;
 	if ((chost = PyString_AsString(host)) == NULL)
 		return -1;
 	switch (version) {
@@ -243,20 +230,53 @@ Snmp_init(SnmpObject *self, PyObject *args, PyObject *kwds)
 		return -1;
 	}
 	if ((session.peername = strdup(chost)) == NULL) {
+		free(session.community);
 		PyErr_NoMemory();
 		return -1;
 	}
-	if ((self->ss = snmp_open(&session)) == NULL) {
+	if ((self->sess = snmp_sess_open(&session)) == NULL) {
 		Snmp_raise_error(&session);
 		free(session.community);
 		free(session.peername);
 		return -1;
 	}
+	/* The session has its own copy of those */
+	free(session.community);
+	free(session.peername);
+	self->ss = snmp_sess_session(self->sess);
 	if ((self->defers = PyDict_New()) == NULL)
-		return -1;
-	if (Snmp_updatereactor() == -1)
-		return -1;
+		goto initerror;
+
+	/* Register a reader for this session. It stays registered until
+	 * the session is closed. */
+	if ((transport = snmp_sess_transport(self->sess)) == NULL) {
+		PyErr_SetString(SnmpException, "unable to get session transport");
+		goto initerror;
+	}
+	if ((reader = (SnmpReaderObject *)
+		PyObject_CallObject((PyObject *)&SnmpReaderType,
+		    NULL)) == NULL)
+		goto initerror;
+	reader->fd = transport->sock;
+	reader->session = self;
+	self->reader = (PyObject *)reader;
+	if ((tmp = PyObject_CallMethod(reactor,
+		    "addReader", "O", self->reader)) == NULL)
+		goto initerror;
+	Py_DECREF(tmp);
 	return 0;
+
+initerror:
+	/* The reader has not been added to the reactor */
+	if (self->reader) {
+		((SnmpReaderObject *)self->reader)->session = NULL;
+		Py_CLEAR(self->reader);
+	}
+	Py_CLEAR(self->defers);
+	snmp_sess_close(self->sess);
+	self->sess = NULL;
+	self->ss = NULL;
+	return -1;
 }
 
 static PyObject*
@@ -341,10 +361,32 @@ Snmp_oid2string(PyObject *resultvalue)
 	return tmp;
 }
 
+/* Fire a callback of a deferred. If direct is false, the callback is
+ * fired on the next reactor turn. */
 static void
-Snmp_invokeerrback(PyObject *defer)
+Snmp_fire(PyObject *defer, char *method, PyObject *arg, int direct)
 {
-	PyObject *type, *value, *traceback, *failure, *tmp;
+	PyObject *tmp, *result;
+
+	if ((tmp = PyObject_GetAttrString(defer, method)) == NULL) {
+		PyErr_WriteUnraisable(defer);
+		return;
+	}
+	if (direct)
+		result = PyObject_CallFunctionObjArgs(tmp, arg, NULL);
+	else
+		result = PyObject_CallMethod(reactor, "callLater",
+		    "iOO", 0, tmp, arg);
+	if (result == NULL)
+		PyErr_WriteUnraisable(defer);
+	Py_XDECREF(result);
+	Py_DECREF(tmp);
+}
+
+static void
+Snmp_invokeerrback(PyObject *defer, int direct)
+{
+	PyObject *type, *value, *traceback, *failure;
 
 	PyErr_Fetch(&type, &value, &traceback);
         if (!traceback)
@@ -354,11 +396,7 @@ Snmp_invokeerrback(PyObject *defer)
                 failure = PyObject_CallMethod(FailureModule,
 		    "Failure", "OOO", value, type, traceback);
 	if (failure != NULL) {
-		if ((tmp = PyObject_GetAttrString(defer, "errback")) != NULL) {
-			Py_DECREF(PyObject_CallMethod(reactor, "callLater",
-				"iOO", 0, tmp, failure));
-			Py_DECREF(tmp);
-		}
+		Snmp_fire(defer, "errback", failure, direct);
 		Py_DECREF(failure);
 	}
 	Py_XDECREF(type);
@@ -507,11 +545,16 @@ Snmp_handle(int operation, netsnmp_session *session, int reqid,
 		if ((resultoid = PyTuple_New(vars->name_length)) == NULL)
 			goto fireexception;
 		for (i = 0; i < vars->name_length; i++) {
-			if ((tmp = PyLong_FromLong(vars->name[i])) == NULL)
+			if (self->tupleoids)
+				tmp = PyInt_FromLong(vars->name[i]);
+			else
+				tmp = PyLong_FromLong(vars->name[i]);
+			if (tmp == NULL)
 				goto fireexception;
 			PyTuple_SetItem(resultoid, i, tmp);
 		}
-		if ((resultoid = Snmp_oid2string(resultoid)) == NULL)
+		if (!self->tupleoids &&
+		    (resultoid = Snmp_oid2string(resultoid)) == NULL)
 			goto fireexception;
 
 		/* Put into dictionary */
@@ -519,17 +562,14 @@ Snmp_handle(int operation, netsnmp_session *session, int reqid,
 		Py_CLEAR(resultoid);
 		Py_CLEAR(resultvalue);
 	}
-	if ((tmp = PyObject_GetAttrString(defer, "callback")) == NULL)
-		goto fireexception;
-	Py_DECREF(PyObject_CallMethod(reactor, "callLater", "iOO", 0, tmp, results));
-	Py_DECREF(tmp);
+	Snmp_fire(defer, "callback", results, self->direct);
 	Py_DECREF(results);
 	Py_DECREF(defer);
 	Py_DECREF(self);
 	return 1;
 
 fireexception:
-	Snmp_invokeerrback(defer);
+	Snmp_invokeerrback(defer, self->direct);
 	Py_XDECREF(results);
 	Py_XDECREF(resultvalue);
 	Py_XDECREF(resultoid);
@@ -681,15 +721,13 @@ Snmp_op(SnmpObject *self, PyObject *args, int op)
 			snmp_add_null_var(pdu, poid, oidlen);
 		}
 	}
-	self->ss->callback = Snmp_handle;
-	self->ss->callback_magic = self;
 	if ((deferred = PyObject_CallMethod(DeferModule,
 		    "Deferred", NULL)) == NULL)
 		goto operror;
-	if (!snmp_send(self->ss, pdu)) {
-		Snmp_raise_error(self->ss);
+	if (!snmp_sess_async_send(self->sess, pdu, Snmp_handle, self)) {
+		Snmp_raise_sess_error(self->sess);
 		/* Instead of raising, we will fire errback */
-		Snmp_invokeerrback(deferred);
+		Snmp_invokeerrback(deferred, 0);
 		Py_DECREF(self);
 		Py_DECREF(oids);
 		if (op == SNMP_MSG_SET) {
@@ -710,7 +748,7 @@ Snmp_op(SnmpObject *self, PyObject *args, int op)
 		goto operror;
 	}
 	Py_DECREF(req);
-	if (Snmp_updatereactor() == -1)
+	if (Snmp_updatetimeout(self) == -1)
 		goto operror;
 	if (op == SNMP_MSG_SET) {
 		Py_DECREF(wvalues);
@@ -838,6 +876,59 @@ Snmp_setversion(SnmpObject *self, PyObject *value, void *closure)
 	return 0;
 }
 
+static PyObject*
+Snmp_gettimeout(SnmpObject *self, void *closure)
+{
+	return PyFloat_FromDouble((double)self->ss->timeout / 1000000);
+}
+
+static int
+Snmp_settimeout(SnmpObject *self, PyObject *value, void *closure)
+{
+	double timeout;
+
+	if (value == NULL) {
+		PyErr_SetString(PyExc_TypeError, "cannot delete timeout");
+		return -1;
+	}
+	timeout = PyFloat_AsDouble(value);
+	if (PyErr_Occurred())
+		return -1;
+	if (timeout <= 0) {
+		PyErr_SetString(PyExc_ValueError, "timeout should be positive");
+		return -1;
+	}
+	/* Only used for requests sent from now on */
+	self->ss->timeout = (long)(timeout * 1000000);
+	return 0;
+}
+
+static PyObject*
+Snmp_getretries(SnmpObject *self, void *closure)
+{
+	return PyInt_FromLong(self->ss->retries);
+}
+
+static int
+Snmp_setretries(SnmpObject *self, PyObject *value, void *closure)
+{
+	long retries;
+
+	if (value == NULL) {
+		PyErr_SetString(PyExc_TypeError, "cannot delete retries");
+		return -1;
+	}
+	retries = PyInt_AsLong(value);
+	if (PyErr_Occurred())
+		return -1;
+	if (retries < 0) {
+		PyErr_SetString(PyExc_ValueError, "retries should not be negative");
+		return -1;
+	}
+	self->ss->retries = retries;
+	return 0;
+}
+
 static PyObject*
 SnmpReader_repr(SnmpReaderObject *self)
 {
@@ -848,9 +939,23 @@ static PyObject*
 SnmpReader_doRead(SnmpReaderObject *self)
 {
 	fd_set fdset;
+	SnmpObject *session = self->session;
+
+	if (session == NULL || session->sess == NULL) {
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	/* Handling responses may release the last reference to the
+	 * session. */
+	Py_INCREF(session);
 	FD_ZERO(&fdset);
 	FD_SET(self->fd, &fdset);
-	snmp_read(&fdset);
+	snmp_sess_read(session->sess, &fdset);
+	if (Snmp_updatetimeout(session) == -1) {
+		Py_DECREF(session);
+		return NULL;
+	}
+	Py_DECREF(session);
 	Py_INCREF(Py_None);
 	return Py_None;
 }
@@ -864,14 +969,6 @@ SnmpReader_fileno(SnmpReaderObject *self)
 static PyObject*
 SnmpReader_connectionLost(PyObject *self, PyObject *args)
 {
-	PyObject *fd;
-	if ((fd = PyInt_FromLong(((SnmpReaderObject*)self)->fd)) == NULL)
-		return NULL;
-	if (PyDict_DelItem(SnmpFds, fd) == -1) {
-		Py_DECREF(fd);
-		return NULL;
-	}
-	Py_DECREF(fd);
 	Py_INCREF(Py_None);
 	return Py_None;
 }
@@ -883,19 +980,23 @@ SnmpReader_logPrefix(SnmpReaderObject *self)
 }
 
 static PyObject*
-SnmpModule_timeout(PyObject *self)
+Snmp_timeout(SnmpObject *self)
 {
-	Py_CLEAR(timeoutId);
-	snmp_timeout();
-	if (Snmp_updatereactor() == -1)
+	Py_CLEAR(self->timeoutId);
+	/* Handling timeouts may release the last reference to us */
+	Py_INCREF(self);
+	if (self->sess)
+		snmp_sess_timeout(self->sess);
+	if (Snmp_updatetimeout(self) == -1) {
+		Py_DECREF(self);
 		return NULL;
+	}
+	Py_DECREF(self);
 	Py_INCREF(Py_None);
 	return Py_None;
 }
 
 static PyMethodDef SnmpModule_methods[] = {
-	{"timeout", (PyCFunction)SnmpModule_timeout,
-	 METH_NOARGS, "Handle SNMP timeout"},
 	{NULL}
 };
 
@@ -908,6 +1009,16 @@ static PyMethodDef Snmp_methods[] = {
 	 METH_VARARGS, "Retrieve an OID value using GETBULK"},
 	{"set", Snmp_set,
 	 METH_VARARGS, "Set an OID value using SET"},
+	{"_timeout", (PyCFunction)Snmp_timeout,
+	 METH_NOARGS, "Handle SNMP timeout for this session"},
+	{NULL}  /* Sentinel */
+};
+
+static PyMemberDef Snmp_members[] = {
+	{"tupleoids", T_INT, offsetof(SnmpObject, tupleoids), 0,
+	 "return OID as tuples of integers instead of strings"},
+	{"direct", T_INT, offsetof(SnmpObject, direct), 0,
+	 "fire deferreds as soon as a response is received"},
 	{NULL}  /* Sentinel */
 };
 
@@ -919,6 +1030,12 @@ static PyGetSetDef Snmp_getseters[] = {
     {"version",
      (getter)Snmp_getversion, (setter)Snmp_setversion,
      "version", NULL},
+    {"timeout",
+     (getter)Snmp_gettimeout, (setter)Snmp_settimeout,
+     "timeout in seconds before retrying a request", NULL},
+    {"retries",
+     (getter)Snmp_getretries, (setter)Snmp_setretries,
+     "number of retries before a request times out", NULL},
     {NULL}  /* Sentinel */
 };
 
@@ -966,7 +1083,7 @@ static PyTypeObject SnmpType = {
 	0,			   /* tp_iter */
 	0,			   /* tp_iternext */
 	Snmp_methods,		   /* tp_methods */
-	0,			   /* tp_members */
+	Snmp_members,		   /* tp_members */
 	Snmp_getseters,		   /* tp_getset */
 	0,                         /* tp_base */
 	0,                         /* tp_dict */
@@ -1073,13 +1190,6 @@ initsnmp(void)
 		if ((reactor =
 			PyImport_ImportModule("twisted.internet.reactor")) == NULL)
 			return;
-	if (SnmpFds == NULL)
-		if ((SnmpFds = PyDict_New()) == NULL)
-			return;
-	if (timeoutFunction == NULL)
-		if ((timeoutFunction = Py_FindMethod(SnmpModule_methods,
-			    m, "timeout")) == NULL)
-			return;
 
 	/* Try to load as less MIB as possible */
 	unsetenv("MIBS");
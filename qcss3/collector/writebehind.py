@@ -0,0 +1,224 @@
+"""
+Write-behind queue between collectors and the database
+
+Results of refreshes are not written at once in their own
+transaction. They are queued and written in batches: a batch is
+written when enough writes are pending or after a short delay. Only
+one batch is written at a time.
+
+Each write is identified by a key C{(lb, vs, rs, status)}. A pending
+write is dropped when a newer write covering it is queued: for
+example, a refresh of a whole load balancer supersedes a pending
+refresh of one of its real servers. A batch contains at most one
+write for each load balancer since timestamps of rows written in the
+same transaction are the same.
+"""
+
+from twisted.internet import defer, reactor
+from twisted.python import failure, log
+
+class WriteBehindQueue:
+    """
+    Queue of pending writes to the database.
+
+    @ivar batched: number of batches written
+    @ivar written: number of writes done
+    @ivar superseded: number of writes dropped because a newer write
+       covers them
+    @ivar failed: number of writes that failed
+    """
+
+    def __init__(self, dbpool, batch=20, delay=0.5, pending=200):
+        """
+        Create a new queue.
+
+        @param dbpool: dbpool to use to run transactions
+        @param batch: maximum number of writes in a transaction
+        @param delay: seconds to wait for more writes before writing
+        @param pending: number of pending writes above which
+           L{ready} waits
+        """
+        self.dbpool = dbpool
+        self.batch = batch
+        self.delay = delay
+        self.limit = pending
+        self.pending = []       # (key, function, args, deferreds)
+        self.writing = []       # Batch being written
+        self.call = None        # Delayed write
+        self.waiting = []       # Deferreds waiting for ready()
+        self.draining = []      # Deferreds waiting for drain()
+        self.batched = 0
+        self.written = 0
+        self.superseded = 0
+        self.failed = 0
+
+    def supersedes(self, new, old):
+        """
+        Tell if a write makes an older one useless.
+
+        @param new: key of the new write
+        @param old: key of the old write
+        @return: C{True} if the new write covers the old one
+        """
+        lb, vs, rs, status = new
+        olb, ovs, ors, ostatus = old
+        if lb != olb:
+            return False
+        if status and not ostatus:
+            # Operational state does not cover a complete write
+            return False
+        if vs is not None and vs != ovs:
+            return False
+        if rs is not None and rs != ors:
+            return False
+        return True
+
+    def write(self, key, function, *args):
+        """
+        Queue a write.
+
+        @param key: C{(lb, vs, rs, status)} identifying what is written
+        @param function: function to call with a transaction and
+           C{args} to write
+        @return: a deferred firing with the result of C{function}
+           once written (or once a newer write covering this one is
+           written)
+        """
+        d = defer.Deferred()
+        deferreds = [d]
+        pending = []
+        for entry in self.pending:
+            if self.supersedes(key, entry[0]):
+                deferreds.extend(entry[3])
+                self.superseded += 1
+            else:
+                pending.append(entry)
+        pending.append((key, function, args, deferreds))
+        self.pending = pending
+        self.schedule()
+        return d
+
+    def schedule(self):
+        """Write a batch now or later, if needed"""
+        if self.writing or not self.pending:
+            return
+        if len(self.pending) >= self.batch or self.draining:
+            self.flush()
+        elif self.call is None:
+            self.call = reactor.callLater(self.delay, self.flush)
+
+    def flush(self):
+        """Write a batch of pending writes"""
+        if self.call is not None:
+            if self.call.active():
+                self.call.cancel()
+            self.call = None
+        if self.writing or not self.pending:
+            return
+        lbs = {}
+        pending = []
+        for entry in self.pending:
+            lb = entry[0][0]
+            if len(self.writing) < self.batch and lb not in lbs:
+                lbs[lb] = True
+                self.writing.append(entry)
+            else:
+                pending.append(entry)
+        self.pending = pending
+        self.release()
+        batch = self.writing
+        d = self.dbpool.runInteraction(self._flush, batch)
+        d.addCallbacks(self.done, lambda x: self.done([(False, x)]*len(batch)))
+
+    def _flush(self, txn, batch):
+        """
+        Run writes of a batch in a transaction.
+
+        Each write is run in a savepoint. A failed write is rolled
+        back without altering the others.
+
+        @return: a list of tuples C{(success, result)}
+        """
+        if len(batch) == 1:
+            key, function, args, deferreds = batch[0]
+            return [(True, function(txn, *args))]
+        results = []
+        for key, function, args, deferreds in batch:
+            txn.execute("SAVEPOINT write")
+            try:
+                result = function(txn, *args)
+            except:
+                results.append((False, failure.Failure()))
+                txn.execute("ROLLBACK TO SAVEPOINT write")
+            else:
+                results.append((True, result))
+                txn.execute("RELEASE SAVEPOINT write")
+        return results
+
+    def done(self, results):
+        """Fire deferreds of a written batch and write the next one"""
+        batch = self.writing
+        self.writing = []
+        self.batched += 1
+        for (success, result), entry in zip(results, batch):
+            self.written += 1
+            if not success:
+                self.failed += 1
+                log.msg("Error while writing %r:\n%s" % (entry[0], result))
+            for d in entry[3]:
+                if success:
+                    d.callback(result)
+                else:
+                    d.errback(result)
+        self.schedule()
+        if not self.pending and not self.writing:
+            draining = self.draining
+            self.draining = []
+            for d in draining:
+                d.callback(None)
+
+    def ready(self):
+        """
+        Wait for the queue to accept more writes.
+
+        @return: a deferred firing when less than C{pending} writes
+           are pending
+        """
+        if len(self.pending) < self.limit:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.waiting.append(d)
+        return d
+
+    def release(self):
+        """Fire deferreds waiting for the queue to be ready"""
+        while self.waiting and len(self.pending) < self.limit:
+            self.waiting.pop(0).callback(None)
+
+    def drain(self):
+        """
+        Write all pending writes without waiting.
+
+        @return: a deferred firing when nothing is pending
+        """
+        if not self.pending and not self.writing:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.draining.append(d)
+        self.schedule()
+        return d
+
+    def state(self):
+        """
+        Get the state of the queue.
+
+        @return: a dictionary with the number of pending writes
+           (C{depth}) and counters
+        """
+        return {'depth': len(self.pending),
+                'writing': len(self.writing),
+                'waiting': len(self.waiting),
+                'batches': self.batched,
+                'written': self.written,
+                'superseded': self.superseded,
+                'failed': self.failed}
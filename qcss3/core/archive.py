@@ -0,0 +1,195 @@
+"""
+Archiving of deleted rows.
+
+Rows that are not alive anymore (C{deleted} is not C{infinity}) are
+moved from live tables to C{_past} tables. Each C{_past} table is
+partitioned by month of deletion with inheritance: a partition
+C{<table>_past_YYYYMM} is created when needed and contains rows
+deleted during this month. Queries on C{_past} tables and C{_full}
+views also see their partitions.
+
+Rows are moved in batches, each batch in its own transaction, to
+keep transactions short. History older than the retention period is
+removed by dropping whole partitions.
+"""
+
+import time
+
+from twisted.internet import defer, task
+from twisted.application import service
+from twisted.python import log
+
+class Archiver:
+    """Move deleted rows to partitions of C{_past} tables"""
+
+    # Tables to archive and their primary keys
+    tables = [("loadbalancer", "name, deleted"),
+              ("virtualserver", "lb, vs, deleted"),
+              ("virtualserver_extra", "lb, vs, key, deleted"),
+              ("realserver", "lb, vs, rs, deleted"),
+              ("realserver_extra", "lb, vs, rs, key, deleted")]
+
+    def __init__(self, dbpool, batch=1000):
+        """
+        Create a new archiver.
+
+        @param dbpool: dbpool to use
+        @param batch: number of rows to move in one transaction. More
+           rows are moved when several rows are deleted at the same time.
+        """
+        self.dbpool = dbpool
+        self.batch = batch
+
+    def partition(self, txn, table, keys, month):
+        """
+        Get the partition of a C{_past} table for a month, creating it
+        if needed.
+
+        @param table: table whose partition should be returned
+        @param keys: primary key of the table
+        @param month: month as C{YYYYMM}
+        @return: name of the partition
+        """
+        name = "%s_past_%s" % (table, month)
+        txn.execute("SELECT 1 FROM pg_tables WHERE tablename=%(name)s",
+                    {'name': name})
+        if txn.fetchall():
+            return name
+        year, month = int(month[:4]), int(month[4:])
+        start = "%04d-%02d-01" % (year, month)
+        if month == 12:
+            end = "%04d-01-01" % (year + 1)
+        else:
+            end = "%04d-%02d-01" % (year, month + 1)
+        txn.execute("CREATE TABLE %s (CHECK (deleted >= '%s'::abstime "
+                    "AND deleted < '%s'::abstime)) "
+                    "INHERITS (%s_past)" % (name, start, end, table))
+        txn.execute("ALTER TABLE %s ADD PRIMARY KEY (%s)" % (name, keys))
+        txn.execute("CREATE INDEX %s_deleted ON %s (deleted)" % (name, name))
+        return name
+
+    def move(self, txn, table, keys, source):
+        """
+        Move a batch of deleted rows to partitions.
+
+        The oldest rows are moved first. Rows deleted during the
+        current second are left alone: an identical row inserted in the
+        same second brings them back to life (see C{doc/database.sql}).
+
+        @param table: table whose rows should be moved
+        @param keys: primary key of the table
+        @param source: table to move rows from (the table itself or
+           C{ONLY <table>_past} for rows archived before partitioning)
+        @return: number of rows moved
+        """
+        where = ("deleted != 'infinity' AND "
+                 "deleted < CURRENT_TIMESTAMP::abstime")
+        params = {}
+        txn.execute("SELECT deleted FROM %s WHERE %s "
+                    "ORDER BY deleted LIMIT 1 OFFSET %d" % (source, where,
+                                                            self.batch - 1))
+        cutoff = txn.fetchall()
+        if cutoff:
+            where = "%s AND deleted <= %%(cutoff)s" % where
+            params['cutoff'] = cutoff[0][0]
+        txn.execute("SELECT DISTINCT to_char(deleted::timestamp, 'YYYYMM') "
+                    "FROM %s WHERE %s" % (source, where), params)
+        for (month,) in txn.fetchall():
+            partition = self.partition(txn, table, keys, month)
+            params['month'] = month
+            txn.execute("INSERT INTO %s SELECT * FROM %s WHERE %s "
+                        "AND to_char(deleted::timestamp, 'YYYYMM') = %%(month)s" % (
+                    partition, source, where), params)
+        txn.execute("DELETE FROM %s WHERE %s" % (source, where), params)
+        return txn.rowcount
+
+    @defer.deferredGenerator
+    def archive(self, legacy=False):
+        """
+        Move all deleted rows to partitions, one batch at a time.
+
+        @param legacy: if C{True}, move rows of C{_past} tables that
+           are not in a partition instead of rows of live tables
+        """
+        for table, keys in self.tables:
+            source = table
+            if legacy:
+                source = "ONLY %s_past" % table
+            total = 0
+            while True:
+                d = defer.waitForDeferred(
+                    self.dbpool.runInteraction(self.move, table, keys, source))
+                yield d
+                moved = d.getResult()
+                total += moved
+                if moved < self.batch:
+                    break
+            if total:
+                log.msg("%d rows archived from %s" % (total, source))
+
+    def drop(self, txn, retention):
+        """
+        Drop partitions older than the retention period.
+
+        A partition is dropped once the whole month is older than the
+        retention period.
+
+        @param retention: number of days of history to keep
+        """
+        limit = time.strftime("%Y%m", time.gmtime(time.time() - retention*86400))
+        for table, keys in self.tables:
+            txn.execute("SELECT c.relname FROM pg_inherits i, pg_class c, pg_class p "
+                        "WHERE i.inhrelid=c.oid AND i.inhparent=p.oid "
+                        "AND p.relname=%(parent)s", {'parent': "%s_past" % table})
+            for (name,) in txn.fetchall():
+                month = name[len("%s_past_" % table):]
+                if len(month) != 6 or not month.isdigit():
+                    continue
+                if month < limit:
+                    log.msg("drop partition %s" % name)
+                    txn.execute("DROP TABLE %s" % name)
+
+class ArchiveService(service.Service):
+    """Service to archive deleted rows periodically"""
+
+    def __init__(self, config, dbpool):
+        """
+        Create a new archiving service.
+
+        @param config: archive configuration section
+        @param dbpool: dbpool
+        """
+        self.config = config
+        self.archiver = Archiver(dbpool, self.config.get("batch", 1000))
+        self.dbpool = dbpool
+        self.setName("Archiver")
+        self.call = None
+        self.inprogress = None
+
+    def startService(self):
+        service.Service.startService(self)
+        self.call = task.LoopingCall(self.archive)
+        self.call.start(self.config.get("interval", 300), now=False)
+
+    def stopService(self):
+        if self.call is not None and self.call.running:
+            self.call.stop()
+        self.call = None
+        return service.Service.stopService(self)
+
+    def archive(self):
+        """
+        Archive deleted rows and drop partitions older than the
+        retention period, if any.
+        """
+        if self.inprogress is not None:
+            return self.inprogress
+        d = self.archiver.archive()
+        retention = self.config.get("retention", 0)
+        if retention:
+            d.addCallback(lambda x: self.dbpool.runInteraction(self.archiver.drop,
+                                                               retention))
+        d.addErrback(lambda x: log.msg("Error while archiving:\n%s" % x))
+        self.inprogress = d
+        d.addBoth(lambda x: setattr(self, "inprogress", None))
+        return d
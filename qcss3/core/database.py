@@ -8,6 +8,8 @@ from twisted.python import log
 from twisted.internet import reactor, defer
 from twisted.enterprise import adbapi
 
+from qcss3.core.archive import Archiver
+
 class Database:
     
     def __init__(self, config):
@@ -107,3 +109,44 @@ CREATE TABLE action (
         d.addCallbacks(lambda _: None,
                        lambda _: self.pool.runInteraction(addpast))
         return d
+
+    def upgradeDatabase_03(self):
+        """add plugin table"""
+
+        def create(txn):
+            """Create plugin table."""
+            txn.execute("""
+CREATE TABLE plugin (
+  lb          text      NOT NULL,
+  oid         text      NOT NULL,
+  description text      NOT NULL,
+  plugins     text      NOT NULL,
+  PRIMARY KEY (lb)
+)""")
+
+        d = self.pool.runOperation("SELECT 1 FROM plugin LIMIT 1")
+        d.addCallbacks(lambda _: None,
+                       lambda _: self.pool.runInteraction(create))
+        return d
+
+    def upgradeDatabase_04(self):
+        """use empty strings instead of NULL in action table"""
+
+        def upgrade(txn):
+            for column in ["vs", "rs"]:
+                txn.execute("UPDATE action SET %s='' WHERE %s IS NULL" % ((column,)*2))
+                txn.execute("ALTER TABLE action ALTER COLUMN %s SET DEFAULT ''" % column)
+                txn.execute("ALTER TABLE action ALTER COLUMN %s SET NOT NULL" % column)
+            # The primary key is enough
+            txn.execute("DROP INDEX action_lb_vs_rs")
+
+        d = self.pool.runQuery("SELECT 1 FROM pg_indexes "
+                               "WHERE indexname='action_lb_vs_rs'")
+        d.addCallback(lambda x: x and self.pool.runInteraction(upgrade) or None)
+        return d
+
+    def upgradeDatabase_05(self):
+        """partition past tables"""
+        # Partitions are created when needed. Move rows archived
+        # before into them.
+        return Archiver(self.pool).archive(legacy=True)
@@ -13,7 +13,9 @@ from twisted.python import log
 from nevow import appserver
 
 from qcss3.core.database import Database
+from qcss3.core.archive import ArchiveService
 from qcss3.collector.service import CollectorService
+from qcss3.collector.scheduler import SchedulerService
 from qcss3.web.web import WebMainPage, MetaWebMainPage
 
 def makeService(config):
@@ -34,6 +36,14 @@ def makeService(config):
     if dbconfig.get('enabled', True):
         dbpool = Database(dbconfig).pool
 
+    # archiving of deleted rows
+    archiver = None
+    if dbpool is not None:
+        archconfig = dbconfig.get('archive', {})
+        if archconfig.get('enabled', True):
+            archiver = ArchiveService(archconfig, dbpool)
+            archiver.setServiceParent(application)
+
     # collector
     collector = None
     if dbpool is not None:
@@ -42,6 +52,14 @@ def makeService(config):
             collector = CollectorService(collconfig, dbpool)
             collector.setServiceParent(application)
 
+    # scheduler
+    scheduler = None
+    if collector is not None:
+        schedconfig = collconfig.get('scheduler', {})
+        if schedconfig:
+            scheduler = SchedulerService(schedconfig, collector, dbpool)
+            scheduler.setServiceParent(application)
+
     # web service
     web = None
     if dbpool is not None and collector is not None:
@@ -65,8 +83,12 @@ def makeService(config):
 
     if dbpool is None:
         reactor.callLater(0, log.msg, "Database has been disabled.")
+    if archiver is None:
+        reactor.callLater(0, log.msg, "Archiver has been disabled.")
     if collector is None:
         reactor.callLater(0, log.msg, "Collector has been disabled.")
+    if scheduler is None:
+        reactor.callLater(0, log.msg, "Scheduler has been disabled.")
     if web is None:
         reactor.callLater(0, log.msg, "Web service has been disabled.")
     if metaweb is None:
@@ -0,0 +1,5 @@
+"""
+Unit tests for QCss3.
+
+Run them with C{trial qcss3.test}.
+"""
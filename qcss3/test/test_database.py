@@ -0,0 +1,55 @@
+"""
+Tests for database writers.
+
+Rows currently in the database are given to writers as L{LiveRows},
+as they would be read by PostgreSQL, and statements are recorded
+instead of being executed.
+"""
+
+from twisted.trial import unittest
+
+from qcss3.collector.datastore import RealServer
+from qcss3.collector.database import IDatabaseWriter, LiveRows, normalize
+
+class RecordingTransaction:
+    """Transaction recording statements"""
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(statement)
+
+    def fetchall(self):
+        return []
+
+class RealServerWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = RealServer("web1", "2001:DB8:0:0::0001", 80, "TCP", 1, "up")
+        self.rs.extra["backup"] = True
+        live = LiveRows()
+        # What PostgreSQL answers for this real server
+        live.realservers["vs1", "rs1"] = normalize(["web1", "2001:db8::1",
+                                                    80, "TCP", 1, "up", False])
+        live.rsextra["vs1", "rs1"] = {"backup": "true"}
+        self.live = live
+        self.txn = RecordingTransaction()
+
+    def write(self):
+        IDatabaseWriter(self.rs).write(self.txn, ("lb1", "vs1", "rs1"), self.live)
+        return [s.split()[0] for s in self.txn.statements]
+
+    def test_unchanged(self):
+        """
+        A real server with an IPv6 address and a boolean extra value
+        is not written again when it has not changed.
+        """
+        self.assertEquals(self.write(), [])
+
+    def test_changedExtra(self):
+        """Only a changed boolean extra value is written again"""
+        self.rs.extra["backup"] = False
+        self.assertEquals(self.write(), ["UPDATE", "INSERT"])
+        for statement in self.txn.statements:
+            self.failUnless("realserver_extra" in statement)
@@ -0,0 +1,69 @@
+"""
+Tests for the SNMP proxy.
+
+Requests are answered from a recording built by each test.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from qcss3.collector.recording import Recorder, Recording, ReplayAgentProxy
+
+class FailingAgentProxy(ReplayAgentProxy):
+    """Proxy whose first request for some OID fails at once"""
+
+    def __init__(self, recording, bad, **kwargs):
+        self.bad = bad
+        ReplayAgentProxy.__init__(self, recording, scale=0, **kwargs)
+
+    def _send(self, request, *args):
+        oids = type(args[0]) is list and args[0] or [args[0]]
+        if self.bad in oids:
+            self.bad = None
+            raise ValueError("unable to build request")
+        return ReplayAgentProxy._send(self, request, *args)
+
+class BatchedGetTestCase(unittest.TestCase):
+
+    oid = ".1.3.6.1.2.1.1.1.0"
+
+    def setUp(self):
+        path = self.mktemp()
+        recorder = Recorder(path, ip="127.0.0.1")
+        recorder.record("get", ([self.oid],),
+                        defer.succeed({self.oid: "Linux"}))
+        recorder.close()
+        self.recording = Recording(path)
+
+    def test_failedSend(self):
+        """
+        A GET whose request cannot be sent fails its callers and does
+        not stay in progress: a later GET of the same OID is sent.
+        """
+        proxy = FailingAgentProxy(self.recording, self.oid, version=2)
+        first = proxy.get(self.oid)
+        second = proxy.get(self.oid)
+        d = defer.DeferredList([first, second], consumeErrors=True)
+
+        def failed(results):
+            for success, result in results:
+                self.failIf(success)
+                result.trap(ValueError)
+            self.assertEquals(proxy._inflight, {})
+            return proxy.get(self.oid)
+        d.addCallback(failed)
+        d.addCallback(self.assertEquals, {self.oid: "Linux"})
+        return d
+
+    def test_badOid(self):
+        """
+        An OID that cannot be parsed fails its caller without
+        failing other GET requests sent with it.
+        """
+        proxy = ReplayAgentProxy(self.recording, scale=0, version=2)
+        bad = proxy.get(".1.3.6.1.2.1.1.x.0")
+        good = proxy.get(self.oid)
+        self.assertFailure(bad, ValueError)
+        d = defer.gatherResults([bad, good])
+        d.addCallback(lambda x: self.assertEquals(x[1], {self.oid: "Linux"}))
+        return d
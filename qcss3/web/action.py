@@ -58,14 +58,14 @@ class ActionMixIn:
                 # If not a dictionary, don't add anything
                 if type(x) is not dict:
                     return x
-                # Otherwise, retrieve list of actions from database
-                params = {'lb': self.lb, 'rs': None, 'vs': None }
-                if hasattr(self, "rs"):
-                    params["rs"] = self.rs
-                if hasattr(self, "vs"):
-                    params["vs"] = self.vs
+                # Otherwise, retrieve list of actions from database. An
+                # empty string stands for a missing virtual server or
+                # real server to use the primary key.
+                params = {'lb': self.lb,
+                          'vs': getattr(self, "vs", None) or '',
+                          'rs': getattr(self, "rs", None) or ''}
                 d = self.dbpool.runQuery("""
-SELECT DISTINCT action, label FROM action
+SELECT action, label FROM action
 WHERE lb = %(lb)s
 AND vs = %(vs)s
 AND rs = %(rs)s
@@ -6,8 +6,8 @@ from nevow import rend, tags as T, loaders
 
 from qcss3.web.timetravel import PastResource, IPastDate, PastConnectionPool
 from qcss3.web.search import SearchResource
-from qcss3.web.equipment import LoadBalancerResource
-from qcss3.web.refresh import RefreshResource
+from qcss3.web.equipment import LoadBalancerResource, AliasesResource
+from qcss3.web.refresh import RefreshResource, WritesResource
 from qcss3.web.common import IApiVersion
 
 class ApiResource(rend.Page):
@@ -62,3 +62,9 @@ class ApiVersionedResource(rend.Page):
 
     def child_refresh(self, ctx):
         return RefreshResource(self.dbpool, self.collector)
+
+    def child_aliases(self, ctx):
+        return AliasesResource(self.collector)
+
+    def child_writes(self, ctx):
+        return WritesResource(self.collector)
@@ -78,3 +78,40 @@ AND deleted='infinity'
     def child_refresh(self, ctx):
         return RefreshResource(self.dbpool, self.collector,
                                self.lb)
+
+    def child_transport(self, ctx):
+        return TransportResource(self.lb, self.collector)
+
+class TransportResource(JsonPage):
+    """
+    Return SNMP transport parameters learned for a load balancer.
+
+    For example::
+      {"bulk": true,
+       "max repetitions": 40,
+       "rtt": 0.012}
+    """
+
+    def __init__(self, lb, collector):
+        self.lb = lb
+        self.collector = collector
+        JsonPage.__init__(self)
+
+    def data_json(self, ctx, data):
+        return self.collector.transport(self.lb)
+
+class AliasesResource(JsonPage):
+    """
+    Return load balancers that are the same agent and collected once.
+
+    Each group of aliases is indexed by the name of the load balancer
+    actually collected. For example::
+      {"lb1.example.net": ["lb1.example.net", "vip.example.net"]}
+    """
+
+    def __init__(self, collector):
+        self.collector = collector
+        JsonPage.__init__(self)
+
+    def data_json(self, ctx, data):
+        return self.collector.aliases()
@@ -169,3 +169,24 @@ class RefreshResource(JsonPage, RefreshMixIn):
     @RefreshMixIn.exist
     def data_json(self, ctx, data):
         return self.refresh(self.lb, self.vs, self.rs)
+
+class WritesResource(JsonPage):
+    """
+    Return the state of the queue of results waiting to be written.
+
+    For example::
+      {"depth": 3,
+       "writing": 10,
+       "waiting": 0,
+       "batches": 120,
+       "written": 1430,
+       "superseded": 12,
+       "failed": 0}
+    """
+
+    def __init__(self, collector):
+        self.collector = collector
+        JsonPage.__init__(self)
+
+    def data_json(self, ctx, data):
+        return self.collector.queue.state()